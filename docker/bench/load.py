@@ -0,0 +1,180 @@
+"""Drive one scenario against an in-process Flask app at a fixed concurrency and measure it."""
+import itertools
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from common.metrics import rss_bytes
+
+MB = 1024 * 1024
+
+
+def percentile(ordered, q):
+    """Linearly interpolated percentile of an already sorted list."""
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def tree_bytes(root):
+    total = 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                # Temp files come and go while we walk
+                pass
+    return total
+
+
+class Sampler:
+    """Peak resident memory and peak size of the scratch directory while a block runs."""
+
+    def __init__(self, root, interval=0.05):
+        self.root = root
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.disk_start = tree_bytes(self.root)
+        self.peak_rss = rss_bytes()
+        self.peak_disk = self.disk_start
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, rss_bytes())
+        self.peak_disk = max(self.peak_disk, tree_bytes(self.root))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        self.disk_end = tree_bytes(self.root)
+
+    def stats(self):
+        return {
+            "peak_rss_mb": round(self.peak_rss / MB, 1),
+            "peak_temp_disk_mb": round(self.peak_disk / MB, 2),
+            "temp_disk_retained_mb": round((self.disk_end - self.disk_start) / MB, 2)
+        }
+
+
+def stage_totals(metrics):
+    """{stage: [seconds, count]} summed over every endpoint, from the service's own Metrics."""
+    totals = {}
+    for name, labels, value in metrics.samples():
+        if name in ("stage_duration_seconds_sum", "stage_duration_seconds_count"):
+            entry = totals.setdefault(labels["stage"], [0.0, 0])
+            entry[0 if name.endswith("_sum") else 1] += value
+    return totals
+
+
+def stage_means(before, after, requests):
+    """Mean milliseconds per request spent in each stage between two stage_totals() snapshots."""
+    means = {}
+    for stage, (seconds, count) in after.items():
+        spent = seconds - before.get(stage, [0.0, 0])[0]
+        if count > before.get(stage, [0.0, 0])[1]:
+            means[stage] = round(spent * 1000 / max(requests, 1), 2)
+    return means
+
+
+class Driver:
+    """Sends a service's scenarios through Flask test clients, one client per worker thread.
+
+    Request numbers keep counting across warmup and concurrency levels, so
+    scenarios that create things (index ids, vocabularies) never collide.
+    """
+
+    def __init__(self, app, metrics, inputs, root):
+        self.app = app
+        self.metrics = metrics
+        self.inputs = inputs
+        self.root = root
+        self.state = {}
+        self._local = threading.local()
+        self._sequence = itertools.count()
+
+    def client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def setup(self, scenario):
+        if scenario.setup:
+            scenario.setup(self.client(), self.state)
+
+    def prepare(self, scenario, n):
+        """Test-client arguments for request n, built before the clock starts."""
+        kwargs = scenario.request(n, self.inputs, self.state)
+        kwargs.setdefault("path", scenario.url(n, self.state))
+        return kwargs
+
+    def call(self, scenario, kwargs):
+        """One request, body read to the end. Returns (seconds, status, error)."""
+        client = self.client()
+        start = time.perf_counter()
+        try:
+            response = client.open(method=scenario.method, buffered=True, **kwargs)
+            status = response.status_code
+            error = None if scenario.ok(status) else response.get_data(as_text=True)[:200]
+            if error is None and scenario.follow:
+                scenario.follow(client, response)
+            response.close()
+        except Exception as e:
+            status, error = None, f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        return time.perf_counter() - start, status, error
+
+    def warmup(self, scenario, requests):
+        for _ in range(requests):
+            self.call(scenario, self.prepare(scenario, next(self._sequence)))
+
+    def run(self, scenario, concurrency, requests):
+        prepared = [self.prepare(scenario, next(self._sequence)) for _ in range(requests)]
+        stages_before = stage_totals(self.metrics)
+        with Sampler(self.root) as sampler, ThreadPoolExecutor(concurrency, thread_name_prefix="bench-client") as pool:
+            start = time.perf_counter()
+            results = list(pool.map(lambda kwargs: self.call(scenario, kwargs), prepared))
+            elapsed = time.perf_counter() - start
+
+        latencies = sorted(seconds * 1000 for seconds, _, error in results if error is None)
+        errors = [error for _, _, error in results if error is not None]
+        statuses = {}
+        for _, status, _ in results:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            "concurrency": concurrency,
+            "requests": requests,
+            "errors": len(errors),
+            "error_sample": errors[0] if errors else None,
+            "statuses": statuses,
+            "seconds": round(elapsed, 3),
+            "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else None,
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+                "p50": _round(percentile(latencies, 50)),
+                "p95": _round(percentile(latencies, 95)),
+                "p99": _round(percentile(latencies, 99)),
+                "max": _round(latencies[-1] if latencies else None)
+            },
+            "stage_ms": stage_means(stages_before, stage_totals(self.metrics), requests),
+            **sampler.stats()
+        }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
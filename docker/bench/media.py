@@ -0,0 +1,89 @@
+"""Deterministic synthetic inputs: photos, speech-like and music-like audio, and short videos.
+
+Everything is generated from a seed, so two runs send byte-identical requests.
+"""
+import io
+import os
+import subprocess
+import numpy as np
+from common.request_io import wav_bytes
+
+
+def image_bytes(width=640, height=480, seed=0, format="PNG"):
+    """A photo-like image: a lit gradient, a few shapes and sensor noise, encoded as PNG or JPEG."""
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    top, bottom = rng.uniform(0, 255, 3), rng.uniform(0, 255, 3)
+    image = top + (bottom - top) * (y / max(height - 1, 1))[..., None]
+    for _ in range(6):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        radius = rng.uniform(0.05, 0.3) * min(width, height)
+        inside = (x - cx) ** 2 + (y - cy) ** 2 < radius ** 2
+        image[inside] = rng.uniform(0, 255, 3)
+    image += rng.normal(0, 6, image.shape)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(buffer, format=format, quality=90)
+    return buffer.getvalue()
+
+
+def speech_samples(seconds=10.0, sample_rate=16000, seed=0):
+    """Voiced bursts with formant-like harmonics separated by pauses, so VAD finds speech and silence."""
+    rng = np.random.default_rng(seed)
+    samples = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+    position = int(rng.uniform(0.1, 0.4) * sample_rate)
+    while position < len(samples):
+        length = min(int(rng.uniform(0.8, 3.0) * sample_rate), len(samples) - position)
+        t = np.arange(length) / sample_rate
+        pitch = rng.uniform(90, 220) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(2, 5) * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+        voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+        envelope = np.abs(np.sin(np.pi * t * rng.uniform(3, 6))) ** 0.5
+        samples[position:position + length] = 0.2 * voice * envelope
+        position += length + int(rng.uniform(0.3, 1.2) * sample_rate)
+    samples += rng.normal(0, 0.002, len(samples)).astype(np.float32)
+    return samples
+
+
+def music_samples(seconds=10.0, sample_rate=44100, channels=2, seed=0):
+    """A chord progression over a kick drum, as (channels, samples)."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    t = np.arange(n) / sample_rate
+    root = 110 * 2 ** (rng.integers(0, 12) / 12)
+    chord = np.zeros(n)
+    for i, start in enumerate(range(0, n, 2 * sample_rate)):
+        span = slice(start, min(start + 2 * sample_rate, n))
+        base = root * 2 ** ([0, 5, 7, 3][i % 4] / 12)
+        chord[span] = sum(np.sin(2 * np.pi * base * ratio * t[span]) for ratio in (1, 1.25, 1.5))
+    beat = t % 0.5
+    kick = np.sin(2 * np.pi * 55 * beat) * np.exp(-beat * 30)
+    # A little noise so every seed is a different file, not one of twelve keys
+    mono = 0.15 * chord + 0.4 * kick + rng.normal(0, 0.002, n)
+    pan = np.linspace(0.3, 0.7, channels)[:, None] if channels > 1 else np.ones((1, 1))
+    return (mono[None] * pan).astype(np.float32)
+
+
+def speech_wav(seconds=10.0, sample_rate=16000, seed=0):
+    return wav_bytes(speech_samples(seconds, sample_rate, seed), sample_rate)
+
+
+def music_wav(seconds=10.0, sample_rate=44100, channels=2, seed=0):
+    return wav_bytes(music_samples(seconds, sample_rate, channels, seed), sample_rate)
+
+
+def video_file(path, seconds=6.0, size=320, seed=0):
+    """An MPEG-4 test pattern with a scene change every two seconds, written with ffmpeg."""
+    if not os.path.exists(path):
+        scenes = ";".join(
+            f"testsrc2=size={size}x{size}:rate=10:duration=2,hue=h={(seed * 37 + i * 90) % 360}[v{i}]"
+            for i in range(int(np.ceil(seconds / 2)))
+        )
+        inputs = "".join(f"[v{i}]" for i in range(int(np.ceil(seconds / 2))))
+        subprocess.run(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-filter_complex",
+             f"{scenes};{inputs}concat=n={int(np.ceil(seconds / 2))}:v=1[out]", "-map", "[out]",
+             "-t", str(seconds), "-pix_fmt", "yuv420p", path],
+            check=True
+        )
+    return path
@@ -0,0 +1,205 @@
+"""CPU benchmark of every AI service, in-process, without GPU, network or model downloads.
+
+Each service's Flask app is imported in its own worker process (the servers
+share module names, and memory is measured per process) and driven through
+test clients at each concurrency level, endpoint by endpoint, with synthetic
+photos, speech, music and video. By default the model libraries are replaced
+with the deterministic stand-ins in bench/stubs.py; `--models real` uses the
+installed libraries with small models from the local cache instead.
+
+Results (throughput, p50/p95/p99 latency, mean time per stage, peak RSS and
+peak scratch-disk use per endpoint and concurrency) are written as JSON;
+pass an earlier file as --baseline to print the change.
+
+    cd docker && python3 -m bench.run --concurrency 1,4 --requests 20 --output bench.json
+    python3 -m bench.run --services whisper,demucs --baseline bench.json --output after.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+DOCKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv=None):
+    from bench.scenarios import SERVICES
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--services", default=",".join(SERVICES), help="Comma separated, default all")
+    parser.add_argument("--endpoints", default="", help="Only scenarios whose name contains one of these (comma separated)")
+    parser.add_argument("--concurrency", default="1,4", help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests per endpoint first (model loads, caches)")
+    parser.add_argument("--distinct", type=int, default=0, help="Cycle through this many different inputs so result caches get hits (0 = a new input per request)")
+    parser.add_argument("--image-size", default="640x480")
+    parser.add_argument("--audio-seconds", type=float, default=20)
+    parser.add_argument("--models", choices=("stub", "real"), default="stub")
+    parser.add_argument("--scale", type=float, default=1.0, help="Stub network depth multiplier")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    return args
+
+
+def worker(args):
+    """Runs inside the service's own process; writes its results to --output."""
+    from bench.scenarios import SERVICES
+    service = SERVICES[args.worker]
+    root = os.environ["TMPDIR"]
+    os.environ.update(service.env(root))
+    os.environ.update(service.stub_env if args.models == "stub" else service.real_env)
+    if args.models == "stub":
+        from bench import stubs
+        stubs.install()
+    sys.path.insert(0, os.path.join(DOCKER_DIR, args.worker))
+
+    import importlib
+    start = time.perf_counter()
+    server = importlib.import_module(service.module)
+    import_seconds = time.perf_counter() - start
+
+    from bench.load import Driver
+    from bench.scenarios import Inputs
+    driver = Driver(server.app, server.metrics, Inputs(root, args), root)
+    wanted = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    results = {"import_seconds": round(import_seconds, 2), "endpoints": {}}
+    for scenario in service.scenarios:
+        if wanted and not any(name in scenario.name for name in wanted):
+            continue
+        print(f"[bench] {service.name} {scenario.name}", flush=True)
+        try:
+            driver.setup(scenario)
+            driver.warmup(scenario, args.warmup)
+            results["endpoints"][scenario.name] = {
+                "method": scenario.method,
+                "path": scenario.path,
+                "levels": [driver.run(scenario, level, args.requests) for level in args.levels]
+            }
+        except Exception as e:
+            # e.g. a scenario that needs what an excluded one creates
+            results["endpoints"][scenario.name] = {"error": f"{type(e).__name__}: {e}"}
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def run_service(name, args, root):
+    """Spawn the worker for one service and return its results (or the error)."""
+    scratch = os.path.join(root, name)
+    os.makedirs(scratch)
+    output = os.path.join(root, f"{name}.json")
+    argv = [sys.executable, "-m", "bench.run", "--worker", name, "--output", output]
+    for flag in ("endpoints", "requests", "warmup", "distinct", "image_size", "audio_seconds", "models"):
+        argv += [f"--{flag.replace('_', '-')}", str(getattr(args, flag))]
+    argv += ["--concurrency", ",".join(map(str, args.levels))]
+    env = {**os.environ, "TMPDIR": scratch, "BENCH_STUB_SCALE": str(args.scale)}
+    if args.models == "real":
+        # Only what is already cached: nothing is downloaded
+        env.update({"HF_HUB_OFFLINE": "1", "TRANSFORMERS_OFFLINE": "1"})
+
+    start = time.perf_counter()
+    completed = subprocess.run(argv, cwd=DOCKER_DIR, env=env)
+    if completed.returncode != 0 or not os.path.exists(output):
+        return {"error": f"Worker exited with code {completed.returncode}"}
+    with open(output) as f:
+        results = json.load(f)
+    results["seconds"] = round(time.perf_counter() - start, 2)
+    return results
+
+
+def rows(results):
+    for service, data in results["services"].items():
+        for endpoint, entry in data.get("endpoints", {}).items():
+            for level in entry.get("levels", []):
+                yield (service, endpoint, level["concurrency"]), level
+
+
+def print_table(results, baseline=None):
+    before = dict(rows(baseline)) if baseline else {}
+    print(f"\n{'service':<9} {'endpoint':<24} {'conc':>4} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rss MB':>8} {'tmp MB':>7} {'err':>4}")
+    for key, level in rows(results):
+        latency = level["latency_ms"]
+        line = (f"{key[0]:<9} {key[1]:<24} {key[2]:>4} {_cell(level['throughput_rps'])} {_cell(latency['p50'], 9)} "
+                f"{_cell(latency['p95'], 9)} {_cell(latency['p99'], 9)} {level['peak_rss_mb']:>8.0f} "
+                f"{level['peak_temp_disk_mb']:>7.1f} {level['errors']:>4}")
+        old = before.get(key)
+        if old and old["throughput_rps"] and level["throughput_rps"] and old["latency_ms"]["p95"] and latency["p95"]:
+            line += (f"   req/s {_change(old['throughput_rps'], level['throughput_rps'])}"
+                     f"  p95 {_change(old['latency_ms']['p95'], latency['p95'])}")
+        print(line)
+    for service, data in results["services"].items():
+        if "error" in data:
+            print(f"{service:<9} {data['error']}")
+        for endpoint, entry in data.get("endpoints", {}).items():
+            if "error" in entry:
+                print(f"{service:<9} {endpoint:<24} {entry['error']}")
+
+
+def _cell(value, width=8):
+    return f"{value:>{width}.2f}" if value is not None else f"{'-':>{width}}"
+
+
+def _change(old, new):
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        worker(args)
+        return
+
+    from bench.scenarios import SERVICES
+    names = [name.strip() for name in args.services.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SERVICES]
+    if unknown:
+        sys.exit(f"Unknown services: {', '.join(unknown)} (choose from {', '.join(SERVICES)})")
+    missing_ffmpeg = not shutil.which("ffmpeg")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    root = tempfile.mkdtemp(prefix="ai-bench-")
+    results = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "models": args.models,
+            "scale": args.scale,
+            "concurrency": args.levels,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "distinct": args.distinct,
+            "image_size": args.image_size,
+            "audio_seconds": args.audio_seconds,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count()
+        },
+        "services": {}
+    }
+    try:
+        for name in names:
+            if missing_ffmpeg and SERVICES[name].needs_ffmpeg:
+                print(f"[bench] Skipping {name}: ffmpeg not found")
+                results["services"][name] = {"error": "ffmpeg not found"}
+                continue
+            print(f"[bench] Benchmarking {name}", flush=True)
+            results["services"][name] = run_service(name, args, root)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_table(results, baseline)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""What to send to each service: its environment, its synthetic inputs and one scenario per endpoint.
+
+A scenario builds the n-th request from the inputs and may prepare shared
+state once before it runs. Every request gets its own input unless
+--distinct is set, in which case inputs repeat and result caches get hits.
+"""
+import io
+import json
+import os
+import time
+import numpy as np
+from bench import media
+
+TAGS = ["beach", "mountains", "city", "cat", "dog", "party", "forest", "sea", "car", "food", "child", "flowers",
+        "snow", "sunset", "building", "friends", "concert", "river", "garden", "kitchen"]
+PROMPTS = ["lofi hip hop beat with soft piano", "upbeat acoustic guitar", "ambient synth pads", "energetic drum and bass"]
+TEXT = ("The album from last summer is ready. It has the photos from the beach and the mountains. "
+        "Everyone can add their own pictures and comments before Friday.")
+
+
+class Inputs:
+    """Synthetic request bodies, generated per request number (or cycling through `distinct` of them)."""
+
+    def __init__(self, root, options):
+        self.root = root
+        self.distinct = options.distinct
+        self.width, self.height = (int(v) for v in options.image_size.lower().split("x"))
+        self.seconds = options.audio_seconds
+
+    def seed(self, n):
+        return n % self.distinct if self.distinct else n
+
+    def image(self, n):
+        return media.image_bytes(self.width, self.height, self.seed(n))
+
+    def speech(self, n, sample_rate=16000, seconds=None):
+        return media.speech_wav(seconds or self.seconds, sample_rate, self.seed(n))
+
+    def music(self, n, sample_rate=44100, channels=2, seconds=None):
+        return media.music_wav(seconds or self.seconds, sample_rate, channels, self.seed(n))
+
+    def video(self, n):
+        seed = self.seed(n)
+        with open(media.video_file(os.path.join(self.root, f"bench-{seed}.mp4"), seed=seed), "rb") as f:
+            return f.read()
+
+    def vectors(self, n, count=1):
+        return np.random.default_rng(self.seed(n)).standard_normal((count, 768)).astype(np.float32).tolist()
+
+
+class Scenario:
+    """One endpoint under load.
+
+    `request(n, inputs, state)` returns test-client keyword arguments,
+    including `path` when it depends on the request.
+    """
+
+    def __init__(self, name, method, path, request=None, ok=None, setup=None, follow=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.request = request or (lambda n, inputs, state: {})
+        self.ok = ok or (lambda status: status < 400)
+        self.setup = setup
+        self.follow = follow
+
+    def url(self, n, state):
+        return self.path.format(n=n, **state)
+
+
+class Service:
+    def __init__(self, name, module, env, scenarios, stub_env=None, real_env=None, needs_ffmpeg=False):
+        self.name = name
+        self.module = module
+        self.env = env
+        self.scenarios = scenarios
+        self.stub_env = stub_env or {}
+        self.real_env = real_env or {}
+        self.needs_ffmpeg = needs_ffmpeg
+
+
+def pick(items, n):
+    return items[n % len(items)]
+
+
+def remember(state, key, values, request):
+    """Record what a request creates so later scenarios can look it up or delete it."""
+    state.setdefault(key, []).extend(values)
+    return request
+
+
+def upload(data, filename):
+    return (io.BytesIO(data), filename)
+
+
+# --- clip -------------------------------------------------------------------------
+
+def clip_dedup_job(client, state):
+    response = client.post("/dedup", json={"threshold": 0.9})
+    state["job"] = response.get_json()["id"]
+
+
+def image_form(n, inputs, **fields):
+    return {"data": {"image": upload(inputs.image(n), f"{n}.png"), **fields}}
+
+
+def images_form(n, inputs, count, **fields):
+    images = [upload(inputs.image(n * count + i), f"{n}_{i}.png") for i in range(count)]
+    return {"data": {"images": images, **fields}}
+
+
+def index_ids(n):
+    return [f"bench-{n}-{k}" for k in range(4)]
+
+
+def take(state, key, count):
+    return [state[key].pop() for _ in range(count)]
+
+
+CLIP = Service(
+    "clip", "clip_server",
+    env=lambda root: {
+        "CLIP_INDEX_DIR": os.path.join(root, "index"),
+        "CLIP_CACHE_DIR": os.path.join(root, "cache"),
+        "CLIP_VOCAB_DIR": os.path.join(root, "vocabularies")
+    },
+    real_env={"CLIP_MODEL": "ViT-B-32/openai"},
+    needs_ffmpeg=True,
+    scenarios=[
+        Scenario("health", "GET", "/health"),
+        Scenario("analyze_fast", "POST", "/analyze", lambda n, i, s: image_form(n, i, mode="fast")),
+        Scenario("analyze_best", "POST", "/analyze", lambda n, i, s: image_form(n, i, mode="best")),
+        Scenario("embed_image", "POST", "/embed", lambda n, i, s: image_form(n, i)),
+        Scenario("embed_text", "POST", "/embed", lambda n, i, s: {"json": {"text": f"{pick(TAGS, n)} number {n}"}}),
+        Scenario("embed_batch", "POST", "/embed/batch", lambda n, i, s: images_form(n, i, 8, texts=json.dumps(TAGS[:8]))),
+        Scenario("similarity", "POST", "/similarity", lambda n, i, s: {"json": {"query": i.vectors(n)[0], "matrix": i.vectors(n + 1, 256), "k": 10}}),
+        Scenario("tags_describe", "POST", "/tags", lambda n, i, s: image_form(n, i)),
+        Scenario("tags_zero_shot", "POST", "/tags", lambda n, i, s: image_form(n, i, tags=json.dumps(TAGS))),
+        Scenario("tags_batch", "POST", "/tags/batch", lambda n, i, s: images_form(n, i, 8, tags=json.dumps(TAGS))),
+        Scenario("vocabulary_list", "GET", "/tags/vocabulary"),
+        Scenario("vocabulary_register", "POST", "/tags/vocabulary",
+                 lambda n, i, s: remember(s, "vocabularies", [f"bench{n}"], {"json": {"name": f"bench{n}", "tags": TAGS}})),
+        Scenario("vocabulary_delete", "DELETE", "/tags/vocabulary/<name>",
+                 lambda n, i, s: {"path": f"/tags/vocabulary/{take(s, 'vocabularies', 1)[0]}"}),
+        Scenario("index_add", "POST", "/index/add", lambda n, i, s: remember(s, "indexed", index_ids(n), images_form(n, i, 4, ids=index_ids(n)))),
+        # Replaces the vectors of items already in the index
+        Scenario("index_upsert", "POST", "/index/upsert", lambda n, i, s: {"json": {"items": [
+            {"id": pick(s["indexed"], 4 * n + k), "embedding": vector} for k, vector in enumerate(i.vectors(n, 4))
+        ]}}),
+        Scenario("index_stats", "GET", "/index/stats"),
+        Scenario("search_text", "POST", "/search", lambda n, i, s: {"json": {"text": pick(TAGS, n), "k": 10}}),
+        Scenario("search_image", "POST", "/search", lambda n, i, s: image_form(n, i, k="10")),
+        Scenario("search_id", "POST", "/search", lambda n, i, s: {"json": {"id": pick(s["indexed"], n), "k": 10}}),
+        Scenario("index_delete", "POST", "/index/delete", lambda n, i, s: {"json": {"ids": take(s, "indexed", 4)}}),
+        Scenario("embed_video", "POST", "/embed/video", lambda n, i, s: {"data": {"video": upload(i.video(n), "bench.mp4"), "mode": "scene"}}),
+        Scenario("dedup", "POST", "/dedup", lambda n, i, s: {"json": {"threshold": 0.9, "wait": True}}),
+        Scenario("dedup_status", "GET", "/dedup/{job}", setup=clip_dedup_job)
+    ]
+)
+
+
+# --- esrgan -----------------------------------------------------------------------
+
+ESRGAN = Service(
+    "esrgan", "esrgan_server",
+    env=lambda root: {"ESRGAN_TILE": "0"},
+    scenarios=[
+        Scenario("health", "GET", "/health"),
+        Scenario("upscale_x2", "POST", "/upscale", lambda n, i, s: image_form(n, i, scale="2")),
+        Scenario("upscale_x4", "POST", "/upscale", lambda n, i, s: image_form(n, i, scale="4")),
+        Scenario("upscale_x4_tiled", "POST", "/upscale", lambda n, i, s: image_form(n, i, scale="4", tile="128")),
+        Scenario("upscale_x4_jpeg", "POST", "/upscale", lambda n, i, s: image_form(n, i, scale="4", format="jpeg")),
+        Scenario("upscale_batch", "POST", "/upscale/batch", lambda n, i, s: images_form(n, i, 4, scale="2")),
+        Scenario("upscale_face", "POST", "/upscale-face", lambda n, i, s: image_form(n, i))
+    ]
+)
+
+
+# --- whisper ----------------------------------------------------------------------
+
+def speech_form(n, inputs, **fields):
+    return {"data": {"audio": upload(inputs.speech(n), f"{n}.wav"), **fields}}
+
+
+WHISPER = Service(
+    "whisper", "whisper_server",
+    env=lambda root: {"WHISPER_PRELOAD": "", "WHISPER_MEDIA_ROOTS": root},
+    # Worker processes import whisper afresh, so with stubs everything runs in this process
+    stub_env={"WHISPER_WORKERS": "1", "WHISPER_MODEL": "base", "WHISPER_MODELS": "tiny,base,small"},
+    real_env={"WHISPER_MODEL": "tiny", "WHISPER_MODELS": "tiny"},
+    needs_ffmpeg=True,
+    scenarios=[
+        Scenario("health", "GET", "/health"),
+        Scenario("health_ready", "GET", "/health/ready", ok=lambda status: status in (200, 503)),
+        Scenario("transcribe", "POST", "/transcribe", lambda n, i, s: speech_form(n, i, vad="false")),
+        Scenario("transcribe_vad", "POST", "/transcribe", lambda n, i, s: speech_form(n, i, vad="true")),
+        Scenario("transcribe_auto", "POST", "/transcribe", lambda n, i, s: speech_form(n, i, model="auto")),
+        Scenario("transcribe_stream", "POST", "/transcribe/stream", lambda n, i, s: speech_form(n, i)),
+        Scenario("transcribe_stream_raw", "POST", "/transcribe/stream",
+                 lambda n, i, s: {"data": i.speech(n), "content_type": "audio/wav"}),
+        Scenario("detect_language", "POST", "/detect-language", lambda n, i, s: speech_form(n, i)),
+        Scenario("detect_language_batch", "POST", "/detect-language/batch", lambda n, i, s: {"data": {
+            "audio": [upload(i.speech(n * 4 + k), f"{k}.wav") for k in range(4)]
+        }})
+    ]
+)
+
+
+# --- xtts -------------------------------------------------------------------------
+
+def xtts_env(root):
+    # One speaker on disk for speaker_id requests
+    speakers = os.path.join(root, "speakers")
+    os.makedirs(speakers, exist_ok=True)
+    with open(os.path.join(speakers, "bench.wav"), "wb") as f:
+        f.write(media.speech_wav(6, 22050, seed=99))
+    return {
+        "XTTS_SPEAKERS_DIR": speakers,
+        "XTTS_LATENTS_DIR": os.path.join(root, "latents"),
+        "XTTS_PRECOMPUTE_SPEAKERS": "0"
+    }
+
+
+XTTS = Service(
+    "xtts", "xtts_server",
+    env=xtts_env,
+    scenarios=[
+        Scenario("health", "GET", "/health"),
+        Scenario("speakers", "GET", "/speakers"),
+        Scenario("synthesize", "POST", "/synthesize", lambda n, i, s: {"json": {"text": TEXT, "language": "en"}}),
+        Scenario("synthesize_speaker", "POST", "/synthesize", lambda n, i, s: {"json": {"text": TEXT, "language": "en", "speaker_id": "bench"}}),
+        Scenario("synthesize_stream", "POST", "/synthesize/stream", lambda n, i, s: {"json": {"text": TEXT, "language": "en", "speaker_id": "bench"}}),
+        Scenario("synthesize_batch", "POST", "/synthesize/batch", lambda n, i, s: {"json": {
+            "lines": [sentence + "." for sentence in TEXT.split(". ")], "language": "en", "speaker_id": "bench"
+        }}),
+        Scenario("clone", "POST", "/clone", lambda n, i, s: {"data": {
+            "audio": upload(i.speech(n, 22050, seconds=6), "reference.wav"), "text": TEXT, "language": "en"
+        }})
+    ]
+)
+
+
+# --- musicgen ---------------------------------------------------------------------
+
+def music_form(n, inputs, sample_rate=44100, channels=2, **fields):
+    return {"data": {"audio": upload(inputs.music(n, sample_rate, channels), f"{n}.wav"), **fields}}
+
+
+MUSICGEN = Service(
+    "musicgen", "musicgen_server",
+    env=lambda root: {},
+    real_env={"MODEL_SIZE": "small"},
+    needs_ffmpeg=True,
+    scenarios=[
+        Scenario("health", "GET", "/health"),
+        Scenario("generate", "POST", "/generate", lambda n, i, s: {"json": {"prompt": pick(PROMPTS, n), "duration": 4}}),
+        Scenario("generate_variations", "POST", "/generate/variations", lambda n, i, s: {"json": {"prompt": pick(PROMPTS, n), "count": 2, "duration": 4}}),
+        Scenario("continue", "POST", "/continue", lambda n, i, s: music_form(n, i, 32000, 1, prompt=pick(PROMPTS, n), duration="4")),
+        Scenario("generate_stream", "POST", "/generate/stream", lambda n, i, s: {"json": {"prompt": pick(PROMPTS, n), "duration": 8}}),
+        Scenario("continue_stream", "POST", "/continue/stream",
+                 lambda n, i, s: music_form(n, i, 32000, 1, prompt=pick(PROMPTS, n), duration="8", format="wav"))
+    ]
+)
+
+
+# --- demucs -----------------------------------------------------------------------
+
+def wait_for_job(client, response):
+    """Poll a chunked separation job until it finishes, so its latency covers the whole job."""
+    job = response.get_json()
+    while job.get("status") == "running":
+        time.sleep(0.05)
+        job = client.get(f"/separate/jobs/{job['id']}").get_json()
+    if job.get("status") != "done":
+        raise RuntimeError(f"Job {job.get('id')} ended with status {job.get('status')}: {job.get('error')}")
+
+
+def demucs_job(client, state):
+    response = client.post("/separate/stream", data={"audio": upload(media.music_wav(8, 44100, 2, seed=999), "job.wav")})
+    wait_for_job(client, response)
+    state["job"] = response.get_json()["id"]
+
+
+DEMUCS = Service(
+    "demucs", "demucs_server",
+    env=lambda root: {
+        "DEMUCS_OUTPUT_DIR": os.path.join(root, "output"),
+        "DEMUCS_CACHE_DIR": os.path.join(root, "cache"),
+        "DEMUCS_MODELS": "htdemucs"
+    },
+    needs_ffmpeg=True,
+    scenarios=[
+        Scenario("health", "GET", "/health"),
+        Scenario("separate", "POST", "/separate", lambda n, i, s: music_form(n, i)),
+        Scenario("separate_two_stems", "POST", "/separate", lambda n, i, s: music_form(n, i, stems="vocals")),
+        Scenario("separate_stem", "POST", "/separate-stem", lambda n, i, s: music_form(n, i, stem="drums")),
+        Scenario("separate_stream", "POST", "/separate/stream", lambda n, i, s: music_form(n, i), follow=wait_for_job),
+        Scenario("job_status", "GET", "/separate/jobs/{job}", setup=demucs_job),
+        Scenario("job_stem", "GET", "/separate/jobs/{job}/vocals", setup=demucs_job)
+    ]
+)
+
+
+SERVICES = {service.name: service for service in (CLIP, ESRGAN, WHISPER, XTTS, MUSICGEN, DEMUCS)}
@@ -0,0 +1,693 @@
+"""Stand-ins for the model libraries the services import, for benchmarking without weights, GPU or network.
+
+`install()` registers fake clip_interrogator, realesrgan, basicsr, gfpgan,
+whisper, TTS, audiocraft and demucs modules before a server is imported.
+Each one has the API surface the servers use and does real tensor work
+shaped like the model it replaces: a patch encoder for CLIP, a
+pixel-shuffle convnet for ESRGAN, an encoder plus per-token decoder loop
+for Whisper, XTTS and MusicGen, and an overlapping chunked convnet for
+Demucs. Cost therefore grows with image size, audio length, token count
+and batch size the way the real models' does, just smaller. Weights are
+seeded from the model name, so outputs are deterministic.
+
+BENCH_STUB_SCALE (default 1) multiplies the depth of every stub network.
+"""
+import math
+import os
+import re
+import sys
+import types
+import wave
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+SCALE = float(os.environ.get("BENCH_STUB_SCALE", "1"))
+
+
+def _depth(layers):
+    return max(1, round(layers * SCALE))
+
+
+def _seeded(name):
+    torch.manual_seed(zlib.crc32(name.encode()))
+
+
+class _Block(nn.Module):
+    """Pre-norm MLP block, the bulk of a transformer layer's FLOPs."""
+
+    def __init__(self, width):
+        super().__init__()
+        self.norm = nn.LayerNorm(width)
+        self.up = nn.Linear(width, width * 4)
+        self.down = nn.Linear(width * 4, width)
+
+    def forward(self, x):
+        return x + self.down(F.gelu(self.up(self.norm(x))))
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+# --- CLIP (clip_interrogator) -------------------------------------------------
+
+_FLAVORS = [
+    f"{a} {b}" for a in ("a photo of", "a painting of", "a close-up of", "a landscape with", "a portrait of", "a drawing of",
+                         "a blurry photo of", "a bright photo of", "an old photo of", "a render of")
+    for b in ("a cat", "a dog", "a beach", "mountains", "a city street", "a birthday party", "a forest", "the sea",
+              "a car", "food on a table", "a child", "flowers", "snow", "a sunset", "a building", "friends", "a concert",
+              "a river", "a garden", "a kitchen")
+]
+
+
+class _ClipModel(nn.Module):
+    def __init__(self, name, width=256, embed=768):
+        super().__init__()
+        _seeded(name)
+        self.patch = nn.Conv2d(3, width, 16, stride=16)
+        self.image_blocks = nn.Sequential(*[_Block(width) for _ in range(_depth(4))])
+        self.image_proj = nn.Linear(width, embed)
+        self.token_embedding = nn.Embedding(49408, width)
+        self.text_blocks = nn.Sequential(*[_Block(width) for _ in range(_depth(3))])
+        self.text_proj = nn.Linear(width, embed)
+        self.logit_scale = nn.Parameter(torch.tensor(math.log(100.0)))
+
+    def encode_image(self, images):
+        x = self.patch(images.float()).flatten(2).transpose(1, 2)
+        return self.image_proj(self.image_blocks(x).mean(1))
+
+    def encode_text(self, tokens):
+        x = self.text_blocks(self.token_embedding(tokens))
+        # Features at the end-of-text token, like CLIP
+        return self.text_proj(x[torch.arange(len(tokens)), tokens.argmax(-1)])
+
+
+class _ClipConfig:
+    def __init__(self, clip_model_name="ViT-L-14/openai", device="cpu", **kwargs):
+        self.clip_model_name = clip_model_name
+        self.device = device
+        self.__dict__.update(kwargs)
+
+
+class _Interrogator:
+    MEAN = torch.tensor([0.481, 0.458, 0.408])[:, None, None]
+    STD = torch.tensor([0.269, 0.261, 0.276])[:, None, None]
+
+    def __init__(self, config):
+        self.config = config
+        self.device = "cpu"
+        self.clip_model = _ClipModel(config.clip_model_name).eval()
+        # Like clip_interrogator, the label embeddings are computed when the model loads
+        with torch.no_grad():
+            self.flavors = F.normalize(self.clip_model.encode_text(self.tokenize(_FLAVORS)), dim=-1)
+
+    def clip_preprocess(self, image):
+        from PIL import Image
+        image = image.convert("RGB")
+        scale = 224 / min(image.size)
+        image = image.resize((max(224, round(image.width * scale)), max(224, round(image.height * scale))), Image.BICUBIC)
+        left, top = (image.width - 224) // 2, (image.height - 224) // 2
+        pixels = np.asarray(image.crop((left, top, left + 224, top + 224)), dtype=np.float32) / 255
+        return (torch.from_numpy(pixels).permute(2, 0, 1) - self.MEAN) / self.STD
+
+    def tokenize(self, texts):
+        tokens = torch.zeros(len(texts), 77, dtype=torch.long)
+        for i, text in enumerate(texts):
+            ids = [49406] + [b + 1 for b in text.lower().encode()[:75]] + [49407]
+            tokens[i, :len(ids)] = torch.tensor(ids)
+        return tokens
+
+    def image_to_features(self, image):
+        with torch.no_grad():
+            return F.normalize(self.clip_model.encode_image(self.clip_preprocess(image)[None]), dim=-1)
+
+    def _rank(self, features, count):
+        scores = (features @ self.flavors.T)[0]
+        return [_FLAVORS[i] for i in scores.topk(count).indices.tolist()]
+
+    def _caption(self, features, tokens=20):
+        # Autoregressive caption decoder (BLIP in the real interrogator)
+        state = features[0]
+        weight = self.clip_model.text_proj.weight
+        for _ in range(tokens):
+            state = torch.tanh(weight @ (weight.T @ state))
+        return self._rank(state[None], 1)[0]
+
+    def interrogate_fast(self, image, max_flavors=32):
+        return ", ".join(self._rank(self.image_to_features(image), min(max_flavors, 8)))
+
+    def interrogate_classic(self, image, max_flavors=3):
+        features = self.image_to_features(image)
+        return ", ".join([self._caption(features)] + self._rank(features, max_flavors))
+
+    def interrogate(self, image, min_flavors=8, max_flavors=32):
+        features = self.image_to_features(image)
+        caption = self._caption(features, 40)
+        # The real "best" mode re-encodes growing prompt chains against the image
+        chain = [caption]
+        for flavor in self._rank(features, min_flavors):
+            with torch.no_grad():
+                self.clip_model.encode_text(self.tokenize([", ".join(chain + [flavor])]))
+            chain.append(flavor)
+        return ", ".join(chain)
+
+
+# --- Real-ESRGAN, basicsr, GFPGAN ---------------------------------------------
+
+class _RRDBNet(nn.Module):
+    def __init__(self, num_in_ch=3, num_out_ch=3, scale=4, num_feat=64, num_block=23, num_grow_ch=32):
+        super().__init__()
+        _seeded(f"rrdbnet-x{scale}")
+        self.scale = scale
+        # Like RRDBNet, x2 and x1 pixel-unshuffle their input and upsample x4 from there
+        self.unshuffle = {1: 4, 2: 2}.get(scale, 1)
+        self.upscale = scale * self.unshuffle
+        feat = num_feat // 2
+        self.conv_first = nn.Conv2d(num_in_ch * self.unshuffle ** 2, feat, 3, padding=1)
+        self.body = nn.Sequential(*[
+            layer for _ in range(_depth(num_block // 8))
+            for layer in (nn.Conv2d(feat, feat, 3, padding=1), nn.LeakyReLU(0.2))
+        ])
+        self.conv_last = nn.Conv2d(feat, num_out_ch * self.upscale ** 2, 3, padding=1)
+
+    def forward(self, x):
+        base = F.interpolate(x, scale_factor=self.scale, mode="bilinear", align_corners=False)
+        if self.unshuffle > 1:
+            x = F.pixel_unshuffle(x, self.unshuffle)
+        feat = self.conv_first(x)
+        residual = F.pixel_shuffle(self.conv_last(feat + self.body(feat)), self.upscale)
+        return base + 0.05 * torch.tanh(residual)
+
+
+class _RealESRGANer:
+    def __init__(self, scale, model_path=None, model=None, tile=0, tile_pad=10, pre_pad=10, half=False, device=None, gpu_id=None):
+        self.scale = scale
+        self.model = (model or _RRDBNet(scale=scale)).eval()
+        self.tile_size = tile
+        self.tile_pad = tile_pad
+        self.pre_pad = pre_pad
+        self.half = half
+        self.device = torch.device("cpu")
+
+    def enhance(self, img, outscale=None, alpha_upsampler="realesrgan"):
+        import cv2
+        h, w = img.shape[:2]
+        max_value = 65535.0 if img.dtype == np.uint16 else 255.0
+        alpha = None
+        if img.ndim == 2:
+            rgb = np.repeat(img[..., None], 3, axis=2)
+        elif img.shape[2] == 4:
+            rgb, alpha = img[..., :3], img[..., 3]
+        else:
+            rgb = img
+        mod = self.model.unshuffle
+        pad_h, pad_w = (-h) % mod, (-w) % mod
+        tensor = torch.from_numpy(np.ascontiguousarray(rgb[..., ::-1], dtype=np.float32) / max_value).permute(2, 0, 1)[None]
+        if pad_h or pad_w:
+            tensor = F.pad(tensor, (0, pad_w, 0, pad_h), mode="replicate")
+        with torch.no_grad():
+            out = self.model(tensor)[0, :, :h * self.scale, :w * self.scale]
+        out = (out.clamp(0, 1) * max_value).round().permute(1, 2, 0).numpy()[..., ::-1].astype(img.dtype)
+        if img.ndim == 2:
+            out = out[..., 0]
+        elif alpha is not None:
+            out = np.dstack([out, cv2.resize(alpha, (w * self.scale, h * self.scale), interpolation=cv2.INTER_LINEAR)])
+        if outscale and outscale != self.scale:
+            out = cv2.resize(out, (int(w * outscale), int(h * outscale)), interpolation=cv2.INTER_LANCZOS4)
+        return out, "RGBA" if alpha is not None else "RGB"
+
+
+class _GFPGANer:
+    def __init__(self, model_path=None, upscale=2, arch="clean", channel_multiplier=2, bg_upsampler=None):
+        _seeded("gfpgan")
+        self.upscale = upscale
+        self.bg_upsampler = bg_upsampler
+        self.restorer = nn.Sequential(*[
+            layer for channels in ((3, 32), (32, 32), (32, 32), (32, 3))
+            for layer in (nn.Conv2d(*channels, 3, padding=1), nn.LeakyReLU(0.2))
+        ][:-1]).eval()
+
+    def enhance(self, img, has_aligned=False, only_center_face=False, paste_back=True, weight=0.5):
+        import cv2
+        h, w = img.shape[:2]
+        if self.bg_upsampler is not None:
+            output = self.bg_upsampler.enhance(img, outscale=self.upscale)[0]
+        else:
+            output = cv2.resize(img, (w * self.upscale, h * self.upscale), interpolation=cv2.INTER_LANCZOS4)
+        # One "face": the centre crop, restored at 512x512 and pasted back
+        size = min(h, w) // 2
+        y, x = (h - size) // 2, (w - size) // 2
+        color = img if img.ndim == 3 else np.repeat(img[..., None], 3, axis=2)
+        face = cv2.resize(color[y:y + size, x:x + size, :3], (512, 512), interpolation=cv2.INTER_LINEAR)
+        tensor = torch.from_numpy(face.astype(np.float32) / 255).permute(2, 0, 1)[None]
+        with torch.no_grad():
+            restored = (tensor + 0.05 * torch.tanh(self.restorer(tensor))).clamp(0, 1)
+        restored = (restored[0].permute(1, 2, 0).numpy() * 255).round().astype(np.uint8)
+        if paste_back:
+            s = size * self.upscale
+            output[y * self.upscale:y * self.upscale + s, x * self.upscale:x * self.upscale + s, :3] = cv2.resize(restored, (s, s))
+        return [face], [restored], output
+
+
+# --- Whisper --------------------------------------------------------------------
+
+_WHISPER_SIZES = {"tiny": (384, 2), "base": (512, 3), "small": (768, 4), "medium": (1024, 6), "large": (1280, 8), "turbo": (1280, 4)}
+_LANGUAGES = ["en", "fr", "de", "es", "it", "pt", "nl", "ja", "zh", "ru"]
+_WORDS = ("the photo album was shared with the family after the holiday and everyone "
+          "liked the pictures from the beach the mountains and the old town").split()
+WHISPER_SAMPLE_RATE = 16000
+WHISPER_N_SAMPLES = 30 * WHISPER_SAMPLE_RATE
+
+
+def _mel_filters(n_mels, n_fft=400, sample_rate=WHISPER_SAMPLE_RATE):
+    mel = lambda f: 2595 * np.log10(1 + f / 700)
+    points = 700 * (10 ** (np.linspace(mel(0), mel(sample_rate / 2), n_mels + 2) / 2595) - 1)
+    bins = np.fft.rfftfreq(n_fft, 1 / sample_rate)
+    filters = np.zeros((n_mels, len(bins)), dtype=np.float32)
+    for i in range(n_mels):
+        low, centre, high = points[i:i + 3]
+        filters[i] = np.clip(np.minimum((bins - low) / (centre - low), (high - bins) / (high - centre)), 0, None)
+    return torch.from_numpy(filters)
+
+
+def _log_mel_spectrogram(audio, n_mels=80, padding=0, device=None):
+    audio = torch.as_tensor(np.asarray(audio, dtype=np.float32) if not torch.is_tensor(audio) else audio).float()
+    if padding:
+        audio = F.pad(audio, (0, padding))
+    stft = torch.stft(audio, 400, 160, window=torch.hann_window(400), return_complex=True)
+    power = stft[..., :-1].abs() ** 2
+    log_spec = torch.clamp(_mel_filters(n_mels) @ power, min=1e-10).log10()
+    log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
+    return (log_spec + 4.0) / 4.0
+
+
+def _pad_or_trim(array, length=WHISPER_N_SAMPLES, axis=-1):
+    if torch.is_tensor(array):
+        if array.shape[axis] > length:
+            return array.narrow(axis, 0, length)
+        return F.pad(array, (0, length - array.shape[axis]))
+    array = np.asarray(array)
+    if array.shape[axis] > length:
+        return array.take(range(length), axis=axis)
+    widths = [(0, 0)] * array.ndim
+    widths[axis] = (0, length - array.shape[axis])
+    return np.pad(array, widths)
+
+
+class _WhisperDims:
+    def __init__(self, n_mels, n_audio_state):
+        self.n_mels = n_mels
+        self.n_audio_state = n_audio_state
+
+
+class _Whisper(nn.Module):
+    def __init__(self, name):
+        super().__init__()
+        _seeded(f"whisper-{name}")
+        width, layers = _WHISPER_SIZES.get(name.split(".")[0].split("-")[0], (512, 3))
+        n_mels = 128 if "v3" in name or name == "turbo" else 80
+        self.name = name
+        self.dims = _WhisperDims(n_mels, width)
+        self.is_multilingual = not name.endswith(".en")
+        self.conv1 = nn.Conv1d(n_mels, width, 3, padding=1)
+        self.conv2 = nn.Conv1d(width, width, 3, stride=2, padding=1)
+        self.encoder = nn.Sequential(*[_Block(width) for _ in range(_depth(layers))])
+        self.decoder = nn.Linear(width, width)
+        self.head = nn.Linear(width, 4096)
+        self.language_head = nn.Linear(width, len(_LANGUAGES))
+        self.eval()
+
+    @property
+    def device(self):
+        return torch.device("cpu")
+
+    def _encode(self, mel):
+        with torch.no_grad():
+            x = F.gelu(self.conv2(F.gelu(self.conv1(mel))))
+            return self.encoder(x.transpose(1, 2))
+
+    def _language_probs(self, features):
+        probs = F.softmax(self.language_head(features.mean(1)), dim=-1)
+        return [dict(zip(_LANGUAGES, row.tolist())) for row in probs]
+
+    def detect_language(self, mel):
+        batched = mel.ndim == 3
+        probs = self._language_probs(self._encode(mel if batched else mel[None]))
+        tokens = [max(p, key=p.get) for p in probs]
+        return (tokens, probs) if batched else (tokens[0], probs[0])
+
+    def transcribe(self, audio, language=None, initial_prompt=None, verbose=None, **options):
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        segments = []
+        for start in range(0, max(len(audio), 1), WHISPER_N_SAMPLES):
+            window = audio[start:start + WHISPER_N_SAMPLES]
+            features = self._encode(_log_mel_spectrogram(_pad_or_trim(window), self.dims.n_mels)[None])
+            if language is None:
+                probs = self._language_probs(features)[0]
+                language = max(probs, key=probs.get)
+            # About three tokens per second of speech, decoded one at a time against the encoder output
+            energy = np.sqrt(np.mean(window[:len(window) // 160 * 160].reshape(-1, 160) ** 2, axis=1)) if len(window) >= 160 else np.zeros(0)
+            speech = float(np.mean(energy > 0.01)) * len(window) / WHISPER_SAMPLE_RATE if len(energy) else 0.0
+            tokens = []
+            state = features.mean(1)[0]
+            with torch.no_grad():
+                for _ in range(int(speech * 3)):
+                    state = torch.tanh(self.decoder(state) + features[0, len(tokens) % features.shape[1]])
+                    tokens.append(int(self.head(state).argmax()))
+            offset = start / WHISPER_SAMPLE_RATE
+            duration = len(window) / WHISPER_SAMPLE_RATE
+            for i in range(0, len(tokens), 15):
+                chunk = tokens[i:i + 15]
+                segment_start = offset + duration * i / max(len(tokens), 1)
+                segments.append({
+                    "id": len(segments),
+                    "seek": start // 160,
+                    "start": round(segment_start, 2),
+                    "end": round(min(offset + duration, segment_start + duration * len(chunk) / max(len(tokens), 1)), 2),
+                    "text": " " + " ".join(_WORDS[t % len(_WORDS)] for t in chunk),
+                    "tokens": chunk,
+                    "temperature": 0.0,
+                    "avg_logprob": -0.3,
+                    "compression_ratio": 1.4,
+                    "no_speech_prob": 0.02
+                })
+        return {"text": "".join(s["text"] for s in segments), "segments": segments, "language": language or "en"}
+
+
+def _load_whisper(name, device=None, download_root=None, in_memory=False):
+    return _Whisper(name)
+
+
+# --- XTTS (TTS.api) -------------------------------------------------------------
+
+class _XttsConfig:
+    temperature = 0.75
+    length_penalty = 1.0
+    repetition_penalty = 5.0
+    top_k = 50
+    top_p = 0.85
+
+
+def _read_wav(path):
+    try:
+        with wave.open(path, "rb") as w:
+            pcm = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2").astype(np.float32) / 32768
+            return pcm.reshape(-1, w.getnchannels()).mean(1), w.getframerate()
+    except (wave.Error, EOFError):
+        with open(path, "rb") as f:
+            return np.frombuffer(f.read(), dtype=np.uint8).astype(np.float32) / 128 - 1, 22050
+
+
+class _Xtts(nn.Module):
+    def __init__(self, width=1024):
+        super().__init__()
+        _seeded("xtts")
+        self.reference = nn.Linear(1024, width)
+        self.latent = nn.Linear(width, 32)
+        self.gpt = nn.Sequential(*[_Block(width) for _ in range(_depth(3))])
+        self.vocoder = nn.Linear(width, 1024)
+        self.width = width
+
+    def get_conditioning_latents(self, audio_path, gpt_cond_len=30, gpt_cond_chunk_len=6, max_ref_length=10, sound_norm_refs=False, **kwargs):
+        paths = audio_path if isinstance(audio_path, list) else [audio_path]
+        frames = []
+        for path in paths:
+            samples, sample_rate = _read_wav(path)
+            samples = samples[:int(max_ref_length * sample_rate)]
+            samples = np.pad(samples, (0, (-len(samples)) % 1024))
+            frames.append(torch.from_numpy(samples.reshape(-1, 1024)))
+        with torch.no_grad():
+            reference = self.gpt(self.reference(torch.cat(frames))[None]).mean(1)
+            gpt_cond_latent = self.latent(reference)[:, :, None] * reference[:, None]
+        return gpt_cond_latent, reference[:, :512, None].contiguous()
+
+    def inference(self, text, language, gpt_cond_latent, speaker_embedding, temperature=0.75, length_penalty=1.0,
+                  repetition_penalty=5.0, top_k=50, top_p=0.85, **kwargs):
+        # One GPT step per character, then a vocoder frame of 1024 samples per step
+        state = gpt_cond_latent.mean(1)
+        frames = []
+        with torch.no_grad():
+            for i in range(max(1, len(text))):
+                state = self.gpt(state[:, None] + gpt_cond_latent[:, i % 32, None])[:, 0]
+                frames.append(self.vocoder(state))
+        pitch = 120 + 40 * float(torch.sigmoid(speaker_embedding.mean()))
+        t = np.arange(len(frames) * 1024) / 24000
+        envelope = np.repeat(torch.sigmoid(torch.cat(frames)[:, 0]).numpy(), 1024)
+        return {"wav": (0.4 * envelope * np.sin(2 * np.pi * pitch * t)).astype(np.float32)}
+
+
+class _Synthesizer:
+    output_sample_rate = 24000
+
+    def __init__(self):
+        self.tts_model = _Xtts().eval()
+        self.tts_config = _XttsConfig()
+        self._default_latents = None
+
+    def split_into_sentences(self, text):
+        return [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()]
+
+    def default_latents(self):
+        if self._default_latents is None:
+            self._default_latents = (torch.zeros(1, 32, self.tts_model.width), torch.zeros(1, 512, 1))
+        return self._default_latents
+
+
+class _TTS:
+    def __init__(self, model_name=None, progress_bar=True, gpu=False):
+        self.model_name = model_name
+        self.synthesizer = _Synthesizer()
+
+    def to(self, device):
+        return self
+
+    def tts(self, text, speaker=None, language=None, speaker_wav=None, **kwargs):
+        if speaker_wav:
+            latents = self.synthesizer.tts_model.get_conditioning_latents(audio_path=speaker_wav if isinstance(speaker_wav, list) else [speaker_wav])
+        else:
+            latents = self.synthesizer.default_latents()
+        wav = []
+        for sentence in self.synthesizer.split_into_sentences(text):
+            wav.extend(self.synthesizer.tts_model.inference(sentence, language, *latents)["wav"].tolist())
+            wav.extend([0.0] * 10000)
+        return wav
+
+
+# --- MusicGen (audiocraft) ------------------------------------------------------
+
+_MUSICGEN_SIZES = {"small": (512, 3), "medium": (768, 4), "large": (1024, 6), "melody": (768, 4)}
+
+
+class _MusicGenLM(nn.Module):
+    def __init__(self, name, width, layers):
+        super().__init__()
+        _seeded(f"musicgen-{name}")
+        self.text = nn.Embedding(256, width)
+        self.blocks = nn.Sequential(*[_Block(width) for _ in range(_depth(layers))])
+        # Four EnCodec codebooks per frame
+        self.heads = nn.Linear(width, 4 * 2048)
+        self.codes = nn.Embedding(4 * 2048, width)
+
+
+class _MusicGen:
+    sample_rate = 32000
+    frame_rate = 50
+    device = "cpu"
+
+    def __init__(self, name):
+        key = next((size for size in _MUSICGEN_SIZES if size in name), "small")
+        width, layers = _MUSICGEN_SIZES[key]
+        self.name = name
+        self.audio_channels = 2 if "stereo" in name else 1
+        self.lm = _MusicGenLM(name, width, layers).eval()
+        self.duration = 30.0
+        self.generation_params = {}
+        self._progress = None
+
+    @staticmethod
+    def get_pretrained(name="facebook/musicgen-small", device=None):
+        return _MusicGen(name)
+
+    def set_generation_params(self, use_sampling=True, top_k=250, top_p=0.0, temperature=1.0, duration=30.0,
+                              cfg_coef=3.0, two_step_cfg=False, extend_stride=18):
+        self.duration = duration
+        self.generation_params = {"use_sampling": use_sampling, "top_k": top_k, "top_p": top_p,
+                                  "temperature": temperature, "cfg_coef": cfg_coef}
+
+    def set_custom_progress_callback(self, progress_callback=None):
+        self._progress = progress_callback
+
+    def _conditioning(self, descriptions):
+        tokens = [[b for b in (d or "").encode()[:64]] or [0] for d in descriptions]
+        with torch.no_grad():
+            return torch.stack([self.lm.text(torch.tensor(t)).mean(0) for t in tokens])
+
+    def _generate(self, descriptions, prompt_frames=0):
+        total = int(self.duration * self.frame_rate)
+        condition = self._conditioning(descriptions)
+        # Classifier-free guidance runs a conditioned and an unconditioned copy of the batch
+        state = torch.cat([condition, torch.zeros_like(condition)])
+        frames = []
+        with torch.no_grad():
+            for step in range(prompt_frames, total):
+                hidden = self.lm.blocks(state[:, None])[:, 0]
+                logits = self.lm.heads(hidden)
+                cond, uncond = logits.chunk(2)
+                codes = (uncond + self.generation_params.get("cfg_coef", 3.0) * (cond - uncond)).argmax(-1)
+                state = hidden + self.lm.codes(codes).repeat(2, 1)
+                frames.append(cond[:, :8])
+                if self._progress:
+                    self._progress(step + 1, total)
+        return self._decode(torch.stack(frames, -1) if frames else torch.zeros(len(descriptions), 8, 0), prompt_frames)
+
+    def _decode(self, frames, offset):
+        # 640 samples per frame, a tone whose pitch follows the generated codes
+        samples_per_frame = self.sample_rate // self.frame_rate
+        pitch = 110 * 2 ** (torch.sigmoid(frames[:, 0]) * 3)
+        pitch = pitch.repeat_interleave(samples_per_frame, -1)
+        phase = 2 * math.pi * torch.cumsum(pitch, -1) / self.sample_rate
+        t0 = offset * samples_per_frame
+        wav = 0.3 * torch.sin(phase + t0) * torch.sigmoid(frames[:, 1]).repeat_interleave(samples_per_frame, -1)
+        return wav[:, None].repeat(1, self.audio_channels, 1)
+
+    def generate(self, descriptions, progress=False, return_tokens=False):
+        return self._generate(descriptions)
+
+    def generate_with_chroma(self, descriptions, melody_wavs, melody_sample_rate, progress=False, return_tokens=False):
+        # Chroma extraction over the melody before generating
+        melody = torch.as_tensor(melody_wavs).float().reshape(-1)
+        if melody.numel() >= 4096:
+            torch.stft(melody, 4096, 1024, window=torch.hann_window(4096), return_complex=True).abs()
+        return self._generate(descriptions)
+
+    def generate_continuation(self, prompt, prompt_sample_rate, descriptions=None, progress=False, return_tokens=False):
+        descriptions = descriptions or [None] * prompt.shape[0]
+        prompt_frames = int(prompt.shape[-1] / prompt_sample_rate * self.frame_rate)
+        new = self._generate(descriptions, prompt_frames)
+        return torch.cat([prompt.float().cpu(), new], -1)
+
+
+def _normalize_audio(wav, normalize=True, strategy="peak", peak_clip_headroom_db=1, rms_headroom_db=18,
+                     loudness_headroom_db=14, loudness_compressor=False, log_clipping=False, sample_rate=None, stem_name=None):
+    if not normalize:
+        return wav
+    if strategy == "peak":
+        return wav / max(float(wav.abs().max()), 1e-8) * 10 ** (-peak_clip_headroom_db / 20)
+    headroom = loudness_headroom_db if strategy == "loudness" else rms_headroom_db
+    rms = float(wav.pow(2).mean().sqrt())
+    return (wav / max(rms, 1e-8) * 10 ** (-headroom / 20)).clamp(-1, 1)
+
+
+# --- Demucs ---------------------------------------------------------------------
+
+class _Separator(nn.Module):
+    def __init__(self, name):
+        super().__init__()
+        _seeded(f"demucs-{name}")
+        self.name = name
+        self.sources = ["drums", "bass", "other", "vocals"]
+        self.samplerate = 44100
+        self.audio_channels = 2
+        self.segment = 7.8
+        width = 48
+        self.encoder = nn.Conv1d(2, width, 8, stride=4, padding=2)
+        self.body = nn.Sequential(*[
+            layer for _ in range(_depth(3)) for layer in (nn.Conv1d(width, width, 3, padding=1), nn.GELU())
+        ])
+        self.decoder = nn.ConvTranspose1d(width, len(self.sources) * 2, 8, stride=4, padding=2)
+        self.eval()
+
+    def forward(self, mix):
+        hidden = F.gelu(self.encoder(mix))
+        masks = torch.sigmoid(self.decoder(hidden + self.body(hidden)))[..., :mix.shape[-1]]
+        masks = masks.reshape(mix.shape[0], len(self.sources), 2, -1)
+        masks = masks / masks.sum(1, keepdim=True)
+        return masks * mix[:, None]
+
+
+def _get_demucs(name, repo=None):
+    return _Separator(name)
+
+
+def _apply_model(model, mix, shifts=1, split=True, overlap=0.25, transition_power=1.0, progress=False, device=None,
+                 num_workers=0, segment=None, pool=None):
+    """(batch, channels, samples) -> (batch, sources, channels, samples), with demucs' shift and split logic."""
+    length = mix.shape[-1]
+    if shifts:
+        max_shift = int(0.5 * model.samplerate)
+        padded = F.pad(mix, (max_shift, max_shift))
+        out = 0
+        generator = np.random.default_rng(0)
+        for _ in range(shifts):
+            offset = int(generator.integers(0, max_shift))
+            shifted = padded[..., offset:offset + length + max_shift]
+            separated = _apply_model(model, shifted, 0, split, overlap, transition_power, False, device, num_workers, segment)
+            out = out + separated[..., max_shift - offset:max_shift - offset + length]
+        return out / shifts
+    if not split:
+        with torch.no_grad():
+            return model(mix)
+
+    chunk = int((segment or model.segment) * model.samplerate)
+    stride = max(1, int((1 - overlap) * chunk))
+    offsets = list(range(0, max(length - chunk, 0) + stride, stride))
+    ramp = torch.cat([torch.arange(1, chunk // 2 + 1), torch.arange(chunk - chunk // 2, 0, -1)]).float() ** transition_power
+
+    def run(offset):
+        piece = mix[..., offset:offset + chunk]
+        with torch.no_grad():
+            return offset, model(F.pad(piece, (0, chunk - piece.shape[-1])))[..., :piece.shape[-1]]
+
+    if num_workers:
+        with ThreadPoolExecutor(num_workers) as executor:
+            pieces = list(executor.map(run, offsets))
+    else:
+        pieces = [run(offset) for offset in offsets]
+    out = torch.zeros(mix.shape[0], len(model.sources), mix.shape[1], length)
+    weights = torch.zeros(length)
+    for offset, piece in pieces:
+        n = piece.shape[-1]
+        out[..., offset:offset + n] += piece * ramp[:n]
+        weights[offset:offset + n] += ramp[:n]
+    return out / weights.clamp(min=1e-8)
+
+
+def install():
+    """Register the stub modules; real packages that are already imported are left alone."""
+    if "clip_interrogator" not in sys.modules:
+        _module("clip_interrogator", Config=_ClipConfig, Interrogator=_Interrogator)
+
+    if "realesrgan" not in sys.modules:
+        _module("realesrgan", RealESRGANer=_RealESRGANer)
+        _module("basicsr")
+        _module("basicsr.archs")
+        _module("basicsr.archs.rrdbnet_arch", RRDBNet=_RRDBNet)
+        _module("gfpgan", GFPGANer=_GFPGANer)
+
+    if "whisper" not in sys.modules:
+        audio = _module("whisper.audio", SAMPLE_RATE=WHISPER_SAMPLE_RATE, CHUNK_LENGTH=30, N_SAMPLES=WHISPER_N_SAMPLES,
+                        HOP_LENGTH=160, N_FRAMES=3000)
+        _module("whisper", audio=audio, load_model=_load_whisper, log_mel_spectrogram=_log_mel_spectrogram,
+                pad_or_trim=_pad_or_trim, available_models=lambda: list(_WHISPER_SIZES))
+
+    if "TTS" not in sys.modules:
+        _module("TTS")
+        _module("TTS.api", TTS=_TTS)
+
+    if "audiocraft" not in sys.modules:
+        _module("audiocraft")
+        _module("audiocraft.models", MusicGen=_MusicGen)
+        _module("audiocraft.data")
+        _module("audiocraft.data.audio_utils", normalize_audio=_normalize_audio)
+
+    if "demucs" not in sys.modules:
+        _module("demucs")
+        _module("demucs.pretrained", get_model=_get_demucs)
+        _module("demucs.apply", apply_model=_apply_model)
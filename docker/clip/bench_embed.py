@@ -0,0 +1,90 @@
+"""Measure /embed throughput of a running CLIP server.
+
+Compares sequential single /embed calls, concurrent single /embed calls (which the
+server micro-batches) and /embed/batch. Only uses the standard library.
+
+The server caches embeddings by image content, so every request sends the image
+with a unique trailer that decoders ignore: each one is a cache miss.
+
+    python3 bench_embed.py --image photo.jpg --count 64 --concurrency 16
+"""
+import argparse
+import json
+import time
+import uuid
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def multipart(files):
+    boundary = uuid.uuid4().hex
+    body = b""
+    for field, name, data in files:
+        body += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode() + data + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def post(url, files):
+    body, content_type = multipart(files)
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+    with urllib.request.urlopen(req) as resp:
+        return json.loads(resp.read())
+
+
+def unique(data):
+    # Bytes after the end of a PNG/JPEG are ignored when decoding but change the cache key
+    return data + f"bench-{uuid.uuid4().hex}".encode()
+
+
+def run(label, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count / elapsed:8.2f} images/s  ({elapsed:.2f}s)")
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8060")
+    parser.add_argument("--image", required=True)
+    parser.add_argument("--count", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        data = f.read()
+
+    def single():
+        return [("image", "bench.png", unique(data))]
+
+    # Warm up so model loading is not counted
+    post(f"{args.url}/embed", single())
+
+    def sequential():
+        for _ in range(args.count):
+            post(f"{args.url}/embed", single())
+
+    def concurrent():
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(lambda _: post(f"{args.url}/embed", single()), range(args.count)))
+
+    def batched():
+        for start in range(0, args.count, args.batch_size):
+            n = min(args.batch_size, args.count - start)
+            post(f"{args.url}/embed/batch", [("images", f"{i}.png", unique(data)) for i in range(n)])
+
+    base = run("sequential /embed", args.count, sequential)
+    run(f"concurrent /embed (x{args.concurrency})", args.count, concurrent)
+    best = run(f"/embed/batch (size {args.batch_size})", args.count, batched)
+    print(f"batch speedup vs sequential: {best / base:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,146 +1,723 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from clip_interrogator import Config, Interrogator
 from PIL import Image
-import tempfile
+from batching import MicroBatcher, chunked
+from vector_index import VectorIndex, DuplicateIdError
+from result_cache import ResultCache, content_key
+from dedup import DedupJobs
+from tagging import VocabularyStore, Vocabulary, DEFAULT_TEMPLATE
+from video_frames import iter_keyframes
+from common.request_io import decode_pool, decode_image
+from common.model_cache import ModelCache
+from common.serving import Gates
+from common.metrics import Metrics
+import vector_codec
 import os
+import tempfile
+import json
+import numpy as np
 import torch
 
 app = Flask(__name__)
 CORS(app)
+metrics = Metrics(app, "clip")
+
+CLIP_MODEL = os.environ.get("CLIP_MODEL", "ViT-L-14/openai")
+
+BATCH_MAX_SIZE = int(os.environ.get("CLIP_BATCH_MAX_SIZE", 32))
+BATCH_MAX_WAIT_MS = float(os.environ.get("CLIP_BATCH_MAX_WAIT_MS", 10))
+BATCH_MAX_ITEMS = int(os.environ.get("CLIP_BATCH_MAX_ITEMS", 256))
+INDEX_DIR = os.environ.get("CLIP_INDEX_DIR", "/app/index")
+INDEX_DTYPE = os.environ.get("CLIP_INDEX_DTYPE", "float16")
+CACHE_DIR = os.environ.get("CLIP_CACHE_DIR", "/root/.cache/clip-results")
+CACHE_MEMORY_MB = int(os.environ.get("CLIP_CACHE_MEMORY_MB", 64))
+CACHE_DISK_MB = int(os.environ.get("CLIP_CACHE_DISK_MB", 1024))
+VOCAB_DIR = os.environ.get("CLIP_VOCAB_DIR", "/root/.cache/clip-vocabularies")
+VIDEO_FRAME_SIZE = int(os.environ.get("CLIP_VIDEO_FRAME_SIZE", 224))
+VIDEO_MAX_FRAMES = int(os.environ.get("CLIP_VIDEO_MAX_FRAMES", 2000))
+# Colon-separated directories that local video paths must live under (empty = local paths are refused)
+MEDIA_ROOTS = [os.path.realpath(p) for p in os.environ.get("CLIP_MEDIA_ROOTS", "").split(":") if p]
+
+# Memory-mapped, so opening is cheap regardless of how many vectors are stored
+index = VectorIndex(INDEX_DIR, INDEX_DTYPE)
+
+dedup_jobs = DedupJobs(index)
+
+# Results keyed by image content, so rescans and renames of unchanged media cost only a hash
+result_cache = ResultCache(CACHE_DIR, CACHE_MEMORY_MB << 20, CACHE_DISK_MB << 20)
 
-interrogator = None
+# Interrogation (CLIP + BLIP captioning) is heavy and runs a few at a time; embedding
+# requests are let through a batch at a time so the micro-batchers can still fill up
+interrogate_gates = Gates.from_env("CLIP_INTERROGATE", concurrency=1, queue_size=8)
+embed_gates = Gates.from_env("CLIP_EMBED", concurrency=BATCH_MAX_SIZE, queue_size=BATCH_MAX_SIZE * 2)
 
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({
         "status": "ok",
         "service": "clip",
-        "loaded": interrogator is not None,
-        "gpu": torch.cuda.is_available()
+        "loaded": models.is_loaded(CLIP_MODEL),
+        "gpu": torch.cuda.is_available(),
+        "batching": {
+            "image": image_batcher.stats(),
+            "text": text_batcher.stats()
+        },
+        "index": index.stats(),
+        "cache": result_cache.stats(),
+        "vocabularies": vocabularies.stats(),
+        "admission": {
+            "interrogate": interrogate_gates.stats(),
+            "embed": embed_gates.stats()
+        }
     })
 
+def load_interrogator(clip_model_name):
+    print("Loading CLIP Interrogator...")
+    config = Config(
+        clip_model_name=clip_model_name,
+        device="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    return Interrogator(config)
+
+# Single-flight: concurrent cold requests wait for one load instead of each loading the model
+models = ModelCache(load_interrogator, name="clip")
+
+metrics.instrument_models(models)
+metrics.collect("cache", result_cache.stats)
+metrics.collect("admission_interrogate", interrogate_gates.stats, label="model")
+metrics.collect("admission_embed", embed_gates.stats, label="model")
+
 def get_interrogator():
-    global interrogator
-    if interrogator is None:
-        print("Loading CLIP Interrogator...")
-        config = Config(
-            clip_model_name="ViT-L-14/openai",
-            device="cuda" if torch.cuda.is_available() else "cpu"
-        )
-        interrogator = Interrogator(config)
-    return interrogator
+    return models.get(CLIP_MODEL)
+
+def _autocast(ci):
+    return torch.autocast(device_type="cuda", enabled=ci.device == "cuda")
+
+def preprocess_image(image):
+    return get_interrogator().clip_preprocess(image)
+
+def tokenize_text(text):
+    return get_interrogator().tokenize([text])[0]
+
+def encode_image_batch(tensors):
+    # One forward pass for the whole batch; rows come back L2-normalised like image_to_features
+    ci = get_interrogator()
+    if hasattr(ci, "_prepare_clip"):
+        ci._prepare_clip()
+    images = torch.stack(tensors).to(ci.device)
+    with torch.no_grad(), _autocast(ci):
+        features = ci.clip_model.encode_image(images)
+        features /= features.norm(dim=-1, keepdim=True)
+    return features.float().cpu()
+
+def encode_text_batch(tokens):
+    ci = get_interrogator()
+    if hasattr(ci, "_prepare_clip"):
+        ci._prepare_clip()
+    text = torch.stack(tokens).to(ci.device)
+    with torch.no_grad(), _autocast(ci):
+        features = ci.clip_model.encode_text(text)
+        features /= features.norm(dim=-1, keepdim=True)
+    return features.float().cpu()
+
+# Tag vocabularies are encoded once into a text-embedding matrix and reused
+vocabularies = VocabularyStore(VOCAB_DIR, lambda prompts: embed_texts(prompts).numpy(), CLIP_MODEL)
+
+# Concurrent single /embed calls are grouped into one forward pass
+image_batcher = MicroBatcher(encode_image_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, name="clip-image-batcher")
+text_batcher = MicroBatcher(encode_text_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, name="clip-text-batcher")
+metrics.collect("batching", lambda: {"image": image_batcher.stats(), "text": text_batcher.stats()}, label="batcher")
+metrics.collect("index", index.stats)
+
+def prepare_image(data):
+    # Decode + resize/normalise; runs on the shared decode pool
+    return preprocess_image(decode_image(data))
+
+def describe(data, mode):
+    key = content_key(data, CLIP_MODEL, "describe", mode)
+    description = result_cache.get(key)
+    if description is None:
+        with metrics.stage("decode"):
+            image = decode_pool.run(decode_image, data)
+        ci = get_interrogator()
+        with metrics.stage("inference"):
+            if mode == "best":
+                description = ci.interrogate(image)
+            elif mode == "classic":
+                description = ci.interrogate_classic(image)
+            else:
+                description = ci.interrogate_fast(image)
+        result_cache.put(key, description)
+    return description
+
+def embed_image_data(datas):
+    # Cached rows are reused; only the misses go through the model
+    keys = [content_key(data, CLIP_MODEL, "embed") for data in datas]
+    embeddings = [result_cache.get(key) for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    # The pool decodes the next chunk while the current one runs through the model
+    tensors = decode_pool.map(prepare_image, [datas[i] for i in missing], prefetch=BATCH_MAX_SIZE)
+    for chunk in chunked(missing, BATCH_MAX_SIZE):
+        with metrics.stage("decode"):
+            batch = [next(tensors) for _ in chunk]
+        with metrics.stage("inference"):
+            computed = encode_image_batch(batch)
+        for i, embedding in zip(chunk, computed.numpy()):
+            embeddings[i] = embedding.tolist()
+            result_cache.put(keys[i], embeddings[i])
+    return embeddings
+
+def logit_scale():
+    scale = getattr(get_interrogator().clip_model, "logit_scale", None)
+    return float(scale.exp()) if scale is not None else 100.0
+
+def embed_texts(texts):
+    features = []
+    for chunk in chunked(texts, BATCH_MAX_SIZE):
+        with metrics.stage("inference"):
+            features.append(encode_text_batch([tokenize_text(text) for text in chunk]))
+    return torch.cat(features) if features else torch.empty(0)
 
 @app.route("/analyze", methods=["POST"])
+@interrogate_gates.admit(CLIP_MODEL)
 def analyze():
     if "image" not in request.files:
         return jsonify({"error": "No image file provided"}), 400
     
-    image_file = request.files["image"]
+    data = request.files["image"].read()
     mode = request.form.get("mode", "fast")  # fast, classic, best
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as f:
-        image_file.save(f.name)
+    try:
+        result = describe(data, mode)
         
-        try:
-            image = Image.open(f.name).convert("RGB")
-            ci = get_interrogator()
-            
-            if mode == "best":
-                result = ci.interrogate(image)
-            elif mode == "classic":
-                result = ci.interrogate_classic(image)
-            else:
-                result = ci.interrogate_fast(image)
-            
-            return jsonify({
-                "description": result,
-                "mode": mode
-            })
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-        finally:
-            os.unlink(f.name)
+        return jsonify({
+            "description": result,
+            "mode": mode
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _output_format():
+    # format=json|base64|binary and dtype=float32|float16, from the query string, form or JSON body
+    data = request.get_json(silent=True) if request.is_json else None
+    source = data if isinstance(data, dict) else request.form
+    fmt = request.args.get("format") or source.get("format", "json")
+    dtype = request.args.get("dtype") or source.get("dtype", "float32")
+    vector_codec.check_format(fmt, dtype)
+    return fmt, dtype
+
+def _encode_vectors(array, fmt, dtype):
+    if fmt == "json":
+        return np.asarray(array).tolist()
+    return vector_codec.to_base64(array, dtype)
+
+def _binary_response(array, dtype, headers=None):
+    return Response(vector_codec.pack(array, dtype), mimetype=vector_codec.BINARY_MIMETYPE, headers=headers)
 
 @app.route("/embed", methods=["POST"])
+@embed_gates.admit(CLIP_MODEL)
 def embed():
-    ci = get_interrogator()
+    try:
+        fmt, dtype = _output_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     if "image" in request.files:
-        image_file = request.files["image"]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as f:
-            image_file.save(f.name)
-            try:
-                image = Image.open(f.name).convert("RGB")
-                embedding = ci.image_to_features(image)
-                return jsonify({
-                    "embedding": embedding.cpu().numpy().tolist(),
-                    "type": "image"
-                })
-            finally:
-                os.unlink(f.name)
-    
-    elif request.json and "text" in request.json:
+        data = request.files["image"].read()
+        key = content_key(data, CLIP_MODEL, "embed")
+        embedding = result_cache.get(key)
+        if embedding is None:
+            with metrics.stage("decode"):
+                tensor = decode_pool.run(prepare_image, data)
+            with metrics.stage("inference"):
+                embedding = image_batcher(tensor).numpy().tolist()
+            result_cache.put(key, embedding)
+        embedding_type = "image"
+    
+    elif request.is_json and request.json and "text" in request.json:
         text = request.json["text"]
-        embedding = ci.text_to_features(text)
+        with metrics.stage("inference"):
+            embedding = text_batcher(tokenize_text(text)).numpy()
+        embedding_type = "text"
+    
+    else:
+        return jsonify({"error": "No image or text provided"}), 400
+    
+    embedding = np.asarray(embedding, dtype=np.float32)[None]
+    if fmt == "binary":
+        return _binary_response(embedding, dtype, {"X-Embedding-Type": embedding_type})
+    return jsonify({
+        "embedding": _encode_vectors(embedding, fmt, dtype),
+        "type": embedding_type
+    })
+
+def _batch_texts():
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        return list(data.get("texts", []))
+    texts = request.form.getlist("texts")
+    # Multipart clients may also send a single JSON-encoded list
+    if len(texts) == 1 and texts[0].startswith("["):
+        return list(json.loads(texts[0]))
+    return texts
+
+@app.route("/embed/batch", methods=["POST"])
+@embed_gates.admit(CLIP_MODEL)
+def embed_batch():
+    image_files = request.files.getlist("images")
+    try:
+        texts = _batch_texts()
+    except ValueError:
+        return jsonify({"error": "texts must be a JSON list of strings"}), 400
+    try:
+        fmt, dtype = _output_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if not image_files and not texts:
+        return jsonify({"error": "No images or texts provided"}), 400
+    if len(image_files) + len(texts) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} items per batch"}), 400
+    
+    try:
+        image_embeddings = embed_image_data([image_file.read() for image_file in image_files])
+        text_embeddings = embed_texts(texts).numpy()
+        
+        if fmt == "binary":
+            # Rows are the images in upload order followed by the texts in request order
+            matrix = np.asarray(list(image_embeddings) + list(text_embeddings), dtype=np.float32)
+            return _binary_response(matrix, dtype, {
+                "X-Image-Count": str(len(image_files)),
+                "X-Text-Count": str(len(texts))
+            })
+        
         return jsonify({
-            "embedding": embedding.cpu().numpy().tolist(),
-            "type": "text"
+            "images": [
+                {"name": image_file.filename, "embedding": _encode_vectors(embedding, fmt, dtype)}
+                for image_file, embedding in zip(image_files, image_embeddings)
+            ],
+            "texts": [
+                {"text": text, "embedding": _encode_vectors(embedding, fmt, dtype)}
+                for text, embedding in zip(texts, text_embeddings)
+            ],
+            "count": len(image_files) + len(texts)
         })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _similarity_inputs():
+    # Binary bodies carry two frames (query, matrix) and take options from the query string
+    if request.mimetype == vector_codec.BINARY_MIMETYPE:
+        arrays = vector_codec.unpack_all(request.get_data())
+        if len(arrays) != 2:
+            raise ValueError("Binary body must contain exactly two arrays: query and matrix")
+        return arrays[0], arrays[1], request.args, True
     
-    return jsonify({"error": "No image or text provided"}), 400
+    data = request.get_json(silent=True)
+    if not data:
+        raise ValueError("No JSON data provided")
+    if "matrix" in data:
+        return vector_codec.decode(data.get("query", [])), vector_codec.decode(data["matrix"]), data, True
+    return vector_codec.decode(data.get("embedding1", [])), vector_codec.decode(data.get("embedding2", [])), data, False
 
 @app.route("/similarity", methods=["POST"])
 def similarity():
-    data = request.json
-    if not data:
-        return jsonify({"error": "No JSON data provided"}), 400
-    
-    embedding1 = torch.tensor(data.get("embedding1", []))
-    embedding2 = torch.tensor(data.get("embedding2", []))
+    try:
+        query, matrix, options, one_vs_many = _similarity_inputs()
+        fmt, dtype = _output_format()
+        k = options.get("k")
+        k = int(k) if k is not None else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    if embedding1.numel() == 0 or embedding2.numel() == 0:
+    if query.size == 0 or matrix.size == 0:
         return jsonify({"error": "Invalid embeddings"}), 400
     
-    similarity = torch.nn.functional.cosine_similarity(
-        embedding1.unsqueeze(0),
-        embedding2.unsqueeze(0)
-    ).item()
+    query = torch.from_numpy(query.reshape(-1))
+    matrix = torch.from_numpy(matrix.reshape(-1, matrix.shape[-1]))
+    if matrix.shape[1] != query.numel():
+        return jsonify({"error": f"Matrix rows must have {query.numel()} dimensions"}), 400
+    
+    # One vectorised call for all N rows
+    scores = torch.nn.functional.cosine_similarity(matrix, query.unsqueeze(0), dim=1)
     
-    return jsonify({"similarity": similarity})
+    if not one_vs_many:
+        return jsonify({"similarity": scores[0].item()})
+    
+    if k is not None:
+        if k < 1:
+            return jsonify({"error": "k must be at least 1"}), 400
+        top = torch.topk(scores, min(k, scores.numel()))
+        return jsonify({
+            "top_k": [
+                {"index": i, "score": score}
+                for i, score in zip(top.indices.tolist(), top.values.tolist())
+            ],
+            "count": scores.numel()
+        })
+    
+    if fmt == "binary":
+        return _binary_response(scores.numpy(), dtype)
+    return jsonify({
+        "scores": _encode_vectors(scores.numpy(), fmt, dtype),
+        "count": scores.numel()
+    })
 
 @app.route("/tags", methods=["POST"])
 def generate_tags():
     if "image" not in request.files:
         return jsonify({"error": "No image file provided"}), 400
     
-    image_file = request.files["image"]
+    try:
+        vocabulary = _request_vocabulary(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Zero-shot tagging is one embedding, so it must not queue behind interrogations
+    if vocabulary is not None:
+        return _zero_shot_tags(vocabulary)
+    return _described_tags()
+
+@embed_gates.admit(CLIP_MODEL)
+def _zero_shot_tags(vocabulary):
+    data = request.files["image"].read()
+    
+    try:
+        # One image embedding against the cached vocabulary matrix
+        max_tags = int(request.form.get("max_tags", 10))
+        min_probability = float(request.form.get("min_probability", 0))
+        scored = vocabularies.score(embed_image_data([data]), vocabulary, max_tags, logit_scale(), min_probability)[0]
+        return jsonify({
+            "tags": [t["tag"] for t in scored],
+            "scored_tags": scored,
+            "vocabulary": vocabulary.describe()
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@interrogate_gates.admit(CLIP_MODEL)
+def _described_tags():
+    data = request.files["image"].read()
     max_tags = int(request.form.get("max_tags", 10))
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as f:
-        image_file.save(f.name)
+    try:
+        # Get description and extract tags (shares the cached /analyze fast result)
+        description = describe(data, "fast")
         
-        try:
-            image = Image.open(f.name).convert("RGB")
-            ci = get_interrogator()
-            
-            # Get description and extract tags
-            description = ci.interrogate_fast(image)
-            
-            # Parse tags from description
-            tags = [tag.strip() for tag in description.split(",")][:max_tags]
-            
-            return jsonify({
-                "tags": tags,
-                "full_description": description
-            })
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-        finally:
-            os.unlink(f.name)
+        # Parse tags from description
+        tags = [tag.strip() for tag in description.split(",")][:max_tags]
+        
+        return jsonify({
+            "tags": tags,
+            "full_description": description
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _request_vocabulary(source):
+    # A registered vocabulary by name, or an inline "tags" list (JSON-encoded in multipart forms)
+    name = source.get("vocabulary")
+    if name:
+        vocabulary = vocabularies.get(name)
+        if vocabulary is None:
+            raise ValueError(f"Unknown vocabulary: {name}")
+        return vocabulary
+    tags = source.get("tags")
+    if not tags:
+        return None
+    if isinstance(tags, str):
+        tags = json.loads(tags) if tags.startswith("[") else tags.split(",")
+    return Vocabulary(tags, source.get("template") or DEFAULT_TEMPLATE)
+
+@app.route("/tags/batch", methods=["POST"])
+@embed_gates.admit(CLIP_MODEL)
+def generate_tags_batch():
+    image_files = request.files.getlist("images")
+    if not image_files:
+        return jsonify({"error": "No image files provided"}), 400
+    if len(image_files) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} images per batch"}), 400
+    
+    try:
+        vocabulary = _request_vocabulary(request.form)
+        max_tags = int(request.form.get("max_tags", 10))
+        min_probability = float(request.form.get("min_probability", 0))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if vocabulary is None:
+        return jsonify({"error": "Provide a vocabulary name or a tags list"}), 400
+    
+    try:
+        embeddings = embed_image_data([image_file.read() for image_file in image_files])
+        scored = vocabularies.score(embeddings, vocabulary, max_tags, logit_scale(), min_probability)
+        return jsonify({
+            "results": [
+                {"name": image_file.filename, "tags": [t["tag"] for t in tags], "scored_tags": tags}
+                for image_file, tags in zip(image_files, scored)
+            ],
+            "vocabulary": vocabulary.describe()
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/tags/vocabulary", methods=["GET"])
+def list_vocabularies():
+    return jsonify({"vocabularies": vocabularies.names()})
+
+@app.route("/tags/vocabulary", methods=["POST"])
+def register_vocabulary():
+    data = request.get_json(silent=True) or {}
+    try:
+        vocabulary = vocabularies.register(data.get("name"), data.get("tags") or [], data.get("template") or DEFAULT_TEMPLATE)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify(vocabulary.describe())
+
+@app.route("/tags/vocabulary/<name>", methods=["DELETE"])
+def delete_vocabulary(name):
+    if not vocabularies.delete(name):
+        return jsonify({"error": f"Unknown vocabulary: {name}"}), 404
+    return jsonify({"deleted": name})
+
+def _parse_media(value):
+    if value in (None, ""):
+        return None
+    return json.loads(value) if isinstance(value, str) else value
+
+def _index_payload():
+    # Multipart: "images" (or "image") files with matching "ids" (or "id") and optional "media" JSON fields.
+    # JSON: {"items": [{"id": ..., "embedding": [...], "media": {...}}]}
+    image_files = request.files.getlist("images") or request.files.getlist("image")
+    if image_files:
+        ids = request.form.getlist("ids") or request.form.getlist("id")
+        media = request.form.getlist("media") or [None] * len(image_files)
+        if len(ids) != len(image_files) or len(media) != len(image_files):
+            raise ValueError("Each image needs exactly one id (and one media entry if any are given)")
+        if len(image_files) > BATCH_MAX_ITEMS:
+            raise ValueError(f"At most {BATCH_MAX_ITEMS} images per request")
+        return ids, embed_image_data([f.read() for f in image_files]), [_parse_media(m) for m in media]
+    
+    data = request.get_json(silent=True) or {}
+    items = data.get("items", [])
+    if not items:
+        raise ValueError("No items provided")
+    if any("id" not in item or "embedding" not in item for item in items):
+        raise ValueError("Each item needs an id and an embedding")
+    return (
+        [item["id"] for item in items],
+        [vector_codec.decode(item["embedding"]).reshape(-1) for item in items],
+        [_parse_media(item.get("media")) for item in items]
+    )
+
+def _write_index(overwrite):
+    try:
+        ids, vectors, media = _index_payload()
+        result = index.upsert(ids, vectors, media, overwrite=overwrite)
+        return jsonify({**result, "count": index.count})
+    except DuplicateIdError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/index/add", methods=["POST"])
+@embed_gates.admit(CLIP_MODEL)
+def index_add():
+    return _write_index(overwrite=False)
+
+@app.route("/index/upsert", methods=["POST"])
+@embed_gates.admit(CLIP_MODEL)
+def index_upsert():
+    return _write_index(overwrite=True)
+
+@app.route("/index/delete", methods=["POST"])
+def index_delete():
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids", [])
+    if not ids:
+        return jsonify({"error": "No ids provided"}), 400
+    deleted = index.delete(ids)
+    return jsonify({"deleted": deleted, "count": index.count})
+
+@app.route("/index/stats", methods=["GET"])
+def index_stats():
+    return jsonify(index.stats())
+
+@app.route("/search", methods=["POST"])
+@embed_gates.admit(CLIP_MODEL)
+def search():
+    exclude = []
+    try:
+        if "image" in request.files:
+            k = int(request.form.get("k", 10))
+            query = embed_image_data([request.files["image"].read()])[0]
+        else:
+            data = request.get_json(silent=True) or {}
+            k = int(data.get("k", 10))
+            if "id" in data:
+                query = index.get_vector(data["id"])
+                if query is None:
+                    return jsonify({"error": f"Unknown id: {data['id']}"}), 404
+                exclude = [data["id"]]
+            elif "text" in data:
+                query = text_batcher(tokenize_text(data["text"])).numpy()
+            elif "embedding" in data:
+                query = vector_codec.decode(data["embedding"])
+            else:
+                return jsonify({"error": "Provide an image, text, id or embedding"}), 400
+        
+        if k < 1:
+            return jsonify({"error": "k must be at least 1"}), 400
+        return jsonify({
+            "results": index.search(query, k, exclude_ids=exclude),
+            "count": index.count
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _video_source():
+    if "video" in request.files:
+        video = request.files["video"]
+        # ffmpeg needs a seekable input for most containers, so uploads are spooled to disk
+        suffix = os.path.splitext(video.filename or "")[1] or ".mp4"
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
+            video.save(f)
+        return f.name, video.filename, True
+    
+    path = request.form.get("path") or (request.get_json(silent=True) or {}).get("path")
+    if not path:
+        raise ValueError("No video file or path provided")
+    if not MEDIA_ROOTS:
+        raise ValueError("Local paths are disabled; set CLIP_MEDIA_ROOTS to allow them")
+    real_path = os.path.realpath(path)
+    if not any(real_path.startswith(root + os.sep) for root in MEDIA_ROOTS):
+        raise ValueError("Path is outside CLIP_MEDIA_ROOTS")
+    if not os.path.isfile(real_path):
+        raise ValueError(f"File not found: {path}")
+    return real_path, path, False
+
+def _video_options():
+    source = request.form if request.files or request.form else (request.get_json(silent=True) or {})
+    max_frames = int(source.get("max_frames", VIDEO_MAX_FRAMES))
+    return {
+        "mode": source.get("mode", "interval"),
+        "interval": float(source.get("interval", 2.0)),
+        "scene_threshold": float(source.get("scene_threshold", 0.3)),
+        "max_frames": min(max_frames, VIDEO_MAX_FRAMES) if max_frames > 0 else VIDEO_MAX_FRAMES
+    }, source
+
+def embed_video_frames(path, options):
+    # ffmpeg decodes in its own process while the previous batch runs through the model
+    batch = []
+    for timestamp, frame in iter_keyframes(path, size=VIDEO_FRAME_SIZE, **options):
+        batch.append((timestamp, preprocess_image(Image.fromarray(frame))))
+        if len(batch) == BATCH_MAX_SIZE:
+            yield batch, encode_image_batch([tensor for _, tensor in batch]).numpy()
+            batch = []
+    if batch:
+        yield batch, encode_image_batch([tensor for _, tensor in batch]).numpy()
+
+@app.route("/embed/video", methods=["POST"])
+@embed_gates.admit(CLIP_MODEL)
+def embed_video():
+    try:
+        options, source = _video_options()
+        fmt, dtype = _output_format()
+        if fmt == "binary":
+            raise ValueError("format must be json or base64 for video embeddings")
+        media = _parse_media(source.get("media")) or {}
+        path, video_id, is_upload = _video_source()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    video_id = source.get("video_id") or video_id
+    add_to_index = str(source.get("index", "false")).lower() in ("1", "true", "yes")
+    
+    def frames():
+        for batch, embeddings in embed_video_frames(path, options):
+            if add_to_index:
+                index.upsert(
+                    [f"{video_id}@{timestamp:.3f}" for timestamp, _ in batch],
+                    embeddings,
+                    [{**media, "video": video_id, "timestamp": timestamp} for timestamp, _ in batch]
+                )
+            for (timestamp, _), embedding in zip(batch, embeddings):
+                yield {"timestamp": timestamp, "embedding": _encode_vectors(embedding, fmt, dtype)}
+    
+    def cleanup():
+        if is_upload:
+            os.unlink(path)
+    
+    if str(source.get("stream", "false")).lower() in ("1", "true", "yes"):
+        # NDJSON: one line per keyframe as soon as its batch is embedded, then a summary line
+        def lines():
+            count = 0
+            try:
+                for frame in frames():
+                    count += 1
+                    yield json.dumps(frame) + "\n"
+                yield json.dumps({"done": True, "count": count, "video": video_id, "indexed": add_to_index}) + "\n"
+            except Exception as e:
+                yield json.dumps({"error": str(e)}) + "\n"
+        response = Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+        # Also runs when the client goes away before the stream is read
+        response.call_on_close(cleanup)
+        return response
+    
+    try:
+        results = list(frames())
+        return jsonify({
+            "frames": results,
+            "count": len(results),
+            "video": video_id,
+            "indexed": add_to_index
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cleanup()
+
+@app.route("/dedup", methods=["POST"])
+def dedup():
+    # Full pass over the index, or incremental when "ids" lists newly added items
+    data = request.get_json(silent=True) or {}
+    try:
+        threshold = float(data.get("threshold", 0.95))
+        block_rows = int(data.get("block_rows", 4096))
+    except (TypeError, ValueError):
+        return jsonify({"error": "threshold and block_rows must be numbers"}), 400
+    if not -1.0 <= threshold <= 1.0:
+        return jsonify({"error": "threshold must be between -1 and 1"}), 400
+    if block_rows < 1:
+        return jsonify({"error": "block_rows must be at least 1"}), 400
+    
+    ids = data.get("ids")
+    if ids is not None and not isinstance(ids, list):
+        return jsonify({"error": "ids must be a list"}), 400
+    
+    job = dedup_jobs.start(threshold, ids, block_rows)
+    if data.get("wait"):
+        job["_thread"].join()
+        return jsonify(DedupJobs.describe(job))
+    return jsonify(DedupJobs.describe(job)), 202
+
+@app.route("/dedup/<job_id>", methods=["GET"])
+def dedup_status(job_id):
+    job = dedup_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify(DedupJobs.describe(job))
 
 if __name__ == "__main__":
     print("Starting CLIP API server")
     print(f"GPU available: {torch.cuda.is_available()}")
+    print(f"Vector index: {index.count} items in {INDEX_DIR}")
+    print(f"Embedding micro-batching: max {BATCH_MAX_SIZE} items, max wait {BATCH_MAX_WAIT_MS}ms")
     print("Listening on http://0.0.0.0:8060")
-    app.run(host="0.0.0.0", port=8060)
+    app.run(host="0.0.0.0", port=8060, threaded=True)
@@ -0,0 +1,166 @@
+import threading
+import time
+import uuid
+import numpy as np
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        root = self.parent.setdefault(x, x)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while x != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def _block(vectors, alive, start, stop):
+    return np.asarray(vectors[start:stop], dtype=np.float32), alive[start:stop] != 0
+
+
+def near_duplicate_pairs(vectors, alive, rows, threshold, block_rows=4096, query_rows=None, progress=None):
+    """Yield (rows_a, rows_b, scores) for every live pair scoring >= threshold.
+
+    Vectors are L2-normalised, so a block of dot products is a block of cosine
+    similarities. Without `query_rows` the upper triangle of the full N x N
+    matrix is scanned block by block; with `query_rows` only those rows are
+    compared against the whole set, and a pair of two query rows is yielded once.
+    """
+    starts = list(range(0, rows, block_rows))
+
+    if query_rows is not None:
+        query_rows = np.unique(np.asarray(query_rows, dtype=np.int64))
+        queries = np.asarray(vectors[query_rows], dtype=np.float32)
+        for n, start in enumerate(starts):
+            stop = min(rows, start + block_rows)
+            block, live = _block(vectors, alive, start, stop)
+            scores = queries @ block.T
+            scores[:, ~live] = -np.inf
+            qi, bi = np.nonzero(scores >= threshold)
+            a, b = query_rows[qi], bi + start
+            # Two query rows meet from both sides: keep only (a, b) with a < b, like the full scan
+            keep = (a < b) | ((a > b) & ~np.isin(b, query_rows))
+            yield a[keep], b[keep], scores[qi, bi][keep]
+            if progress:
+                progress((n + 1) / len(starts))
+        return
+
+    total = len(starts) * (len(starts) + 1) // 2
+    done = 0
+    for i, start_a in enumerate(starts):
+        stop_a = min(rows, start_a + block_rows)
+        block_a, live_a = _block(vectors, alive, start_a, stop_a)
+        for start_b in starts[i:]:
+            stop_b = min(rows, start_b + block_rows)
+            block_b, live_b = _block(vectors, alive, start_b, stop_b)
+            scores = block_a @ block_b.T
+            scores[~live_a, :] = -np.inf
+            scores[:, ~live_b] = -np.inf
+            if start_a == start_b:
+                # Same block: only pairs above the diagonal
+                scores[np.tril_indices(len(scores), m=scores.shape[1])] = -np.inf
+            ai, bi = np.nonzero(scores >= threshold)
+            yield ai + start_a, bi + start_b, scores[ai, bi]
+            done += 1
+            if progress:
+                progress(done / total)
+
+
+def group_duplicates(index, threshold=0.95, ids=None, block_rows=4096, progress=None):
+    vectors, alive, rows = index.snapshot()
+    if vectors is None or rows == 0:
+        return {"groups": [], "pairs": 0}
+
+    query_rows = None
+    if ids is not None:
+        query_rows = list(index.rows_for(ids).values())
+        if not query_rows:
+            return {"groups": [], "pairs": 0}
+
+    uf = UnionFind()
+    weakest = {}
+    edges = []
+    pairs = 0
+    for a, b, scores in near_duplicate_pairs(vectors, alive, rows, threshold, block_rows, query_rows, progress):
+        pairs += len(scores)
+        for row_a, row_b, score in zip(a.tolist(), b.tolist(), scores.tolist()):
+            uf.union(row_a, row_b)
+            edges.append((row_a, score))
+
+    for row, score in edges:
+        root = uf.find(row)
+        weakest[root] = min(weakest.get(root, 1.0), score)
+
+    members = {}
+    for row in uf.parent:
+        members.setdefault(uf.find(row), []).append(row)
+
+    found = index.lookup_rows([row for group in members.values() for row in group])
+    groups = []
+    for root, group in members.items():
+        items = [{"id": found[row][0], "media": found[row][1]} for row in sorted(group) if row in found]
+        if len(items) > 1:
+            groups.append({"items": items, "size": len(items), "min_similarity": weakest[root]})
+    groups.sort(key=lambda g: g["size"], reverse=True)
+    return {"groups": groups, "pairs": pairs}
+
+
+class DedupJobs:
+    """Runs dedup passes in background threads and keeps the last few results."""
+
+    def __init__(self, index, keep=20):
+        self.index = index
+        self.keep = keep
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, threshold, ids=None, block_rows=4096):
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "running",
+            "mode": "incremental" if ids is not None else "full",
+            "threshold": threshold,
+            "progress": 0.0,
+            "started": time.time(),
+            "finished": None,
+            "result": None,
+            "error": None
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            for old_id in list(self._jobs)[:-self.keep]:
+                if self._jobs[old_id]["status"] != "running":
+                    del self._jobs[old_id]
+
+        def progress(fraction):
+            job["progress"] = round(fraction, 4)
+
+        def run():
+            try:
+                job["result"] = group_duplicates(self.index, threshold, ids, block_rows, progress)
+                job["status"] = "done"
+            except Exception as e:
+                job["error"] = str(e)
+                job["status"] = "error"
+            job["finished"] = time.time()
+
+        thread = threading.Thread(target=run, name=f"dedup-{job['id'][:8]}", daemon=True)
+        thread.start()
+        job["_thread"] = thread
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @staticmethod
+    def describe(job):
+        return {key: value for key, value in job.items() if not key.startswith("_")}
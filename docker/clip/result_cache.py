@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def content_key(data, *parts):
+    """Hash of the raw media bytes plus everything that changes the result."""
+    h = hashlib.sha256(data)
+    for part in parts:
+        h.update(b"\0" + str(part).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache for JSON-serialisable results.
+
+    An in-memory LRU sits in front of an on-disk store; both tiers are bounded
+    by total size in bytes and evict least recently used entries first.
+    """
+
+    def __init__(self, disk_dir=None, memory_max_bytes=64 << 20, disk_max_bytes=1 << 30):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_dir = disk_dir if disk_max_bytes > 0 else None
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _load_disk_index(self):
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    st = os.stat(os.path.join(root, name))
+                    entries.append((st.st_mtime, name[:-5], st.st_size))
+        # Oldest first so the OrderedDict matches LRU order
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return self._memory[key][0]
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as f:
+                    raw = f.read()
+                os.utime(self._path(key))
+                value = json.loads(raw)
+            except (OSError, ValueError):
+                with self._lock:
+                    self._forget_disk(key)
+            else:
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self.hits["disk"] += 1
+                    self._remember(key, value, len(raw))
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        raw = json.dumps(value).encode()
+        with self._lock:
+            self._remember(key, value, len(raw))
+
+        if self.disk_dir and len(raw) <= self.disk_max_bytes:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(raw)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._forget_disk(key, unlink=False)
+                self._disk[key] = len(raw)
+                self._disk_bytes += len(raw)
+                self._evict_disk()
+
+    def _remember(self, key, value, size):
+        if size > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        self._memory[key] = (value, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_max_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted
+
+    def _forget_disk(self, key, unlink=True):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+        if unlink:
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key = next(iter(self._disk))
+            self._forget_disk(key)
+
+    def stats(self):
+        lookups = self.hits["memory"] + self.hits["disk"] + self.misses
+        return {
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_rate": round((self.hits["memory"] + self.hits["disk"]) / lookups, 4) if lookups else 0.0,
+            "memory": {"entries": len(self._memory), "bytes": self._memory_bytes, "max_bytes": self.memory_max_bytes},
+            "disk": {"entries": len(self._disk), "bytes": self._disk_bytes, "max_bytes": self.disk_max_bytes}
+        }
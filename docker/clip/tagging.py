@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+
+DEFAULT_TEMPLATE = "a photo of {}"
+NAME_PATTERN = re.compile(r"^[\w-]{1,64}$")
+
+
+class Vocabulary:
+    def __init__(self, tags, template=DEFAULT_TEMPLATE, name=None):
+        tags = [str(t).strip() for t in tags if str(t).strip()]
+        if not tags:
+            raise ValueError("Vocabulary needs at least one tag")
+        if "{}" not in template:
+            raise ValueError("template must contain {}")
+        self.tags = list(dict.fromkeys(tags))
+        self.template = template
+        self.name = name
+
+    def key(self, model_name):
+        payload = json.dumps([model_name, self.template, self.tags]).encode()
+        return hashlib.sha256(payload).hexdigest()
+
+    def prompts(self):
+        return [self.template.format(tag) for tag in self.tags]
+
+    def describe(self):
+        return {"name": self.name, "template": self.template, "size": len(self.tags)}
+
+
+class VocabularyStore:
+    """Named tag vocabularies and their cached text-embedding matrices.
+
+    A matrix is keyed by model, prompt template and tag list, so it is only
+    re-encoded when one of those changes. Matrices are kept in a small in-memory
+    LRU and saved next to the vocabulary definitions to survive restarts.
+    """
+
+    def __init__(self, directory, encode_texts, model_name, max_cached=8):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.encode_texts = encode_texts
+        self.model_name = model_name
+        self.max_cached = max_cached
+        self._matrices = OrderedDict()
+        self._lock = threading.Lock()
+        self.encodes = 0
+
+    def _definition_path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _matrix_path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def register(self, name, tags, template=DEFAULT_TEMPLATE):
+        if not NAME_PATTERN.match(name or ""):
+            raise ValueError("name must be 1-64 letters, digits, _ or -")
+        vocabulary = Vocabulary(tags, template, name)
+        self.matrix(vocabulary)
+        with open(self._definition_path(name), "w") as f:
+            json.dump({"tags": vocabulary.tags, "template": vocabulary.template}, f)
+        return vocabulary
+
+    def get(self, name):
+        if not NAME_PATTERN.match(name or ""):
+            return None
+        try:
+            with open(self._definition_path(name)) as f:
+                definition = json.load(f)
+        except FileNotFoundError:
+            return None
+        return Vocabulary(definition["tags"], definition.get("template", DEFAULT_TEMPLATE), name)
+
+    def names(self):
+        return sorted(f[:-5] for f in os.listdir(self.directory) if f.endswith(".json"))
+
+    def delete(self, name):
+        vocabulary = self.get(name)
+        if vocabulary is None:
+            return False
+        os.unlink(self._definition_path(name))
+
+        # The matrix is shared by any other vocabulary with the same tags and template
+        key = vocabulary.key(self.model_name)
+        if not any(self.get(other).key(self.model_name) == key for other in self.names()):
+            with self._lock:
+                self._matrices.pop(key, None)
+            try:
+                os.unlink(self._matrix_path(key))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def matrix(self, vocabulary):
+        key = vocabulary.key(self.model_name)
+        with self._lock:
+            if key in self._matrices:
+                self._matrices.move_to_end(key)
+                return self._matrices[key]
+
+        path = self._matrix_path(key)
+        if os.path.exists(path):
+            matrix = np.load(path)
+        else:
+            matrix = np.asarray(self.encode_texts(vocabulary.prompts()), dtype=np.float32)
+            np.save(path, matrix)
+            self.encodes += 1
+
+        with self._lock:
+            self._matrices[key] = matrix
+            while len(self._matrices) > self.max_cached:
+                self._matrices.popitem(last=False)
+        return matrix
+
+    def score(self, image_embeddings, vocabulary, k=10, logit_scale=100.0, min_probability=0.0):
+        """Top-k tags per image from a single (N x D) @ (D x T) multiply.
+
+        `score` is the raw cosine similarity; `probability` is the softmax over the
+        vocabulary at CLIP's logit scale, i.e. the usual zero-shot calibration.
+        """
+        images = np.asarray(image_embeddings, dtype=np.float32)
+        images = images / np.maximum(np.linalg.norm(images, axis=1, keepdims=True), 1e-12)
+        scores = images @ self.matrix(vocabulary).T
+
+        logits = scores * logit_scale
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        k = min(k, len(vocabulary.tags))
+        results = []
+        for row_scores, row_probabilities in zip(scores, probabilities):
+            top = np.argsort(-row_scores)[:k]
+            results.append([
+                {"tag": vocabulary.tags[i], "score": float(row_scores[i]), "probability": float(row_probabilities[i])}
+                for i in top if row_probabilities[i] >= min_probability
+            ])
+        return results
+
+    def stats(self):
+        return {"vocabularies": len(self.names()), "cached_matrices": len(self._matrices), "encodes": self.encodes}
@@ -0,0 +1,76 @@
+"""Compact wire formats for embeddings.
+
+Three formats are understood:
+
+- ``json``: nested lists of floats (the default, unchanged).
+- ``base64``: ``{"dtype": "float16", "shape": [1, 768], "data": "<base64>"}``
+  where ``data`` holds the little-endian array bytes.
+- ``binary``: ``application/octet-stream`` bodies made of one or more framed
+  arrays. Each frame is the 4-byte magic ``EMB1``, a dtype code byte
+  (0 = float32, 1 = float16), a ndim byte, two reserved bytes, ``ndim``
+  little-endian uint32 dimensions and then the raw little-endian data.
+"""
+import base64
+import struct
+import numpy as np
+
+MAGIC = b"EMB1"
+DTYPE_CODES = {"float32": 0, "float16": 1}
+CODE_DTYPES = {code: name for name, code in DTYPE_CODES.items()}
+FORMATS = ("json", "base64", "binary")
+BINARY_MIMETYPE = "application/octet-stream"
+
+
+def check_format(fmt, dtype):
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"dtype must be one of {', '.join(DTYPE_CODES)}")
+
+
+def to_base64(array, dtype="float32"):
+    array = np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder("<"))
+    return {"dtype": dtype, "shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def pack(array, dtype="float32"):
+    array = np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder("<"))
+    header = MAGIC + struct.pack("<BBxx", DTYPE_CODES[dtype], array.ndim)
+    header += struct.pack(f"<{array.ndim}I", *array.shape)
+    return header + array.tobytes()
+
+
+def unpack_all(data):
+    arrays = []
+    offset = 0
+    view = memoryview(data)
+    while offset < len(data):
+        if bytes(view[offset:offset + 4]) != MAGIC:
+            raise ValueError("Bad embedding frame: missing EMB1 magic")
+        code, ndim = struct.unpack_from("<BBxx", data, offset + 4)
+        if code not in CODE_DTYPES:
+            raise ValueError(f"Bad embedding frame: unknown dtype code {code}")
+        shape = struct.unpack_from(f"<{ndim}I", data, offset + 8)
+        offset += 8 + 4 * ndim
+        dtype = np.dtype(CODE_DTYPES[code]).newbyteorder("<")
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        if offset + nbytes > len(data):
+            raise ValueError("Bad embedding frame: truncated data")
+        arrays.append(np.frombuffer(view[offset:offset + nbytes], dtype=dtype).reshape(shape).astype(np.float32))
+        offset += nbytes
+    return arrays
+
+
+def decode(value):
+    """Accept either a JSON (nested) list or a base64 object and return float32."""
+    if isinstance(value, dict):
+        try:
+            dtype = value.get("dtype", "float32")
+            if dtype not in DTYPE_CODES:
+                raise ValueError(f"dtype must be one of {', '.join(DTYPE_CODES)}")
+            raw = base64.b64decode(value["data"], validate=True)
+            array = np.frombuffer(raw, dtype=np.dtype(dtype).newbyteorder("<"))
+            return array.reshape(value.get("shape", [-1])).astype(np.float32)
+        except (KeyError, TypeError, base64.binascii.Error) as e:
+            raise ValueError(f"Invalid base64 embedding: {e}")
+    return np.asarray(value, dtype=np.float32)
@@ -0,0 +1,237 @@
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+
+DTYPES = {"float16": np.float16, "float32": np.float32}
+
+
+class DuplicateIdError(ValueError):
+    pass
+
+
+class VectorIndex:
+    """Persistent embedding store.
+
+    Vectors live in a raw memory-mapped array (`vectors.bin`) next to a one-byte
+    liveness flag per row (`alive.bin`); ids, rows and media info live in SQLite.
+    Nothing is read into memory at startup, so opening an index with millions of
+    rows costs the same as opening an empty one. Vectors are stored L2-normalised,
+    which makes cosine similarity a plain dot product.
+    """
+
+    def __init__(self, path, dtype="float16", block_rows=65536):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported index dtype: {dtype}")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.block_rows = block_rows
+        self._lock = threading.RLock()
+        self._meta_path = os.path.join(path, "index.json")
+        self._vectors_path = os.path.join(path, "vectors.bin")
+        self._alive_path = os.path.join(path, "alive.bin")
+
+        self._db = sqlite3.connect(os.path.join(path, "ids.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS items (id TEXT PRIMARY KEY, row INTEGER NOT NULL UNIQUE, media TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)")
+        self._db.commit()
+
+        self.dim = None
+        self.dtype = np.dtype(DTYPES[dtype])
+        self.rows = 0
+        self.capacity = 0
+        self.vectors = None
+        self.alive = None
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+            self.capacity = meta["capacity"]
+            # Rows written after the last metadata save are still recorded in SQLite
+            max_row = self._db.execute("SELECT MAX(row) FROM items").fetchone()[0]
+            self.rows = max(meta["rows"], (max_row + 1) if max_row is not None else 0)
+            if self.capacity:
+                self._map()
+
+        self.count = self._db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def _map(self):
+        self.vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r+", shape=(self.capacity, self.dim))
+        self.alive = np.memmap(self._alive_path, dtype=np.uint8, mode="r+", shape=(self.capacity,))
+
+    def _save_meta(self):
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "rows": self.rows, "capacity": self.capacity}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _reserve(self, extra):
+        if self.rows + extra <= self.capacity:
+            return
+        capacity = max(1024, self.capacity * 2, self.rows + extra)
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.alive.flush()
+        for path, row_bytes in ((self._vectors_path, self.dim * self.dtype.itemsize), (self._alive_path, 1)):
+            with open(path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self.capacity = capacity
+        self._map()
+
+    def _normalise(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None]
+        if self.dim is not None and vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dim vectors, got {vectors.shape[1]}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _rows_for(self, ids):
+        rows = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            query = f"SELECT id, row FROM items WHERE id IN ({','.join('?' * len(chunk))})"
+            rows.update(self._db.execute(query, chunk).fetchall())
+        return rows
+
+    def upsert(self, ids, vectors, media=None, overwrite=True):
+        ids = [str(i) for i in ids]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Duplicate ids in request")
+        vectors = self._normalise(vectors)
+        if len(vectors) != len(ids):
+            raise ValueError("Number of ids and vectors differ")
+        media = media or [None] * len(ids)
+
+        with self._lock:
+            existing = self._rows_for(ids)
+            if existing and not overwrite:
+                raise DuplicateIdError(f"Ids already indexed: {', '.join(sorted(existing)[:10])}")
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+
+            new_ids = [i for i in ids if i not in existing]
+            free = [r for (r,) in self._db.execute("SELECT row FROM free_rows ORDER BY row LIMIT ?", (len(new_ids),))]
+            self._reserve(len(new_ids) - len(free))
+
+            rows = []
+            for item_id in ids:
+                if item_id in existing:
+                    rows.append(existing[item_id])
+                elif free:
+                    rows.append(free.pop(0))
+                else:
+                    rows.append(self.rows)
+                    self.rows += 1
+
+            rows_array = np.asarray(rows)
+            self.vectors[rows_array] = vectors.astype(self.dtype)
+            self.alive[rows_array] = 1
+            self.vectors.flush()
+            self.alive.flush()
+
+            self._db.executemany("DELETE FROM free_rows WHERE row = ?", [(r,) for r in rows])
+            self._db.executemany(
+                "INSERT OR REPLACE INTO items (id, row, media) VALUES (?, ?, ?)",
+                [(i, r, json.dumps(m) if m is not None else None) for i, r, m in zip(ids, rows, media)]
+            )
+            self._db.commit()
+            self._save_meta()
+            self.count += len(new_ids)
+
+        return {"added": len(new_ids), "updated": len(ids) - len(new_ids)}
+
+    def delete(self, ids):
+        ids = [str(i) for i in ids]
+        with self._lock:
+            rows = list(self._rows_for(ids).values())
+            if not rows:
+                return 0
+            self.alive[np.asarray(rows)] = 0
+            self.alive.flush()
+            self._db.executemany("DELETE FROM items WHERE row = ?", [(r,) for r in rows])
+            self._db.executemany("INSERT OR IGNORE INTO free_rows (row) VALUES (?)", [(r,) for r in rows])
+            self._db.commit()
+            self.count -= len(rows)
+        return len(rows)
+
+    def snapshot(self):
+        with self._lock:
+            return self.vectors, self.alive, self.rows
+
+    def rows_for(self, ids):
+        with self._lock:
+            return self._rows_for([str(i) for i in ids])
+
+    def lookup_rows(self, rows):
+        found = {}
+        with self._lock:
+            for start in range(0, len(rows), 500):
+                chunk = rows[start:start + 500]
+                query = f"SELECT row, id, media FROM items WHERE row IN ({','.join('?' * len(chunk))})"
+                for row, item_id, media in self._db.execute(query, chunk):
+                    found[row] = (item_id, json.loads(media) if media else None)
+        return found
+
+    def get_vector(self, item_id):
+        with self._lock:
+            row = self._rows_for([str(item_id)]).get(str(item_id))
+            if row is None:
+                return None
+            return np.asarray(self.vectors[row], dtype=np.float32)
+
+    def search(self, query, k=10, exclude_ids=()):
+        if self.vectors is None or self.count == 0:
+            return []
+        query = self._normalise(query)[0]
+        vectors, alive, rows = self.snapshot()
+        excluded = list(self.rows_for(exclude_ids).values()) if exclude_ids else []
+
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        # Score block by block so memory stays bounded however large the index is
+        for start in range(0, rows, self.block_rows):
+            stop = min(rows, start + self.block_rows)
+            scores = np.asarray(vectors[start:stop], dtype=np.float32) @ query
+            scores[alive[start:stop] == 0] = -np.inf
+            block_rows = np.arange(start, stop)
+            if excluded:
+                # Before the cut to k, so excluded rows don't take any of the k slots
+                scores[np.isin(block_rows, excluded)] = -np.inf
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                scores, block_rows = scores[top], block_rows[top]
+            best_scores = np.concatenate([best_scores, scores])
+            best_rows = np.concatenate([best_rows, block_rows])
+            if len(best_scores) > k:
+                top = np.argpartition(-best_scores, k - 1)[:k]
+                best_scores, best_rows = best_scores[top], best_rows[top]
+
+        order = np.argsort(-best_scores)
+        best_scores, best_rows = best_scores[order], best_rows[order]
+        keep = np.isfinite(best_scores)
+        return self._describe(best_rows[keep].tolist(), best_scores[keep].tolist())
+
+    def _describe(self, rows, scores):
+        found = self.lookup_rows(rows)
+        results = []
+        for row, score in zip(rows, scores):
+            if row in found:
+                item_id, media = found[row]
+                results.append({"id": item_id, "score": float(score), "media": media})
+        return results
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "rows": self.rows,
+            "capacity": self.capacity,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "path": self.path
+        }
@@ -0,0 +1,83 @@
+import itertools
+import re
+import subprocess
+import threading
+from collections import deque
+from queue import Queue, Empty
+import numpy as np
+
+PTS_TIME = re.compile(r"\bn:\s*\d+\s+pts:\s*\S+\s+pts_time:\s*([0-9.eE+-]+)")
+MODES = ("interval", "scene")
+
+
+def ffmpeg_command(source, mode="interval", interval=2.0, scene_threshold=0.3, size=224, max_frames=None):
+    if mode == "scene":
+        # Always keep the first frame, then every frame that differs enough from the previous one
+        select = f"select='eq(n\\,0)+gt(scene\\,{scene_threshold})'"
+    else:
+        select = f"fps=1/{interval}"
+    # Centre square crop at the model's input size, as CLIP preprocessing would do
+    vf = f"{select},scale={size}:{size}:force_original_aspect_ratio=increase,crop={size}:{size},showinfo"
+    cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-i", source, "-an", "-sn", "-vf", vf, "-vsync", "vfr"]
+    if max_frames:
+        cmd += ["-frames:v", str(int(max_frames))]
+    return cmd + ["-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+
+
+def iter_keyframes(source, mode="interval", interval=2.0, scene_threshold=0.3, size=224, max_frames=None):
+    """Yield (timestamp_seconds, size x size x 3 uint8 frame) as ffmpeg decodes them.
+
+    Frames are read one at a time from ffmpeg's stdout, so memory does not depend
+    on the length of the video. Timestamps come from the showinfo filter on stderr.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    if mode == "interval" and interval <= 0:
+        raise ValueError("interval must be positive")
+
+    frame_bytes = size * size * 3
+    proc = subprocess.Popen(
+        ffmpeg_command(source, mode, interval, scene_threshold, size, max_frames),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    timestamps = Queue()
+    log_tail = deque(maxlen=20)
+
+    def read_stderr():
+        for raw in proc.stderr:
+            line = raw.decode(errors="replace").rstrip()
+            match = PTS_TIME.search(line) if "showinfo" in line else None
+            if match:
+                timestamps.put(float(match.group(1)))
+            elif "showinfo" not in line:
+                log_tail.append(line)
+
+    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+    stderr_thread.start()
+
+    try:
+        for index in itertools.count():
+            data = proc.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            try:
+                timestamp = timestamps.get(timeout=30)
+            except Empty:
+                # No showinfo line for this frame: interval frames are evenly spaced, scene frames can't be placed
+                if mode != "interval":
+                    continue
+                timestamp = index * interval
+            yield timestamp, np.frombuffer(data, dtype=np.uint8).reshape(size, size, 3)
+
+        proc.wait()
+        stderr_thread.join(timeout=5)
+        if proc.returncode != 0:
+            detail = log_tail[-1] if log_tail else f"exit code {proc.returncode}"
+            raise RuntimeError(f"ffmpeg failed: {detail}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
@@ -0,0 +1,269 @@
+import collections
+import functools
+import os
+import resource
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, jsonify, request
+from werkzeug.wsgi import ClosingIterator
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+FORM_MIMETYPES = ("multipart/form-data", "application/x-www-form-urlencoded")
+# Everything else is exported as a gauge
+TYPES = {"requests_total": "counter", "request_duration_seconds": "histogram", "stage_duration_seconds": "histogram"}
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{name}_bucket", {**labels, "le": repr(float(bound))}, cumulative
+        yield f"{name}_bucket", {**labels, "le": "+Inf"}, self.count
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, self.count
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _line(name, labels, value):
+    if labels:
+        label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f"{name}{{{label_text}}} {float(value)!r}"
+    return f"{name} {float(value)!r}"
+
+
+def flatten(prefix, stats, label="key", labels=None):
+    """Numeric leaves of a stats() dict as (name, labels, value) samples.
+
+    Nested dicts become a label (`label`), lists count their items and
+    anything else that is not a number is skipped.
+    """
+    labels = labels or {}
+    if stats and all(isinstance(v, dict) for v in stats.values()):
+        # One stats dict per model, batcher, ...
+        for key, sub_stats in stats.items():
+            yield from flatten(prefix, sub_stats, label, {**labels, label: key})
+        return
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, bool):
+            yield name, labels, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, labels, value
+        elif isinstance(value, (list, tuple)):
+            yield f"{name}_count", labels, len(value)
+        elif isinstance(value, dict):
+            if value and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value.values()):
+                for sub_key, v in value.items():
+                    yield name, {**labels, label: sub_key}, v
+            else:
+                yield from flatten(name, value, label, labels)
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Metrics:
+    """Prometheus text metrics for one Flask service.
+
+    Every request is counted and timed per route (until its body has been
+    sent, so streams count in full), and `stage()` breaks that time into
+    upload read, decode, model load, inference, encode and response write.
+    Services add their own gauges (queues, caches, loads) with `collect()`.
+    With `profiler=True` POST /debug/profile samples every thread's stack
+    for a few seconds and returns collapsed stacks for a flame graph.
+    """
+
+    def __init__(self, app, service, profiler=None):
+        self.service = service
+        self.profiler = profiler if profiler is not None else os.environ.get("METRICS_PROFILER", "0") == "1"
+        self._lock = threading.Lock()
+        self._requests = collections.Counter()
+        self._latency = {}
+        self._stages = {}
+        self._collectors = []
+        self._in_flight = 0
+        self._profiling = threading.Lock()
+
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.add_url_rule("/metrics", "metrics", self.render, methods=["GET"])
+        app.add_url_rule("/debug/profile", "debug_profile", self.profile, methods=["POST"])
+
+    @staticmethod
+    def endpoint():
+        if not has_request_context():
+            return "background"
+        return request.url_rule.rule if request.url_rule else "unmatched"
+
+    def _before(self):
+        g.metrics_start = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+        # Parse the body up front so reading the upload is timed as its own stage
+        if request.mimetype in FORM_MIMETYPES:
+            with self.stage("upload_read"):
+                request.files
+        elif request.is_json:
+            with self.stage("upload_read"):
+                request.get_data(cache=True)
+
+    def _after(self, response):
+        endpoint = self.endpoint()
+        key = (endpoint, request.method, str(response.status_code))
+        start = g.get("metrics_start", time.perf_counter())
+        handled = time.perf_counter()
+
+        def finished():
+            end = time.perf_counter()
+            self.observe_stage(endpoint, "response_write", end - handled)
+            with self._lock:
+                self._in_flight -= 1
+                self._requests[key] += 1
+                self._latency.setdefault(key, Histogram()).observe(end - start)
+
+        if response.direct_passthrough:
+            # send_file bodies go straight to the server, which never calls the response's own close()
+            response.response = ClosingIterator(response.response, finished)
+        else:
+            response.call_on_close(finished)
+        return response
+
+    def observe_stage(self, endpoint, stage, seconds):
+        with self._lock:
+            self._stages.setdefault((endpoint, stage), Histogram()).observe(seconds)
+
+    @contextmanager
+    def stage(self, name, endpoint=None):
+        """Time the block as stage `name` of the current request (or of `endpoint`, from worker threads)."""
+        endpoint = endpoint or self.endpoint()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(endpoint, name, time.perf_counter() - start)
+
+    def timed(self, name, fn):
+        """`fn` with every call recorded as stage `name`."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def instrument_models(self, cache, name="models"):
+        """Time a ModelCache's loads as the model_load stage of whichever request triggered them, and export its stats."""
+        cache.loader = self.timed("model_load", cache.loader)
+        self.collect(name, cache.stats, label="model")
+        return cache
+
+    def collect(self, name, stats, label="key"):
+        """Export the numbers in `stats()` as gauges named <service>_<name>_<key>."""
+        self._collectors.append((name, stats, label))
+
+    def samples(self):
+        base = {"service": self.service}
+        with self._lock:
+            requests = dict(self._requests)
+            latency = {key: histogram for key, histogram in self._latency.items()}
+            stages = dict(self._stages)
+            in_flight = self._in_flight
+
+        for (endpoint, method, status), count in sorted(requests.items()):
+            yield "requests_total", {**base, "endpoint": endpoint, "method": method, "status": status}, count
+        for (endpoint, method, status), histogram in sorted(latency.items()):
+            yield from histogram.samples("request_duration_seconds", {**base, "endpoint": endpoint, "method": method, "status": status})
+        for (endpoint, stage), histogram in sorted(stages.items()):
+            yield from histogram.samples("stage_duration_seconds", {**base, "endpoint": endpoint, "stage": stage})
+        yield "requests_in_flight", base, in_flight
+        yield "process_resident_memory_bytes", base, rss_bytes()
+        yield "process_peak_resident_memory_bytes", base, peak_rss_bytes()
+
+        for name, stats, label in self._collectors:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"[metrics] Collecting {name} failed: {e}")
+                continue
+            for metric, labels, value in flatten(f"{self.service}_{name}", values, label):
+                yield metric, {**base, **labels}, value
+
+    def render(self):
+        # Each family's samples have to be one contiguous group after its TYPE line
+        families = {}
+        for name, labels, value in self.samples():
+            family = name
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[:-len(suffix)] in TYPES:
+                    family = name[:-len(suffix)]
+            families.setdefault(family, []).append(_line(name, labels, value))
+        lines = []
+        for family, samples in families.items():
+            lines.append(f"# TYPE {family} {TYPES.get(family, 'gauge')}")
+            lines.extend(samples)
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+    def profile(self):
+        if not self.profiler:
+            return jsonify({"error": "Profiler disabled; set METRICS_PROFILER=1"}), 404
+        try:
+            seconds = min(float(request.args.get("seconds", 10)), 120)
+            interval = max(float(request.args.get("interval", 0.01)), 0.001)
+        except ValueError:
+            return jsonify({"error": "seconds and interval must be numbers"}), 400
+        if not self._profiling.acquire(blocking=False):
+            return jsonify({"error": "A profile is already running"}), 409
+        try:
+            stacks = sample_stacks(seconds, interval)
+        finally:
+            self._profiling.release()
+        body = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        return Response(body, mimetype="text/plain")
+
+
+def sample_stacks(seconds, interval=0.01):
+    """Collapsed stacks ("thread;outer;...;inner" -> samples) of every other thread, sampled for `seconds`."""
+    own = threading.get_ident()
+    names = {}
+    stacks = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if len(names) != threading.active_count():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            frames = [f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})" for entry in traceback.extract_stack(frame)]
+            stacks[";".join([names.get(ident, str(ident))] + frames)] += 1
+        time.sleep(interval)
+    return stacks
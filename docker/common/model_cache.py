@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def model_size_bytes(obj):
+    """Parameter + buffer bytes of a torch module, or of the modules one attribute deep."""
+    try:
+        import torch
+    except ImportError:
+        return 0
+
+    if isinstance(obj, torch.nn.Module):
+        modules = [obj]
+    else:
+        modules = [value for value in getattr(obj, "__dict__", {}).values() if isinstance(value, torch.nn.Module)]
+
+    seen = set()
+    total = 0
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if id(tensor) not in seen:
+                seen.add(id(tensor))
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelCache:
+    """Keyed model cache with single-flight loading and LRU eviction.
+
+    `loader(key)` is called at most once per key at a time: concurrent callers
+    asking for a model that is still loading wait for that load instead of
+    starting their own. Once the total size passes `budget_bytes` the least
+    recently used models are dropped (never the one just loaded).
+    """
+
+    def __init__(self, loader, budget_bytes=0, name="models", size_of=model_size_bytes, on_evict=None):
+        self.loader = loader
+        self.budget_bytes = budget_bytes
+        self.name = name
+        self.size_of = size_of
+        self.on_evict = on_evict
+        self._models = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = {}
+
+    def get(self, key):
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        start = time.perf_counter()
+        try:
+            model = self.loader(key)
+            size = self.size_of(model)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+
+        evicted = []
+        with self._lock:
+            self._models[key] = (model, size)
+            del self._loading[key]
+            self.loads += 1
+            self.load_seconds[key] = round(time.perf_counter() - start, 3)
+            # The new model is the most recently used, so it is never the one evicted
+            while self.budget_bytes and self._total_bytes() > self.budget_bytes and len(self._models) > 1:
+                old_key = next(iter(self._models))
+                evicted.append((old_key, self._models.pop(old_key)[0]))
+                self.evictions += 1
+
+        for old_key, old_model in evicted:
+            print(f"[{self.name}] Evicted {old_key} to stay under {self.budget_bytes >> 20}MB")
+            if self.on_evict:
+                self.on_evict(old_key, old_model)
+        future.set_result(model)
+        return model
+
+    def peek(self, key):
+        with self._lock:
+            entry = self._models.get(key)
+            return entry[0] if entry else None
+
+    def is_loaded(self, key):
+        with self._lock:
+            return key in self._models
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def preload(self, keys, background=True):
+        def run():
+            for key in keys:
+                try:
+                    self.get(key)
+                except Exception as e:
+                    print(f"[{self.name}] Preloading {key} failed: {e}")
+
+        if background:
+            thread = threading.Thread(target=run, name=f"{self.name}-preload", daemon=True)
+            thread.start()
+            return thread
+        run()
+
+    def _total_bytes(self):
+        return sum(size for _, size in self._models.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": [str(key) for key in self._models],
+                "loading": [str(key) for key in self._loading],
+                "bytes": self._total_bytes(),
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "load_seconds": {str(key): seconds for key, seconds in self.load_seconds.items()}
+            }
+
+
+def release_cuda_memory(key=None, model=None):
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
@@ -0,0 +1,264 @@
+"""Request I/O shared by the AI services.
+
+Uploads are decoded straight from memory instead of being saved to a temp file
+and read back, CPU-heavy decoding runs in one bounded thread pool so it can
+overlap with inference running on other request threads, and responses are
+sent from in-memory buffers so nothing is left behind in /tmp.
+"""
+import io
+import json
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from flask import send_file
+
+IO_WORKERS = int(os.environ.get("AI_IO_WORKERS", min(4, os.cpu_count() or 1)))
+
+
+class DecodePool:
+    """Bounded thread pool for decode/resize work.
+
+    At most `workers` jobs run at once and at most `workers * 2` more may be
+    waiting, so a burst of uploads cannot queue unbounded decoded data.
+    """
+
+    def __init__(self, workers=IO_WORKERS):
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="decode")
+        self._slots = threading.BoundedSemaphore(self.workers * 3)
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    def map(self, fn, items, prefetch=None):
+        """Ordered map that keeps at most `prefetch` results decoded ahead of the consumer."""
+        prefetch = prefetch or self.workers
+        items = iter(items)
+        pending = []
+        for item in items:
+            pending.append(self.submit(fn, item))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            result = pending.pop(0).result()
+            for item in items:
+                pending.append(self.submit(fn, item))
+                break
+            yield result
+
+
+decode_pool = DecodePool()
+
+
+def read_upload(file_storage):
+    return file_storage.read()
+
+
+def decode_image(data, mode="RGB"):
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    return image.convert(mode) if mode else image
+
+
+def decode_image_cv2(data, flags=None):
+    import cv2
+    if flags is None:
+        flags = cv2.IMREAD_UNCHANGED
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+def encode_image_cv2(image, ext=".png", params=None):
+    import cv2
+    ok, buffer = cv2.imencode(ext, image, params or [])
+    if not ok:
+        raise ValueError(f"Failed to encode image as {ext}")
+    return buffer.tobytes()
+
+
+def _ffmpeg_audio_cmd(source, sample_rate, channels, offset=None, duration=None):
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0"]
+    # As input options these seek in the container (for seekable inputs) and stop
+    # decoding early, instead of decoding everything and discarding it
+    if offset:
+        cmd += ["-ss", f"{offset:.3f}"]
+    if duration:
+        cmd += ["-t", f"{duration:.3f}"]
+    return cmd + [
+        "-i", source,
+        "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(sample_rate), "-"
+    ]
+
+
+def _ffmpeg_audio(source, data, sample_rate, channels, offset=None, duration=None):
+    return subprocess.run(_ffmpeg_audio_cmd(source, sample_rate, channels, offset, duration), input=data, capture_output=True)
+
+
+def _pcm(result, channels):
+    if result.returncode != 0:
+        detail = result.stderr.decode(errors="replace").strip().splitlines()
+        raise ValueError(f"Failed to decode audio: {detail[-1] if detail else 'ffmpeg error'}")
+    samples = np.frombuffer(result.stdout, dtype=np.float32)
+    if channels == 1:
+        return samples.copy()
+    return samples.reshape(-1, channels).T.copy()
+
+
+def decode_audio(data, sample_rate=16000, channels=1, offset=None, duration=None):
+    """Decode any ffmpeg-readable audio/video bytes to float32 PCM.
+
+    Returns shape (samples,) for mono and (channels, samples) otherwise.
+    `offset` and `duration` (seconds) limit decoding to one window.
+    """
+    result = _ffmpeg_audio("pipe:0", data, sample_rate, channels, offset, duration)
+    if result.returncode != 0 or not result.stdout:
+        # Some containers (e.g. MP4 with the index at the end) need a seekable input;
+        # from a pipe ffmpeg can exit cleanly without decoding anything
+        with tempfile.NamedTemporaryFile(suffix=".media") as f:
+            f.write(data)
+            f.flush()
+            result = _ffmpeg_audio(f.name, None, sample_rate, channels, offset, duration)
+    return _pcm(result, channels)
+
+
+def decode_audio_file(path, sample_rate=16000, channels=1, offset=None, duration=None):
+    """decode_audio for a file on disk, where `offset` seeks instead of decoding up to it."""
+    return _pcm(_ffmpeg_audio(path, None, sample_rate, channels, offset, duration), channels)
+
+
+def media_duration(path):
+    """Container duration in seconds as reported by ffmpeg, or None when it is unknown."""
+    result = subprocess.run(["ffmpeg", "-nostdin", "-hide_banner", "-i", path], capture_output=True)
+    for line in result.stderr.decode(errors="replace").splitlines():
+        line = line.strip()
+        if line.startswith("Duration:") and not line.startswith("Duration: N/A"):
+            h, m, s = line.split(",")[0].split()[1].split(":")
+            return int(h) * 3600 + int(m) * 60 + float(s)
+    return None
+
+
+def iter_audio(stream, sample_rate=16000, block_samples=16000, channels=1):
+    """Decode a file-like byte stream (e.g. a request body still uploading) as it arrives.
+
+    Yields float32 blocks of up to `block_samples` samples, shaped like
+    decode_audio's output. Formats that need a seekable input (MP4 with the
+    index at the end) cannot be decoded this way and raise ValueError.
+    """
+    proc = subprocess.Popen(
+        _ffmpeg_audio_cmd("pipe:0", sample_rate, channels),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    stderr = []
+
+    def feed():
+        try:
+            while True:
+                chunk = stream.read(64 << 10)
+                if not chunk:
+                    break
+                proc.stdin.write(chunk)
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, name="audio-feed", daemon=True)
+    feeder.start()
+    stderr_reader = threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)
+    stderr_reader.start()
+
+    frame_bytes = 4 * channels
+    decoded = 0
+    try:
+        while True:
+            data = proc.stdout.read(block_samples * frame_bytes)
+            data = data[:len(data) // frame_bytes * frame_bytes]
+            if not data:
+                break
+            decoded += len(data)
+            samples = np.frombuffer(data, dtype=np.float32)
+            yield samples.copy() if channels == 1 else samples.reshape(-1, channels).T.copy()
+
+        proc.wait()
+        stderr_reader.join(timeout=5)
+        if proc.returncode != 0 or not decoded:
+            detail = stderr[0].decode(errors="replace").strip().splitlines() if stderr else []
+            raise ValueError(f"Failed to decode audio: {detail[-1] if detail else 'no audio decoded'}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        feeder.join(timeout=5)
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def wav_bytes(samples, sample_rate, normalize=False):
+    """16-bit PCM WAV from float samples shaped (samples,) or (channels, samples)."""
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 1:
+        samples = samples[None]
+    if normalize:
+        samples = samples / max(0.01, float(np.max(np.abs(samples))) if samples.size else 0.01)
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(pcm.shape[0])
+        w.setsampwidth(2)
+        w.setframerate(int(sample_rate))
+        w.writeframes(pcm.T.tobytes())
+    return buffer.getvalue()
+
+
+def wav_header(sample_rate, channels=1):
+    """Header for a streamed 16-bit WAV of unknown length; players read such streams to the end."""
+    size = 0xFFFFFFFF
+    return b"".join([
+        b"RIFF", struct.pack("<I", size), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * channels * 2, channels * 2, 16),
+        b"data", struct.pack("<I", size - 36)
+    ])
+
+
+def pcm16(samples):
+    """Interleaved little-endian 16-bit PCM of float samples shaped (samples,) or (channels, samples).
+
+    Samples are clipped, not peak-normalised like wav_bytes(normalize=True):
+    a stream's peak is not known until its last chunk.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 1:
+        samples = samples[None]
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").T.tobytes()
+
+
+def format_event(event, format="ndjson"):
+    """One streamed event as an NDJSON line, or as a server-sent event named after its "type"."""
+    if format == "sse":
+        payload = {key: value for key, value in event.items() if key != "type"}
+        return f"event: {event['type']}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps(event) + "\n"
+
+
+def send_bytes(data, mimetype, download_name, as_attachment=True):
+    return send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=as_attachment, download_name=download_name)
@@ -0,0 +1,192 @@
+import functools
+import inspect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import jsonify, make_response, request
+
+# Clients can bound how long a request may wait for a model, in seconds
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+
+class Overloaded(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Deadline passed while waiting for {name}")
+        self.retry_after = retry_after
+
+
+class Gate:
+    """Admission control for one model: bounded concurrency behind a bounded FIFO queue.
+
+    At most `concurrency` callers run at once and at most `queue_size` wait;
+    anyone beyond that is turned away immediately with Overloaded rather than
+    piling up and dragging every request's latency with it. Waiters whose
+    deadline passes give up with DeadlineExceeded. Both carry a Retry-After
+    estimate from the recent time callers held the gate.
+    """
+
+    def __init__(self, name, concurrency=1, queue_size=8, smoothing=0.2):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.smoothing = smoothing
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queue = []
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.hold_seconds = None
+
+    def retry_after(self):
+        """Seconds until a slot is likely to be free, at least 1."""
+        hold = self.hold_seconds or 1.0
+        return max(1, math.ceil(hold * (len(self._queue) + 1) / self.concurrency))
+
+    def enter(self, deadline=None, bounded=True):
+        """Take a slot, waiting in line if needed. `bounded=False` skips the queue limit for already accepted work."""
+        with self._cond:
+            if self._active < self.concurrency and not self._queue:
+                self._active += 1
+                self.admitted += 1
+                return
+            if bounded and len(self._queue) >= self.queue_size:
+                self.rejected += 1
+                raise Overloaded(self.name, self.retry_after())
+
+            ticket = object()
+            self._queue.append(ticket)
+            try:
+                while self._queue[0] is not ticket or self._active >= self.concurrency:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.expired += 1
+                        raise DeadlineExceeded(self.name, self.retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                # The next in line may be able to go now (or be the one after a leaver)
+                self._cond.notify_all()
+            self._active += 1
+            self.admitted += 1
+
+    def leave(self, held_seconds=None):
+        with self._cond:
+            self._active -= 1
+            if held_seconds is not None:
+                if self.hold_seconds is None:
+                    self.hold_seconds = held_seconds
+                else:
+                    self.hold_seconds += self.smoothing * (held_seconds - self.hold_seconds)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, deadline=None, bounded=True):
+        self.enter(deadline, bounded)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.leave(time.monotonic() - start)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self._active,
+                "queued": len(self._queue),
+                "concurrency": self.concurrency,
+                "queue_size": self.queue_size,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "hold_seconds": round(self.hold_seconds, 3) if self.hold_seconds is not None else None
+            }
+
+
+class Gates:
+    """One Gate per model key, created on first use with the same limits."""
+
+    def __init__(self, concurrency=1, queue_size=8, timeout=0):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._gates = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, prefix, concurrency=1, queue_size=8, timeout=0):
+        """Limits from <PREFIX>_MAX_CONCURRENCY, <PREFIX>_MAX_QUEUE and <PREFIX>_REQUEST_TIMEOUT (seconds, 0 = none)."""
+        return cls(
+            int(os.environ.get(f"{prefix}_MAX_CONCURRENCY", concurrency)),
+            int(os.environ.get(f"{prefix}_MAX_QUEUE", queue_size)),
+            float(os.environ.get(f"{prefix}_REQUEST_TIMEOUT", timeout))
+        )
+
+    def get(self, key):
+        with self._lock:
+            gate = self._gates.get(key)
+            if gate is None:
+                gate = self._gates[key] = Gate(str(key), self.concurrency, self.queue_size)
+            return gate
+
+    def deadline(self):
+        """Monotonic deadline for the current request: its timeout header, else the default timeout."""
+        value = request.headers.get(TIMEOUT_HEADER)
+        try:
+            timeout = float(value) if value else self.timeout
+        except ValueError:
+            timeout = self.timeout
+        return time.monotonic() + timeout if timeout > 0 else None
+
+    def admit(self, key):
+        """Decorator that runs a view inside the gate for `key` (a value, or a callable evaluated per request).
+
+        Rejections become 429 and missed deadlines 503, both with Retry-After.
+        A response whose body is a generator still has work to do, so it keeps
+        its slot until it has been sent.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                gate = self.get(key() if callable(key) else key)
+                try:
+                    gate.enter(self.deadline())
+                except Overloaded as e:
+                    return busy_response(e, 429)
+                except DeadlineExceeded as e:
+                    return busy_response(e, 503)
+
+                start = time.monotonic()
+                release = lambda: gate.leave(time.monotonic() - start)
+                try:
+                    response = make_response(view(*args, **kwargs))
+                except BaseException:
+                    release()
+                    raise
+                if inspect.isgenerator(response.response):
+                    response.call_on_close(release)
+                else:
+                    release()
+                return response
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            gates = dict(self._gates)
+        return {str(key): gate.stats() for key, gate in gates.items()}
+
+
+def busy_response(error, status):
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = status
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
@@ -1,117 +1,283 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import subprocess
-import tempfile
+from common.request_io import decode_pool, decode_audio, send_bytes
+from common.model_cache import ModelCache, release_cuda_memory
+from common.serving import Gates
+from common.metrics import Metrics
+from demucs.pretrained import get_model
+from demucs.apply import apply_model
+from streaming import SeparationJobs, FORMATS
+from separation_cache import SeparationCache, content_key
+import io
 import os
+import time
 import zipfile
-import shutil
+import torch
 
 app = Flask(__name__)
 CORS(app)
+metrics = Metrics(app, "demucs")
 
-OUTPUT_DIR = "/app/output"
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+MODELS = [name.strip() for name in os.environ.get("DEMUCS_MODELS", "htdemucs,htdemucs_ft,mdx_extra").split(",") if name.strip()]
+MODEL_BUDGET_MB = int(os.environ.get("DEMUCS_MODEL_BUDGET_MB", 2048))
+# Comma-separated model names to load at startup, e.g. "htdemucs"
+PRELOAD = [name.strip() for name in os.environ.get("DEMUCS_PRELOAD", "").split(",") if name.strip()]
+OVERLAP = float(os.environ.get("DEMUCS_OVERLAP", 0.25))
+SHIFTS = int(os.environ.get("DEMUCS_SHIFTS", 1))
+
+# Chunked mode: window length and crossfade in seconds, and windows separated in parallel
+OUTPUT_DIR = os.environ.get("DEMUCS_OUTPUT_DIR", "/app/output")
+SEGMENT_SECONDS = float(os.environ.get("DEMUCS_SEGMENT_SECONDS", 30))
+SEGMENT_OVERLAP = float(os.environ.get("DEMUCS_SEGMENT_OVERLAP", 2))
+SEGMENT_WORKERS = int(os.environ.get("DEMUCS_SEGMENT_WORKERS", 1 if torch.cuda.is_available() else max(1, min(4, (os.cpu_count() or 1) // 4))))
+JOBS_KEEP = int(os.environ.get("DEMUCS_JOBS_KEEP", 10))
+
+# Full separations keyed by audio hash and model, reused by /separate and /separate-stem
+CACHE_DIR = os.environ.get("DEMUCS_CACHE_DIR", "/root/.cache/demucs-results")
+CACHE_DISK_MB = int(os.environ.get("DEMUCS_CACHE_DISK_MB", 4096))
+
+if SEGMENT_WORKERS > 1 and not torch.cuda.is_available():
+    # Split the cores between segment workers instead of oversubscribing them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // SEGMENT_WORKERS))
+
+def load_model(name):
+    print(f"Loading Demucs model {name}...")
+    model = get_model(name)
+    model.eval()
+    return model.to(DEVICE)
+
+# Weights stay resident between requests until the memory budget forces one out
+models = ModelCache(load_model, MODEL_BUDGET_MB << 20, name="demucs", on_evict=release_cuda_memory)
+jobs = SeparationJobs(OUTPUT_DIR, keep=JOBS_KEEP)
+results = SeparationCache(CACHE_DIR, CACHE_DISK_MB << 20)
+# As many separations per model as segment workers; chunked jobs take a slot per window
+gates = Gates.from_env("DEMUCS", concurrency=SEGMENT_WORKERS, queue_size=4)
+
+metrics.instrument_models(models)
+metrics.collect("results", results.stats)
+metrics.collect("admission", gates.stats, label="model")
+
+def model_key():
+    # Unknown names are rejected by the view; they queue with the default model until then
+    name = request.form.get("model", "htdemucs")
+    return name if name in MODELS else "htdemucs"
 
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({
         "status": "ok",
         "service": "demucs",
-        "models": ["htdemucs", "htdemucs_ft", "mdx_extra"]
+        "models": MODELS,
+        "cache": models.stats(),
+        "results": results.stats(),
+        "gpu": torch.cuda.is_available(),
+        "admission": gates.stats(),
+        "chunked": {
+            "segment": SEGMENT_SECONDS,
+            "overlap": SEGMENT_OVERLAP,
+            "workers": SEGMENT_WORKERS,
+            "formats": list(FORMATS)
+        }
     })
 
+def check_model(name):
+    if name not in MODELS:
+        raise ValueError(f"model must be one of {', '.join(MODELS)}")
+
+def get_separator(name):
+    check_model(name)
+    return models.get(name)
+
+def apply_separator(model, wav, num_workers=0):
+    """(channels, samples) tensor -> (sources, channels, samples), normalised like the demucs CLI."""
+    ref = wav.mean(0)
+    mean, std = ref.mean(), ref.std() + 1e-8
+    with torch.no_grad():
+        sources = apply_model(
+            model, ((wav - mean) / std)[None], device=DEVICE, shifts=SHIFTS, split=True,
+            overlap=OVERLAP, progress=False, num_workers=num_workers
+        )[0]
+    return sources * std + mean
+
+def separate_audio(data, model_name):
+    """Separate encoded audio into {source: (channels, samples) tensor} with the given model."""
+    model = get_separator(model_name)
+    with metrics.stage("decode"):
+        wav = torch.from_numpy(decode_pool.run(decode_audio, data, model.samplerate, model.audio_channels))
+
+    start = time.perf_counter()
+    # The whole file is one request here, so let demucs spread its own chunks over the segment workers
+    with metrics.stage("inference"):
+        sources = apply_separator(model, wav, SEGMENT_WORKERS if DEVICE == "cpu" and SEGMENT_WORKERS > 1 else 0)
+    print(f"Separated {wav.shape[-1] / model.samplerate:.1f}s of audio with {model_name} in {time.perf_counter() - start:.2f}s")
+
+    return {name: wav.cpu().numpy() for name, wav in zip(model.sources, sources)}, model.samplerate
+
+def cached_separation(data, model_name):
+    """Full separation from the result cache, running (at most once per key at a time) on a miss.
+
+    Use it as a context manager: the cache entry is kept until the block exits.
+    """
+    check_model(model_name)
+    key = content_key(data, model_name, SHIFTS, OVERLAP)
+    return results.use(key, lambda: separate_audio(data, model_name))
+
+def select_stems(sources, stems):
+    """All sources, or `stems` plus `no_<stems>` (the sum of the rest) like --two-stems."""
+    if stems == "all":
+        return sources
+    if stems not in sources:
+        raise ValueError(f"stem must be one of {', '.join(sources)}")
+    rest = sum(wav for name, wav in sources.items() if name != stems)
+    return {stems: sources[stems], f"no_{stems}": rest}
+
 @app.route("/separate", methods=["POST"])
+@gates.admit(model_key)
 def separate():
     if "audio" not in request.files:
         return jsonify({"error": "No audio file provided"}), 400
-    
+
     audio = request.files["audio"]
     model = request.form.get("model", "htdemucs")
     stems = request.form.get("stems", "all")  # all, vocals, drums, bass, other
-    
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_path = os.path.join(tmpdir, "input.wav")
-        audio.save(input_path)
-        
-        try:
-            # Run demucs
-            cmd = [
-                "python3", "-m", "demucs",
-                "--model", model,
-                "--out", tmpdir,
-                input_path
-            ]
-            
-            if stems != "all":
-                cmd.extend(["--two-stems", stems])
-            
-            subprocess.run(cmd, check=True, capture_output=True)
-            
-            # Find output directory
-            output_subdir = os.path.join(tmpdir, model, "input")
-            
-            if not os.path.exists(output_subdir):
-                return jsonify({"error": "Separation failed"}), 500
-            
-            # Create zip with all stems
-            zip_path = os.path.join(tmpdir, "stems.zip")
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for stem_file in os.listdir(output_subdir):
-                    stem_path = os.path.join(output_subdir, stem_file)
-                    zipf.write(stem_path, stem_file)
-            
-            return send_file(
-                zip_path,
-                mimetype="application/zip",
-                as_attachment=True,
-                download_name="stems.zip"
-            )
-            
-        except subprocess.CalledProcessError as e:
-            return jsonify({"error": f"Demucs error: {e.stderr.decode()}"}), 500
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+
+    try:
+        with cached_separation(audio.read(), model) as separation:
+            selected = separation.stems(stems)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Demucs error: {e}"}), 500
+
+    buffer = io.BytesIO()
+    with metrics.stage("encode"), zipfile.ZipFile(buffer, 'w') as zipf:
+        for filename, data in selected.items():
+            zipf.writestr(filename, data)
+
+    return send_bytes(
+        buffer.getvalue(),
+        mimetype="application/zip",
+        download_name="stems.zip"
+    )
 
 @app.route("/separate-stem", methods=["POST"])
+@gates.admit(model_key)
 def separate_single_stem():
     if "audio" not in request.files:
         return jsonify({"error": "No audio file provided"}), 400
-    
+
     audio = request.files["audio"]
     stem = request.form.get("stem", "vocals")  # vocals, drums, bass, other
     model = request.form.get("model", "htdemucs")
-    
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_path = os.path.join(tmpdir, "input.wav")
-        audio.save(input_path)
-        
-        try:
-            cmd = [
-                "python3", "-m", "demucs",
-                "--model", model,
-                "--two-stems", stem,
-                "--out", tmpdir,
-                input_path
-            ]
-            
-            subprocess.run(cmd, check=True, capture_output=True)
-            
-            output_subdir = os.path.join(tmpdir, model, "input")
-            stem_path = os.path.join(output_subdir, f"{stem}.wav")
-            
-            if not os.path.exists(stem_path):
-                return jsonify({"error": f"Stem {stem} not found"}), 500
-            
-            return send_file(
-                stem_path,
-                mimetype="audio/wav",
-                as_attachment=True,
-                download_name=f"{stem}.wav"
-            )
-            
-        except subprocess.CalledProcessError as e:
-            return jsonify({"error": f"Demucs error: {e.stderr.decode()}"}), 500
+
+    try:
+        # Served from a cached full separation, so asking for another stem later costs nothing
+        with cached_separation(audio.read(), model) as separation:
+            if stem not in separation.sources:
+                raise ValueError(f"stem must be one of {', '.join(separation.sources)}")
+            data = separation.wav(stem)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Demucs error: {e}"}), 500
+
+    return send_bytes(
+        data,
+        mimetype="audio/wav",
+        download_name=f"{stem}.wav"
+    )
+
+@app.route("/separate/stream", methods=["POST"])
+@gates.admit(model_key)
+def separate_stream():
+    # Chunked separation for long audio: stems are written segment by segment and can be
+    # downloaded from /separate/jobs/<job_id>/<stem> while the job is still running
+    if "audio" not in request.files:
+        return jsonify({"error": "No audio file provided"}), 400
+
+    audio = request.files["audio"]
+    model_name = request.form.get("model", "htdemucs")
+    stems = request.form.get("stems", "all")
+    format = request.form.get("format", "wav").lower()
+    try:
+        segment = float(request.form.get("segment", SEGMENT_SECONDS))
+        overlap = float(request.form.get("overlap", SEGMENT_OVERLAP))
+        workers = int(request.form.get("workers", SEGMENT_WORKERS))
+    except ValueError:
+        return jsonify({"error": "segment, overlap and workers must be numbers"}), 400
+    if format not in FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
+    if segment < 1 or not 0 <= overlap < segment:
+        return jsonify({"error": "segment must be at least 1s and overlap between 0 and segment"}), 400
+    # More workers than configured would oversubscribe the CPU threads set at startup
+    workers = max(1, min(workers, SEGMENT_WORKERS))
+
+    try:
+        model = get_separator(model_name)
+        if stems != "all" and stems not in model.sources:
+            raise ValueError(f"stem must be one of {', '.join(model.sources)}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Demucs error: {e}"}), 500
+    names = list(model.sources) if stems == "all" else [stems, f"no_{stems}"]
+
+    # Windows are separated on the job's threads, after this request has returned
+    endpoint = metrics.endpoint()
+
+    def separate_window(window):
+        # Already accepted work: waits for a slot however long the queue is
+        with gates.get(model_name).slot(bounded=False), metrics.stage("inference", endpoint):
+            sources = apply_separator(model, torch.from_numpy(window))
+        return select_stems(dict(zip(model.sources, sources.cpu().numpy())), stems)
+
+    # The upload goes to disk so ffmpeg can decode it window by window
+    job_id, job_dir = jobs.create()
+    input_path = os.path.join(job_dir, "input")
+    audio.save(input_path)
+
+    job = jobs.start(
+        job_id, job_dir, input_path, separate_window, model_name, names,
+        model.samplerate, model.audio_channels, segment, overlap, workers, format
+    )
+    return jsonify({
+        **SeparationJobs.describe(job),
+        "urls": {name: f"/separate/jobs/{job_id}/{name}" for name in names}
+    }), 202
+
+@app.route("/separate/jobs/<job_id>", methods=["GET"])
+def separate_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify(SeparationJobs.describe(job))
+
+@app.route("/separate/jobs/<job_id>/<stem>", methods=["GET"])
+def separate_job_stem(job_id, stem):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    if stem not in job["stems"]:
+        return jsonify({"error": f"stem must be one of {', '.join(job['stems'])}"}), 404
+    if job["status"] == "error":
+        return jsonify({"error": job["error"]}), 500
+
+    filename = f"{stem}.{job['format']}"
+    return Response(
+        SeparationJobs.follow(job, stem),
+        mimetype=FORMATS[job["format"]],
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
 if __name__ == "__main__":
     print("Starting Demucs API server")
+    print(f"Device: {DEVICE}")
+    if PRELOAD:
+        unknown = [name for name in PRELOAD if name not in MODELS]
+        if unknown:
+            print(f"Ignoring unknown DEMUCS_PRELOAD models: {', '.join(unknown)}")
+        print(f"Preloading models: {', '.join(n for n in PRELOAD if n in MODELS)}")
+        models.preload([name for name in PRELOAD if name in MODELS])
     print("Listening on http://0.0.0.0:8040")
     app.run(host="0.0.0.0", port=8040)
@@ -0,0 +1,239 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import wave
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+import numpy as np
+
+
+def content_key(data, *parts):
+    """Hash of the raw audio bytes plus everything that changes the separation."""
+    h = hashlib.sha256(data)
+    for part in parts:
+        h.update(b"\0" + str(part).encode())
+    return h.hexdigest()
+
+
+def encode_stem(samples, sample_rate):
+    """16-bit WAV of a (channels, samples) array, rescaled like the demucs CLI; returns (bytes, scale)."""
+    samples = np.asarray(samples, dtype=np.float32)
+    scale = max(1.01 * float(np.abs(samples).max()) if samples.size else 0.0, 1.0)
+    pcm = (np.clip(samples / scale, -1.0, 1.0) * 32767).astype("<i2")
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(pcm.shape[0])
+        w.setsampwidth(2)
+        w.setframerate(int(sample_rate))
+        w.writeframes(pcm.T.tobytes())
+    return buffer.getvalue(), scale
+
+
+class Separation:
+    """Every source of one separation as encoded WAVs, in memory or in a cache directory."""
+
+    def __init__(self, sample_rate, scales, wavs=None, directory=None):
+        self.sample_rate = sample_rate
+        self.scales = scales
+        self.sources = list(scales)
+        self._wavs = wavs
+        self._directory = directory
+
+    def wav(self, name):
+        if self._wavs is not None:
+            return self._wavs[name]
+        with open(os.path.join(self._directory, f"{name}.wav"), "rb") as f:
+            return f.read()
+
+    def samples(self, name):
+        """Float samples before the output rescale, so stems can be summed."""
+        with wave.open(io.BytesIO(self.wav(name))) as w:
+            channels = w.getnchannels()
+            pcm = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2")
+        return pcm.reshape(-1, channels).T.astype(np.float32) / 32767 * self.scales[name]
+
+    def stems(self, stems="all"):
+        """{filename: wav bytes} for all sources, or `stems` plus `no_<stems>` like --two-stems."""
+        if stems == "all":
+            return {f"{name}.wav": self.wav(name) for name in self.sources}
+        if stems not in self.scales:
+            raise ValueError(f"stem must be one of {', '.join(self.sources)}")
+        rest = sum(self.samples(name) for name in self.sources if name != stems)
+        return {f"{stems}.wav": self.wav(stems), f"no_{stems}.wav": encode_stem(rest, self.sample_rate)[0]}
+
+
+class SeparationCache:
+    """Size-bounded on-disk LRU store of full separations.
+
+    One directory per key holds a WAV per source and a meta.json; the cached
+    sources are a full separation, so any stem mode can be served from them.
+    Concurrent requests for a key that is still being separated wait for that
+    run instead of starting their own, and entries in use are never evicted.
+    With `max_bytes=0` nothing is stored, but identical concurrent requests
+    are still collapsed.
+    """
+
+    def __init__(self, directory, max_bytes=4 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._running = {}
+        self._pins = Counter()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+
+        if self.max_bytes > 0:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self._path(name)
+            meta = os.path.join(path, "meta.json")
+            if name.endswith(".tmp") or not os.path.exists(meta):
+                # Left over from an interrupted write
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.stat(meta).st_mtime, name, size))
+        # Oldest first so the OrderedDict matches LRU order
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._bytes += size
+        self._evict()
+
+    def _load(self, key):
+        path = self._path(key)
+        meta_path = os.path.join(path, "meta.json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            return None
+        return Separation(meta["sample_rate"], meta["scales"], directory=path)
+
+    def put(self, key, sources, sample_rate):
+        """Encode {name: (channels, samples)} sources and store them; returns the Separation."""
+        wavs, scales = {}, {}
+        for name, samples in sources.items():
+            wavs[name], scales[name] = encode_stem(samples, sample_rate)
+        result = Separation(sample_rate, scales, wavs=wavs)
+
+        size = sum(len(data) for data in wavs.values())
+        if self.max_bytes <= 0 or size > self.max_bytes:
+            return result
+
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        for name, data in wavs.items():
+            with open(os.path.join(tmp_path, f"{name}.wav"), "wb") as f:
+                f.write(data)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({"sample_rate": sample_rate, "scales": scales}, f)
+
+        with self._lock:
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+            self._bytes -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._bytes += size
+            self._evict(keep=key)
+        return result
+
+    @contextmanager
+    def use(self, key, separate):
+        """get_or_create(), with the entry pinned against eviction until the block exits.
+
+        A cached Separation reads its stems from disk lazily, so its directory
+        has to outlive the request that serves it.
+        """
+        with self._lock:
+            self._pins[key] += 1
+        try:
+            yield self.get_or_create(key, separate)
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+                self._evict()
+
+    def get_or_create(self, key, separate):
+        """Cached separation for `key`, or run `separate()` -> (sources, sample_rate) once and store it."""
+        # The lookup and registering the run share one lock, so two misses can't both separate
+        with self._lock:
+            cached = key in self._entries
+            if cached:
+                self._entries.move_to_end(key)
+            else:
+                self.misses += 1
+                future = self._running.get(key)
+                owner = future is None
+                if owner:
+                    future = self._running[key] = Future()
+                else:
+                    self.collapsed += 1
+
+        if cached:
+            result = self._load(key)
+            with self._lock:
+                if result is not None:
+                    self.hits += 1
+                    return result
+                # Its directory is gone: forget the entry and separate again
+                self._bytes -= self._entries.pop(key, 0)
+            return self.get_or_create(key, separate)
+        if not owner:
+            return future.result()
+
+        try:
+            sources, sample_rate = separate()
+            result = self.put(key, sources, sample_rate)
+        except BaseException as e:
+            with self._lock:
+                del self._running[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._running[key]
+        future.set_result(result)
+        return result
+
+    def _evict(self, keep=None):
+        # Oldest first, skipping entries a request is still reading from and the one just stored
+        for key in list(self._entries):
+            if self._bytes <= self.max_bytes:
+                break
+            if self._pins[key] or key == keep:
+                continue
+            self._bytes -= self._entries.pop(key)
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "collapsed": self.collapsed,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "running": len(self._running),
+                "pinned": len(self._pins)
+            }
@@ -0,0 +1,295 @@
+import os
+import re
+import shutil
+import struct
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+FORMATS = {"wav": "audio/wav", "flac": "audio/flac"}
+DURATION = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def iter_segments(path, sample_rate, channels, hop, overlap, info=None):
+    """Yield (start_sample, (channels, n) float32) windows of `hop + overlap` samples.
+
+    Window k starts at k * hop, so neighbours share `overlap` samples. Audio is read
+    from ffmpeg's stdout as it decodes; only one window is ever held here. The
+    input duration, once ffmpeg reports it, is stored in `info["duration"]`.
+    """
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", path,
+        "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(sample_rate), "-"
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    log_tail = deque(maxlen=20)
+
+    def read_stderr():
+        for raw in proc.stderr:
+            line = raw.decode(errors="replace").rstrip()
+            match = DURATION.search(line)
+            if match and info is not None and "duration" not in info:
+                h, m, s = match.groups()
+                info["duration"] = int(h) * 3600 + int(m) * 60 + float(s)
+            log_tail.append(line)
+
+    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+    stderr_thread.start()
+
+    frame_bytes = 4 * channels
+    window = hop + overlap
+    try:
+        start = 0
+        carry = np.zeros((channels, 0), dtype=np.float32)
+        while True:
+            data = proc.stdout.read((window - carry.shape[1]) * frame_bytes)
+            data = data[:len(data) // frame_bytes * frame_bytes]
+            fresh = np.frombuffer(data, dtype=np.float32).reshape(-1, channels).T
+            segment = np.concatenate([carry, fresh], axis=1)
+            if segment.shape[1] < window:
+                # End of stream: whatever is left beyond the previous window is the last one
+                if segment.shape[1] > (overlap if start else 0):
+                    yield start, segment
+                break
+            yield start, segment
+            carry = segment[:, hop:]
+            start += hop
+
+        proc.wait()
+        stderr_thread.join(timeout=5)
+        if proc.returncode != 0:
+            detail = log_tail[-1] if log_tail else f"exit code {proc.returncode}"
+            raise ValueError(f"Failed to decode audio: {detail}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def overlap_add(results, hop, overlap):
+    """Crossfade consecutive (sources, channels, n) windows; yields finished sample blocks.
+
+    The shared `overlap` samples are blended with complementary linear ramps, so a
+    block is emitted as soon as the window after it has been separated.
+    """
+    fade_in = np.linspace(0.0, 1.0, overlap + 2, dtype=np.float32)[1:-1]
+    tail = None
+    for sources in results:
+        sources = np.array(sources, dtype=np.float32)
+        if tail is not None:
+            n = min(overlap, sources.shape[-1])
+            sources[..., :n] = tail[..., :n] * (1.0 - fade_in[:n]) + sources[..., :n] * fade_in[:n]
+        if sources.shape[-1] > hop:
+            tail = sources[..., hop:]
+            yield sources[..., :hop]
+        else:
+            tail = None
+            yield sources
+    if tail is not None:
+        # Nothing follows the last window, so its tail is final as it is
+        yield tail
+
+
+def ordered_map(fn, items, workers):
+    """Ordered parallel map with at most `workers + 1` items in flight."""
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    with ThreadPoolExecutor(workers, thread_name_prefix="demucs-segment") as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) > workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class StemWriter:
+    """Appends 16-bit PCM for one stem to a WAV or FLAC file as it is produced.
+
+    WAV files start with placeholder sizes (so the file can be streamed while
+    growing) that are patched on close; FLAC is encoded by an ffmpeg process.
+    """
+
+    def __init__(self, path, sample_rate, channels, format="wav"):
+        self.path = path
+        self.format = format
+        self.frames = 0
+        self.channels = channels
+        self.sample_rate = sample_rate
+        if format == "flac":
+            self._proc = subprocess.Popen(
+                ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-f", "s16le", "-ar", str(sample_rate),
+                 "-ac", str(channels), "-i", "pipe:0", "-c:a", "flac", path],
+                stdin=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            self._file = self._proc.stdin
+        else:
+            self._proc = None
+            self._file = open(path, "wb")
+            self._file.write(self._header(0xFFFFFFFF - 36))
+            self._file.flush()
+
+    def _header(self, data_bytes):
+        block_align = self.channels * 2
+        return struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF", min(36 + data_bytes, 0xFFFFFFFF), b"WAVE", b"fmt ", 16, 1, self.channels,
+            self.sample_rate, self.sample_rate * block_align, block_align, 16, b"data", data_bytes
+        )
+
+    def write(self, samples):
+        pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+        self._file.write(pcm.T.tobytes())
+        self._file.flush()
+        self.frames += pcm.shape[1]
+
+    def close(self):
+        if self._proc is not None:
+            _, stderr = self._proc.communicate()
+            if self._proc.returncode != 0:
+                raise RuntimeError(f"FLAC encoding failed: {stderr.decode(errors='replace').strip()}")
+            return
+        self._file.seek(0)
+        self._file.write(self._header(self.frames * self.channels * 2))
+        self._file.close()
+
+
+class SeparationJobs:
+    """Chunked separations running in background threads, with their stem files on disk.
+
+    Only finished stem files and the uploaded input are kept per job; the last
+    `keep` jobs are retained and older finished ones are deleted.
+    """
+
+    def __init__(self, directory, keep=10):
+        self.directory = directory
+        self.keep = keep
+        self._jobs = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self):
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.directory, job_id)
+        os.makedirs(job_dir)
+        return job_id, job_dir
+
+    def start(self, job_id, job_dir, input_path, separate, model, stems, sample_rate, channels,
+              segment, overlap, workers, format="wav"):
+        """Separate `input_path` in windows of `segment` seconds.
+
+        `separate((channels, n) array)` returns a {stem: (channels, n)} dict;
+        the stems it returns must be `stems`.
+        """
+        job = {
+            "id": job_id,
+            "status": "running",
+            "model": model,
+            "stems": list(stems),
+            "format": format,
+            "segment": segment,
+            "overlap": overlap,
+            "workers": workers,
+            "duration": None,
+            "processed_seconds": 0.0,
+            "progress": 0.0,
+            "started": time.time(),
+            "finished": None,
+            "error": None,
+            "_dir": job_dir
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            for old_id in list(self._jobs)[:-self.keep]:
+                if self._jobs[old_id]["status"] != "running":
+                    shutil.rmtree(self._jobs.pop(old_id)["_dir"], ignore_errors=True)
+
+        hop = int(segment * sample_rate)
+        overlap_samples = int(overlap * sample_rate)
+
+        def separate_window(item):
+            _, window = item
+            result = separate(window)
+            return np.stack([result[stem] for stem in stems])
+
+        def run():
+            info = {}
+            writers = {}
+            try:
+                writers = {
+                    stem: StemWriter(self.stem_path(job, stem), sample_rate, channels, format)
+                    for stem in stems
+                }
+                windows = iter_segments(input_path, sample_rate, channels, hop, overlap_samples, info)
+                for block in overlap_add(ordered_map(separate_window, windows, workers), hop, overlap_samples):
+                    for stem, samples in zip(stems, block):
+                        writers[stem].write(samples)
+                    job["processed_seconds"] = round(writers[stems[0]].frames / sample_rate, 2)
+                    if info.get("duration"):
+                        job["duration"] = round(info["duration"], 2)
+                        job["progress"] = round(min(1.0, job["processed_seconds"] / info["duration"]), 4)
+                for writer in writers.values():
+                    writer.close()
+                job["progress"] = 1.0
+                job["status"] = "done"
+            except Exception as e:
+                for writer in writers.values():
+                    try:
+                        writer.close()
+                    except Exception:
+                        pass
+                job["error"] = str(e)
+                job["status"] = "error"
+            finally:
+                if os.path.exists(input_path):
+                    os.remove(input_path)
+            job["finished"] = time.time()
+
+        thread = threading.Thread(target=run, name=f"separate-{job_id[:8]}", daemon=True)
+        thread.start()
+        job["_thread"] = thread
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @staticmethod
+    def stem_path(job, stem):
+        return os.path.join(job["_dir"], f"{stem}.{job['format']}")
+
+    @staticmethod
+    def follow(job, stem, chunk_size=64 << 10, poll_seconds=0.2):
+        """Yield a stem file's bytes as they are written, until the job finishes."""
+        path = SeparationJobs.stem_path(job, stem)
+        while not os.path.exists(path):
+            if job["status"] != "running":
+                return
+            time.sleep(poll_seconds)
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(chunk_size)
+                if data:
+                    yield data
+                    continue
+                if job["status"] != "running":
+                    # Drain whatever was written between the last read and the end of the job
+                    data = f.read()
+                    if data:
+                        yield data
+                    return
+                time.sleep(poll_seconds)
+
+    @staticmethod
+    def describe(job):
+        return {key: value for key, value in job.items() if not key.startswith("_")}
@@ -1,141 +1,316 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 from realesrgan import RealESRGANer
 from basicsr.archs.rrdbnet_arch import RRDBNet
+from common.request_io import decode_pool, decode_image_cv2, send_bytes
+from common.model_cache import ModelCache, model_size_bytes, release_cuda_memory
+from common.serving import Gates
+from common.metrics import Metrics
+from tiling import tiled_enhance, auto_tile_size, cpu_workers_default, peak_rss_mb
+import output_formats
 import cv2
+import io
+import zipfile
 import numpy as np
-import tempfile
 import os
+import threading
+import time
 import torch
 
 app = Flask(__name__)
 CORS(app)
+metrics = Metrics(app, "esrgan")
 
-upsampler = None
+MODEL_BUDGET_MB = int(os.environ.get("ESRGAN_MODEL_BUDGET_MB", 1024))
+# Comma-separated model keys to load at startup, e.g. "x4,face"
+PRELOAD = [key.strip() for key in os.environ.get("ESRGAN_PRELOAD", "").split(",") if key.strip()]
+MODEL_KEYS = ["x2", "x4", "x8", "face"]
+BATCH_MAX_ITEMS = int(os.environ.get("ESRGAN_BATCH_MAX_ITEMS", 32))
+
+# Tile size in pixels, 0 for a single full-image pass, or "auto" to size tiles from available RAM
+TILE = os.environ.get("ESRGAN_TILE", "0" if torch.cuda.is_available() else "auto")
+TILE_OVERLAP = int(os.environ.get("ESRGAN_TILE_OVERLAP", 10))
+TILE_WORKERS = int(os.environ.get("ESRGAN_TILE_WORKERS", cpu_workers_default()))
+
+if TILE_WORKERS > 1 and not torch.cuda.is_available():
+    # Split the cores between tile workers instead of oversubscribing them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // TILE_WORKERS))
 
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({
         "status": "ok",
         "service": "esrgan",
-        "loaded": upsampler is not None,
+        "loaded": bool(models.loaded()),
+        "models": models.stats(),
         "gpu": torch.cuda.is_available(),
-        "scales": [2, 4, 8]
+        "scales": [2, 4, 8],
+        "formats": output_formats.AVAILABLE,
+        "tiling": {
+            "tile": TILE,
+            "overlap": TILE_OVERLAP,
+            "workers": TILE_WORKERS
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "admission": gates.stats()
     })
 
+def load_upsampler(scale):
+    print(f"Loading RealESRGAN model with scale {scale}x...")
+    
+    model = RRDBNet(
+        num_in_ch=3,
+        num_out_ch=3,
+        num_feat=64,
+        num_block=23,
+        num_grow_ch=32,
+        scale=scale
+    )
+    
+    return RealESRGANer(
+        scale=scale,
+        model_path=None,
+        model=model,
+        tile=0,
+        tile_pad=10,
+        pre_pad=0,
+        half=torch.cuda.is_available(),
+        gpu_id=0 if torch.cuda.is_available() else None
+    )
+
+def load_face_enhancer():
+    from gfpgan import GFPGANer
+    
+    print("Loading GFPGAN face enhancer...")
+    # Its own background upsampler: evicting "x2" then really frees x2, and the two never share enhance() state
+    return GFPGANer(
+        model_path='GFPGANv1.4.pth',
+        upscale=2,
+        arch='clean',
+        channel_multiplier=2,
+        bg_upsampler=load_upsampler(2)
+    )
+
+def load_model(key):
+    if key == "face":
+        return load_face_enhancer()
+    return load_upsampler(int(key[1:]))
+
+def model_bytes(model):
+    # The face enhancer's size includes the background upsampler it owns
+    background = getattr(model, "bg_upsampler", None)
+    return model_size_bytes(model) + (model_size_bytes(background) if background is not None else 0)
+
+# Every scale and the face enhancer stay resident until the memory budget forces them out
+models = ModelCache(load_model, MODEL_BUDGET_MB << 20, name="esrgan", size_of=model_bytes, on_evict=release_cuda_memory)
+
 def get_upsampler(scale=4):
-    global upsampler
-    if upsampler is None or upsampler.scale != scale:
-        print(f"Loading RealESRGAN model with scale {scale}x...")
-        
-        model = RRDBNet(
-            num_in_ch=3,
-            num_out_ch=3,
-            num_feat=64,
-            num_block=23,
-            num_grow_ch=32,
-            scale=scale
-        )
-        
-        upsampler = RealESRGANer(
-            scale=scale,
-            model_path=None,
-            model=model,
-            tile=0,
-            tile_pad=10,
-            pre_pad=0,
-            half=torch.cuda.is_available(),
-            gpu_id=0 if torch.cuda.is_available() else None
-        )
+    return models.get(f"x{scale}")
+
+# enhance() keeps per-call state on the RealESRGANer/GFPGANer (img, output, padding), so each
+# model runs one enhance() at a time whatever ESRGAN_MAX_CONCURRENCY admits; tiled passes only
+# call the network and need no lock
+model_locks = {}
+model_locks_guard = threading.Lock()
+
+def model_lock(key):
+    with model_locks_guard:
+        return model_locks.setdefault(key, threading.Lock())
+
+# A few upscales at a time per model; more wait in a short queue, the rest get a 429
+gates = Gates.from_env("ESRGAN", concurrency=1, queue_size=4)
+
+metrics.instrument_models(models)
+metrics.collect("admission", gates.stats, label="model")
+
+def scale_key():
+    # Unknown scales are rejected by the view; they queue with the default model until then
+    key = f"x{request.form.get('scale', 4)}"
+    return key if key in MODEL_KEYS else "x4"
+
+def resolve_tile(value, scale):
+    value = str(value if value not in (None, "") else TILE).lower()
+    if value == "auto":
+        return auto_tile_size(scale, TILE_WORKERS, half=torch.cuda.is_available())
+    tile = int(value)
+    if tile != 0 and tile < 32:
+        raise ValueError("tile must be 0, auto or at least 32 pixels")
+    return tile
+
+def upscale_image(img, scale, tile, overlap):
+    upsampler = get_upsampler(scale)
+    if tile == 0:
+        with model_lock(f"x{scale}"):
+            output, _ = upsampler.enhance(img, outscale=scale)
+        return output
+    
+    # Tiled path works on 3-channel BGR; grey and alpha are handled around it like enhance() does
+    h, w = img.shape[:2]
+    alpha = None
+    if img.ndim == 2:
+        bgr = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    elif img.shape[2] == 4:
+        bgr, alpha = img[:, :, :3], img[:, :, 3]
+    else:
+        bgr = img
+    
+    output = tiled_enhance(upsampler.model, bgr, scale, tile, overlap, upsampler.device, upsampler.half, TILE_WORKERS)
     
-    return upsampler
+    if img.ndim == 2:
+        output = cv2.cvtColor(output, cv2.COLOR_BGR2GRAY)
+    elif alpha is not None:
+        alpha = cv2.resize(alpha, (w * scale, h * scale), interpolation=cv2.INTER_LINEAR)
+        output = np.dstack([output, alpha])
+    return output
 
 @app.route("/upscale", methods=["POST"])
+@gates.admit(scale_key)
 def upscale():
     if "image" not in request.files:
         return jsonify({"error": "No image file provided"}), 400
     
-    image_file = request.files["image"]
+    data = request.files["image"].read()
     scale = int(request.form.get("scale", 4))
     
     if scale not in [2, 4, 8]:
         return jsonify({"error": "Scale must be 2, 4, or 8"}), 400
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as input_file:
-        image_file.save(input_file.name)
+    try:
+        tile = resolve_tile(request.form.get("tile"), scale)
+        overlap = int(request.form.get("tile_overlap", TILE_OVERLAP))
+        encoding = output_formats.parse_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        # Read image
+        with metrics.stage("decode"):
+            img = decode_pool.run(decode_image_cv2, data)
+        if img is None:
+            return jsonify({"error": "Failed to read image"}), 400
+        
+        # Upscale
+        start = time.perf_counter()
+        with metrics.stage("inference"):
+            output = upscale_image(img, scale, tile, overlap)
+        elapsed = time.perf_counter() - start
+        megapixels = img.shape[0] * img.shape[1] / 1e6
+        print(f"Upscaled {megapixels:.2f}MP x{scale} (tile {tile}) in {elapsed:.2f}s, "
+              f"{elapsed / megapixels:.2f}s/MP, peak RSS {peak_rss_mb():.0f}MB")
         
-        try:
-            # Read image
-            img = cv2.imread(input_file.name, cv2.IMREAD_UNCHANGED)
+        with metrics.stage("encode"):
+            encoded, mimetype, ext = decode_pool.run(output_formats.encode, output, **encoding)
+        response = send_bytes(
+            encoded,
+            mimetype=mimetype,
+            download_name=f"upscaled_{scale}x{ext}"
+        )
+        response.headers["X-Tile-Size"] = str(tile)
+        response.headers["X-Upscale-Seconds"] = f"{elapsed:.3f}"
+        response.headers["X-Seconds-Per-Megapixel"] = f"{elapsed / megapixels:.3f}"
+        response.headers["X-Peak-RSS-MB"] = f"{peak_rss_mb():.1f}"
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/upscale/batch", methods=["POST"])
+@gates.admit(scale_key)
+def upscale_batch():
+    image_files = request.files.getlist("images")
+    if not image_files:
+        return jsonify({"error": "No image files provided"}), 400
+    if len(image_files) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} images per batch"}), 400
+    
+    scale = int(request.form.get("scale", 4))
+    if scale not in [2, 4, 8]:
+        return jsonify({"error": "Scale must be 2, 4, or 8"}), 400
+    
+    try:
+        tile = resolve_tile(request.form.get("tile"), scale)
+        overlap = int(request.form.get("tile_overlap", TILE_OVERLAP))
+        encoding = output_formats.parse_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        get_upsampler(scale)
+        names = [os.path.splitext(os.path.basename(f.filename or f"image_{i}"))[0] for i, f in enumerate(image_files)]
+        # Decode ahead on the pool, upscale here, and encode image N on the pool while N+1 is upscaled
+        images = decode_pool.map(decode_image_cv2, [f.read() for f in image_files], prefetch=2)
+        encoded = []
+        failed = []
+        for name, img in zip(names, images):
             if img is None:
-                return jsonify({"error": "Failed to read image"}), 400
-            
-            # Upscale
-            upsampler = get_upsampler(scale)
-            output, _ = upsampler.enhance(img, outscale=scale)
-            
-            # Save output
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as output_file:
-                cv2.imwrite(output_file.name, output)
-                
-                return send_file(
-                    output_file.name,
-                    mimetype="image/png",
-                    as_attachment=True,
-                    download_name=f"upscaled_{scale}x.png"
-                )
-                
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-        finally:
-            os.unlink(input_file.name)
+                failed.append(name)
+                continue
+            with metrics.stage("inference"):
+                output = upscale_image(img, scale, tile, overlap)
+            encoded.append((name, decode_pool.submit(output_formats.encode, output, **encoding)))
+            del output
+        
+        buffer = io.BytesIO()
+        # Outputs are already compressed, so the archive only stores them
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zipf:
+            for i, (name, future) in enumerate(encoded):
+                with metrics.stage("encode"):
+                    data, _, ext = future.result()
+                zipf.writestr(f"{i:03d}_{name}_{scale}x{ext}", data)
+        
+        response = send_bytes(buffer.getvalue(), mimetype="application/zip", download_name=f"upscaled_{scale}x.zip")
+        response.headers["X-Upscaled-Count"] = str(len(encoded))
+        if failed:
+            response.headers["X-Failed-Images"] = ",".join(failed)
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @app.route("/upscale-face", methods=["POST"])
+@gates.admit("face")
 def upscale_face():
     if "image" not in request.files:
         return jsonify({"error": "No image file provided"}), 400
     
-    image_file = request.files["image"]
+    data = request.files["image"].read()
+    
+    try:
+        encoding = output_formats.parse_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as input_file:
-        image_file.save(input_file.name)
+    try:
+        # Read image
+        with metrics.stage("decode"):
+            img = decode_pool.run(decode_image_cv2, data)
+        if img is None:
+            return jsonify({"error": "Failed to read image"}), 400
+        
+        # Face enhancement
+        face_enhancer = models.get("face")
         
-        try:
-            from gfpgan import GFPGANer
-            
-            # Read image
-            img = cv2.imread(input_file.name, cv2.IMREAD_UNCHANGED)
-            
-            # Face enhancement
-            face_enhancer = GFPGANer(
-                model_path='GFPGANv1.4.pth',
-                upscale=2,
-                arch='clean',
-                channel_multiplier=2,
-                bg_upsampler=get_upsampler(2)
-            )
-            
+        with metrics.stage("inference"), model_lock("face"):
             _, _, output = face_enhancer.enhance(img, has_aligned=False, only_center_face=False, paste_back=True)
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as output_file:
-                cv2.imwrite(output_file.name, output)
-                
-                return send_file(
-                    output_file.name,
-                    mimetype="image/png",
-                    as_attachment=True,
-                    download_name="face_enhanced.png"
-                )
-                
-        except ImportError:
-            return jsonify({"error": "GFPGAN not installed for face enhancement"}), 500
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-        finally:
-            os.unlink(input_file.name)
+        
+        with metrics.stage("encode"):
+            encoded, mimetype, ext = decode_pool.run(output_formats.encode, output, **encoding)
+        return send_bytes(
+            encoded,
+            mimetype=mimetype,
+            download_name=f"face_enhanced{ext}"
+        )
+    except ImportError:
+        return jsonify({"error": "GFPGAN not installed for face enhancement"}), 500
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
     print("Starting RealESRGAN API server")
     print(f"GPU available: {torch.cuda.is_available()}")
+    if PRELOAD:
+        unknown = [key for key in PRELOAD if key not in MODEL_KEYS]
+        if unknown:
+            print(f"Ignoring unknown ESRGAN_PRELOAD keys: {', '.join(unknown)}")
+        print(f"Preloading models: {', '.join(k for k in PRELOAD if k in MODEL_KEYS)}")
+        models.preload([key for key in PRELOAD if key in MODEL_KEYS])
     print("Listening on http://0.0.0.0:8070")
     app.run(host="0.0.0.0", port=8070)
@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+FORMATS = {
+    "png": (".png", "image/png"),
+    "webp": (".webp", "image/webp"),
+    "jpeg": (".jpg", "image/jpeg"),
+    "avif": (".avif", "image/avif")
+}
+ALIASES = {"jpg": "jpeg"}
+
+
+def _can_encode(ext):
+    try:
+        ok, _ = cv2.imencode(ext, np.zeros((8, 8, 3), dtype=np.uint8))
+        return bool(ok)
+    except cv2.error:
+        return False
+
+
+# AVIF depends on how OpenCV was built, so probe it once
+AVAILABLE = [name for name, (ext, _) in FORMATS.items() if name != "avif" or _can_encode(ext)]
+
+
+def parse_options(form):
+    """Validate format/quality/png_compression form fields."""
+    fmt = form.get("format", "png").lower()
+    fmt = ALIASES.get(fmt, fmt)
+    if fmt not in AVAILABLE:
+        raise ValueError(f"format must be one of {', '.join(AVAILABLE)}")
+    quality = int(form.get("quality", 90))
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    png_compression = int(form.get("png_compression", 3))
+    if not 0 <= png_compression <= 9:
+        raise ValueError("png_compression must be between 0 and 9")
+    return {"format": fmt, "quality": quality, "png_compression": png_compression}
+
+
+def encode(image, format="png", quality=90, png_compression=3):
+    """Encode a BGR(A) array in memory; returns (bytes, mimetype, extension)."""
+    ext, mimetype = FORMATS[format]
+    if format != "png" and image.dtype == np.uint16:
+        # Only PNG keeps 16 bits per channel
+        image = (image >> 8).astype(np.uint8)
+    if format == "jpeg" and image.ndim == 3 and image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+    if format == "png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    elif format == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif format == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    else:
+        params = [getattr(cv2, "IMWRITE_AVIF_QUALITY", 512), quality]
+
+    ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f"Failed to encode image as {format}")
+    return buffer.tobytes(), mimetype, ext
@@ -0,0 +1,104 @@
+import os
+import resource
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+MIN_TILE = 128
+MAX_TILE = 1024
+
+
+def available_memory_bytes():
+    """MemAvailable, capped by the cgroup (container) limit when there is one."""
+    available = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        with open("/sys/fs/cgroup/memory.current") as f:
+            current = int(f.read().strip())
+        if limit != "max":
+            headroom = int(limit) - current
+            available = headroom if available is None else min(available, headroom)
+    except (OSError, ValueError):
+        pass
+    return available if available is not None else 2 << 30
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def auto_tile_size(scale, workers=1, half=False, budget_bytes=None):
+    """Largest tile (multiple of 32) whose RRDBNet activations fit the memory budget.
+
+    RRDB dense blocks keep up to ~192 feature channels at tile resolution, and the
+    upsampling tail holds 64 channels at the output resolution, per worker.
+    """
+    if budget_bytes is None:
+        budget_bytes = available_memory_bytes() // 2
+    bytes_per_pixel = (192 + 64 * scale * scale) * (2 if half else 4) * 2
+    tile = int((budget_bytes / max(1, workers) / bytes_per_pixel) ** 0.5) // 32 * 32
+    return max(MIN_TILE, min(MAX_TILE, tile))
+
+
+def tiled_enhance(model, img, scale, tile, overlap=10, device="cpu", half=False, workers=1):
+    """Upscale an HxWx3 BGR image tile by tile into a preallocated output.
+
+    Each tile is run with `overlap` pixels of context on every side and only its
+    centre is written back, so seams match a full-image pass. Peak memory is one
+    input and one output buffer plus the activations of `workers` tiles.
+    """
+    max_value = 65535.0 if img.dtype == np.uint16 else 255.0
+    h, w = img.shape[:2]
+    output = np.empty((h * scale, w * scale, 3), dtype=img.dtype)
+    # The x2 and x1 RRDBNet variants pixel-unshuffle their input
+    mod = {1: 4, 2: 2}.get(scale, 1)
+    boxes = [
+        (y, x, min(y + tile, h), min(x + tile, w))
+        for y in range(0, h, tile)
+        for x in range(0, w, tile)
+    ]
+
+    def run(box):
+        y0, x0, y1, x1 = box
+        py0, px0 = max(y0 - overlap, 0), max(x0 - overlap, 0)
+        py1, px1 = min(y1 + overlap, h), min(x1 + overlap, w)
+        crop = np.ascontiguousarray(img[py0:py1, px0:px1, ::-1], dtype=np.float32)
+        tensor = torch.from_numpy(crop).permute(2, 0, 1).unsqueeze(0).div_(max_value)
+        pad_h, pad_w = (-tensor.shape[2]) % mod, (-tensor.shape[3]) % mod
+        if pad_h or pad_w:
+            tensor = F.pad(tensor, (0, pad_w, 0, pad_h), mode="replicate")
+        tensor = tensor.to(device)
+        if half:
+            tensor = tensor.half()
+
+        with torch.no_grad():
+            result = model(tensor)
+
+        result = result[0, :, :(py1 - py0) * scale, :(px1 - px0) * scale].float().clamp_(0, 1).mul_(max_value).round_()
+        result = result.permute(1, 2, 0).cpu().numpy().astype(img.dtype)
+        oy, ox = (y0 - py0) * scale, (x0 - px0) * scale
+        output[y0 * scale:y1 * scale, x0 * scale:x1 * scale] = \
+            result[oy:oy + (y1 - y0) * scale, ox:ox + (x1 - x0) * scale, ::-1]
+
+    if workers > 1:
+        with ThreadPoolExecutor(workers, thread_name_prefix="esrgan-tile") as pool:
+            list(pool.map(run, boxes))
+    else:
+        for box in boxes:
+            run(box)
+    return output
+
+
+def cpu_workers_default():
+    return 1 if torch.cuda.is_available() else max(1, min(4, (os.cpu_count() or 1) // 4))
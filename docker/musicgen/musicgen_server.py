@@ -1,16 +1,68 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from audiocraft.models import MusicGen
-from audiocraft.data.audio import audio_write
-import tempfile
+from audiocraft.data.audio_utils import normalize_audio
+from common.request_io import decode_pool, decode_audio, wav_bytes, send_bytes, wav_header, pcm16, format_event
+from common.model_cache import ModelCache
+from common.serving import Gates
+from common.metrics import Metrics
+from scheduler import GenerationScheduler, DEFAULT_PARAMS
+from streaming import generate_window, window_plan, keep_tail, audio_event
+import queue
+import zipfile
+import io
 import os
+import time
 import torch
 
 app = Flask(__name__)
 CORS(app)
+metrics = Metrics(app, "musicgen")
 
-model = None
 model_size = os.environ.get("MODEL_SIZE", "small")
+MAX_DURATION = 30
+MAX_PROMPTS = int(os.environ.get("MUSICGEN_MAX_PROMPTS", "8"))
+# Streaming and long-form generation: a short first window, then chunks that each
+# continue the last CONTEXT seconds, so a window never exceeds what the model can generate
+MAX_STREAM_DURATION = float(os.environ.get("MUSICGEN_MAX_STREAM_DURATION", "600"))
+STREAM_FIRST_SECONDS = float(os.environ.get("MUSICGEN_STREAM_FIRST_SECONDS", "5"))
+CONTEXT_SECONDS = float(os.environ.get("MUSICGEN_CONTEXT_SECONDS", "10"))
+STREAM_CHUNK_SECONDS = min(float(os.environ.get("MUSICGEN_STREAM_CHUNK_SECONDS", "10")), MAX_DURATION - CONTEXT_SECONDS)
+
+def load_model(size):
+    print(f"Loading MusicGen model: {size}")
+    return MusicGen.get_pretrained(f"facebook/musicgen-{size}")
+
+# Single-flight: concurrent cold requests wait for one load instead of each loading the model
+models = ModelCache(load_model, name="musicgen")
+
+def get_model():
+    return models.get(model_size)
+
+scheduler = GenerationScheduler(
+    get_model,
+    max_batch=int(os.environ.get("MUSICGEN_BATCH_MAX_SIZE", "4")),
+    max_wait=float(os.environ.get("MUSICGEN_BATCH_WAIT_MS", "50")) / 1000,
+    duration_slack=float(os.environ.get("MUSICGEN_BATCH_DURATION_SLACK", "5"))
+)
+# Enough requests in flight to fill a batch; beyond a short queue the rest get a 429
+gates = Gates.from_env("MUSICGEN", concurrency=scheduler.max_batch, queue_size=scheduler.max_batch * 2)
+
+metrics.instrument_models(models)
+metrics.collect("scheduler", scheduler.stats)
+metrics.collect("admission", gates.stats, label="model")
+
+def generation_params(data):
+    """Sampling parameters from a request, typed like set_generation_params expects."""
+    params = {}
+    for name, default in DEFAULT_PARAMS.items():
+        if name in data:
+            value = data[name]
+            if isinstance(default, bool):
+                params[name] = value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes")
+            else:
+                params[name] = type(default)(value)
+    return params
 
 @app.route("/health", methods=["GET"])
 def health():
@@ -18,17 +70,20 @@ def health():
         "status": "ok",
         "service": "musicgen",
         "model": f"facebook/musicgen-{model_size}",
-        "loaded": model is not None,
-        "gpu": torch.cuda.is_available()
+        "loaded": models.is_loaded(model_size),
+        "gpu": torch.cuda.is_available(),
+        "scheduler": scheduler.stats(),
+        "admission": gates.stats()
     })
 
+def encode_wav(wav, sample_rate):
+    # Same loudness normalisation audio_write applies, without the temp file
+    wav = normalize_audio(wav.float(), strategy="loudness", sample_rate=sample_rate)
+    return wav_bytes(wav.numpy(), sample_rate)
+
 @app.route("/generate", methods=["POST"])
+@gates.admit(model_size)
 def generate():
-    global model
-    if model is None:
-        print(f"Loading MusicGen model: {model_size}")
-        model = MusicGen.get_pretrained(f"facebook/musicgen-{model_size}")
-    
     data = request.json
     if not data:
         return jsonify({"error": "No JSON data provided"}), 400
@@ -37,60 +92,241 @@ def generate():
     if not prompt:
         return jsonify({"error": "No prompt provided"}), 400
     
-    duration = min(data.get("duration", 10), 30)  # Max 30 seconds
+    try:
+        duration = min(float(data.get("duration", 10)), MAX_DURATION)  # Max 30 seconds
+        params = generation_params(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
     
     try:
-        model.set_generation_params(duration=duration)
-        wav = model.generate([prompt])
+        # Queued with other requests' prompts and generated in one batch (the batching wait counts as inference)
+        with metrics.stage("inference"):
+            wav = scheduler.submit([prompt], duration, params).result()
+        with metrics.stage("encode"):
+            audio = encode_wav(wav[0], get_model().sample_rate)
         
-        with tempfile.TemporaryDirectory() as tmpdir:
-            output_path = os.path.join(tmpdir, "music")
-            audio_write(output_path, wav[0].cpu(), model.sample_rate, strategy="loudness")
-            
-            return send_file(
-                f"{output_path}.wav",
-                mimetype="audio/wav",
-                as_attachment=True,
-                download_name="generated_music.wav"
-            )
+        return send_bytes(
+            audio,
+            mimetype="audio/wav",
+            download_name="generated_music.wav"
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/generate/variations", methods=["POST"])
+@gates.admit(model_size)
+def generate_variations():
+    """Several clips in one batched pass: `count` variations of `prompt`, or one per entry of `prompts`."""
+    data = request.json
+    if not data:
+        return jsonify({"error": "No JSON data provided"}), 400
+    
+    prompts = data.get("prompts")
+    if prompts is None:
+        prompt = data.get("prompt", "")
+        if not prompt:
+            return jsonify({"error": "No prompt provided"}), 400
+        try:
+            prompts = [prompt] * int(data.get("count", 4))
+        except (TypeError, ValueError):
+            return jsonify({"error": "count must be an integer"}), 400
+    if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p for p in prompts):
+        return jsonify({"error": "prompts must be a list of non-empty strings"}), 400
+    if len(prompts) > MAX_PROMPTS:
+        return jsonify({"error": f"At most {MAX_PROMPTS} prompts per request"}), 400
+    
+    try:
+        duration = min(float(data.get("duration", 10)), MAX_DURATION)
+        params = generation_params(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
+    
+    try:
+        with metrics.stage("inference"):
+            wavs = scheduler.submit(prompts, duration, params).result()
+        sample_rate = get_model().sample_rate
+        
+        buffer = io.BytesIO()
+        with metrics.stage("encode"), zipfile.ZipFile(buffer, "w") as zipf:
+            for i, wav in enumerate(wavs):
+                zipf.writestr(f"variation_{i + 1}.wav", encode_wav(wav, sample_rate))
+        
+        return send_bytes(buffer.getvalue(), mimetype="application/zip", download_name="variations.zip")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route("/continue", methods=["POST"])
+@gates.admit(model_size)
 def continue_music():
-    global model
-    if model is None:
-        model = MusicGen.get_pretrained(f"facebook/musicgen-{model_size}")
-    
     if "audio" not in request.files:
         return jsonify({"error": "No audio file provided"}), 400
     
     prompt = request.form.get("prompt", "")
-    duration = min(int(request.form.get("duration", 10)), 30)
-    audio = request.files["audio"]
+    try:
+        duration = min(int(request.form.get("duration", 10)), MAX_DURATION)
+        params = {**DEFAULT_PARAMS, **generation_params(request.form)}
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
+    data = request.files["audio"].read()
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as input_file:
-        audio.save(input_file.name)
+    try:
+        sample_rate = get_model().sample_rate
+        # Decoded in memory at the model rate; chroma extraction only needs mono
+        with metrics.stage("decode"):
+            melody = torch.from_numpy(decode_pool.run(decode_audio, data, sample_rate))
+        
+        def continue_with_chroma(model):
+            model.set_generation_params(duration=duration, **params)
+            return model.generate_with_chroma([prompt], melody[None, None], model.sample_rate)
         
+        # Runs on the scheduler thread, between batches, so the generation params stay its own
+        with metrics.stage("inference"):
+            wav = scheduler.run(continue_with_chroma).result()
+        with metrics.stage("encode"):
+            audio = encode_wav(wav[0].cpu(), sample_rate)
+        
+        return send_bytes(
+            audio,
+            mimetype="audio/wav",
+            download_name="continued_music.wav"
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def stream_generation(prompt, duration, params, format, tail=None):
+    """Generate window by window on the scheduler thread, sending each window's audio as soon as it is decoded.
+    
+    Only the last CONTEXT_SECONDS are kept between windows, so memory does not grow with the duration.
+    """
+    model = get_model()
+    sample_rate = model.sample_rate
+    channels = tail.shape[0] if tail is not None else getattr(model, "audio_channels", 1)
+    context_samples = int(CONTEXT_SECONDS * sample_rate)
+    params = {**DEFAULT_PARAMS, **params}
+    plan = window_plan(duration, STREAM_CHUNK_SECONDS if tail is not None else STREAM_FIRST_SECONDS, STREAM_CHUNK_SECONDS)
+    
+    endpoint = metrics.endpoint()
+    
+    def generate():
+        context = tail
+        start = 0.0
+        if format == "wav":
+            yield wav_header(sample_rate, channels)
         try:
-            import torchaudio
-            melody, sr = torchaudio.load(input_file.name)
-            
-            model.set_generation_params(duration=duration)
-            wav = model.generate_with_chroma([prompt], melody[None].expand(1, -1, -1), sr)
-            
-            with tempfile.TemporaryDirectory() as tmpdir:
-                output_path = os.path.join(tmpdir, "continued_music")
-                audio_write(output_path, wav[0].cpu(), model.sample_rate, strategy="loudness")
-                
-                return send_file(
-                    f"{output_path}.wav",
-                    mimetype="audio/wav",
-                    as_attachment=True,
-                    download_name="continued_music.wav"
+            for index, seconds in enumerate(plan):
+                progress = queue.Queue()
+                # Timed by hand: the wait below yields progress events to the client
+                window_start = time.perf_counter()
+                future = scheduler.run(
+                    lambda model, seconds=seconds, context=context: generate_window(
+                        model, prompt, seconds, params, context,
+                        lambda generated, total: progress.put(generated / max(total, 1))
+                    )
                 )
-        finally:
-            os.unlink(input_file.name)
+                while not future.done():
+                    try:
+                        fraction = progress.get(timeout=0.25)
+                    except queue.Empty:
+                        continue
+                    # The model reports every token; only the latest value is sent
+                    while not progress.empty():
+                        fraction = progress.get_nowait()
+                    if format != "wav":
+                        yield format_event({
+                            "type": "progress",
+                            "window": index,
+                            "seconds": round(start + fraction * seconds, 2),
+                            "duration": duration
+                        }, format)
+                
+                new = future.result()
+                metrics.observe_stage(endpoint, "inference", time.perf_counter() - window_start)
+                context = keep_tail(context, new, context_samples)
+                if format == "wav":
+                    yield pcm16(new.numpy())
+                else:
+                    yield format_event(audio_event(index, start, new, sample_rate), format)
+                start += new.shape[-1] / sample_rate
+            
+            if format != "wav":
+                yield format_event({"type": "done", "duration": round(start, 3), "windows": len(plan)}, format)
+        except Exception as e:
+            if format == "wav":
+                # Headers are gone; all that is left is ending the stream early
+                print(f"Streaming generation failed: {e}")
+            else:
+                yield format_event({"type": "error", "error": str(e)}, format)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype={"wav": "audio/wav", "sse": "text/event-stream"}.get(format, "application/x-ndjson"),
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Sample-Rate": str(sample_rate),
+            "X-Windows": str(len(plan))
+        }
+    )
+
+def stream_options(values):
+    """(duration, params, format) for the streaming endpoints; raises ValueError."""
+    format = values.get("format", "ndjson")
+    if format not in ("ndjson", "sse", "wav"):
+        raise ValueError("format must be ndjson, sse or wav")
+    duration = float(values.get("duration", 10))
+    if duration <= 0:
+        raise ValueError("duration must be positive")
+    return min(duration, MAX_STREAM_DURATION), generation_params(values), format
+
+@app.route("/generate/stream", methods=["POST"])
+@gates.admit(model_size)
+def generate_stream():
+    # Audio is sent window by window, as base64 WAV chunks between progress events
+    # (NDJSON or SSE) or as one open-ended WAV; durations beyond 30 seconds are
+    # generated as windowed continuations
+    data = request.json
+    if not data:
+        return jsonify({"error": "No JSON data provided"}), 400
+    
+    prompt = data.get("prompt", "")
+    if not prompt:
+        return jsonify({"error": "No prompt provided"}), 400
+    
+    try:
+        duration, params, format = stream_options(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return stream_generation(prompt, duration, params, format)
+
+@app.route("/continue/stream", methods=["POST"])
+@gates.admit(model_size)
+def continue_stream():
+    # Continues the uploaded audio itself (not just its melody) for `duration`
+    # seconds, streamed like /generate/stream; only the new audio is sent
+    if "audio" not in request.files:
+        return jsonify({"error": "No audio file provided"}), 400
+    
+    prompt = request.form.get("prompt", "")
+    try:
+        duration, params, format = stream_options(request.form)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    data = request.files["audio"].read()
+    
+    try:
+        model = get_model()
+        channels = getattr(model, "audio_channels", 1)
+        with metrics.stage("decode"):
+            audio = decode_pool.run(decode_audio, data, model.sample_rate, channels)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    tail = torch.from_numpy(audio).reshape(channels, -1)[..., -int(CONTEXT_SECONDS * model.sample_rate):]
+    if tail.shape[-1] == 0:
+        return jsonify({"error": "Audio is empty"}), 400
+    
+    return stream_generation(prompt, duration, params, format, tail)
 
 if __name__ == "__main__":
     print(f"Starting MusicGen API server with model size: {model_size}")
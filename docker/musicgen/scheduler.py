@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# audiocraft's own defaults, so requests that leave a parameter out still group together
+DEFAULT_PARAMS = {"use_sampling": True, "top_k": 250, "top_p": 0.0, "temperature": 1.0, "cfg_coef": 3.0}
+
+
+class _Job:
+    def __init__(self, prompts=None, duration=None, params=None, call=None):
+        self.prompts = prompts or []
+        self.duration = duration
+        self.params = params
+        self.call = call
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+    @property
+    def key(self):
+        return tuple(sorted(self.params.items())) if self.params is not None else None
+
+
+class GenerationScheduler:
+    """Runs every MusicGen call on one worker thread, batching compatible text prompts.
+
+    The first queued request waits up to `max_wait` seconds for others with
+    the same sampling parameters and a duration within `duration_slack`
+    seconds; together they become one `generate` call of at most `max_batch`
+    prompts at the longest duration, and each result is cut back to its own
+    duration (generation is autoregressive, so a prefix is a complete clip).
+    Generation parameters are set on the model right before each call, so
+    requests never see each other's settings.
+    """
+
+    def __init__(self, get_model, max_batch=4, max_wait=0.05, duration_slack=5.0):
+        self.get_model = get_model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.duration_slack = duration_slack
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.batches = 0
+        self.requests = 0
+        self.prompts = 0
+        self.busy_seconds = 0.0
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, name="musicgen-scheduler", daemon=True)
+            self._thread.start()
+
+    def submit(self, prompts, duration, params=None):
+        """Future of one (channels, samples) tensor per prompt."""
+        job = _Job(list(prompts), duration, {**DEFAULT_PARAMS, **(params or {})})
+        with self._cond:
+            self._start()
+            self._pending.append(job)
+            self._cond.notify()
+        return job.future
+
+    def run(self, call):
+        """Future of call(model), run alone on the worker thread (for calls that cannot be batched)."""
+        job = _Job(call=call)
+        with self._cond:
+            self._start()
+            self._pending.append(job)
+            self._cond.notify()
+        return job.future
+
+    def _compatible(self, first):
+        batch, size = [], 0
+        shortest = longest = first.duration
+        for job in self._pending:
+            if job.key != first.key:
+                continue
+            low, high = min(shortest, job.duration), max(longest, job.duration)
+            if batch and (high - low > self.duration_slack or size + len(job.prompts) > self.max_batch):
+                continue
+            batch.append(job)
+            size += len(job.prompts)
+            shortest, longest = low, high
+        return batch, size
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            first = self._pending[0]
+            if first.call is not None:
+                self._pending.popleft()
+                return [first]
+            deadline = first.enqueued + self.max_wait
+            while True:
+                batch, size = self._compatible(first)
+                remaining = deadline - time.monotonic()
+                if size >= self.max_batch or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            for job in batch:
+                self._pending.remove(job)
+            return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            start = time.perf_counter()
+            try:
+                model = self.get_model()
+                if batch[0].call is not None:
+                    batch[0].future.set_result(batch[0].call(model))
+                else:
+                    self._generate(model, batch)
+            except BaseException as e:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            self.busy_seconds += time.perf_counter() - start
+
+    def _generate(self, model, batch):
+        duration = max(job.duration for job in batch)
+        prompts = [prompt for job in batch for prompt in job.prompts]
+        model.set_generation_params(duration=duration, **batch[0].params)
+        wavs = []
+        # A single multi-prompt request can be larger than max_batch
+        for i in range(0, len(prompts), self.max_batch):
+            wavs.extend(model.generate(prompts[i:i + self.max_batch]).cpu())
+
+        self.batches += 1
+        self.requests += len(batch)
+        self.prompts += len(prompts)
+        for job in batch:
+            samples = int(job.duration * model.sample_rate)
+            job.future.set_result([wav[..., :samples] for wav in wavs[:len(job.prompts)]])
+            wavs = wavs[len(job.prompts):]
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._pending)
+        return {
+            "queued": queued,
+            "batches": self.batches,
+            "requests": self.requests,
+            "prompts": self.prompts,
+            "average_batch": round(self.prompts / self.batches, 2) if self.batches else 0,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "max_batch": self.max_batch,
+            "max_wait": self.max_wait
+        }
@@ -0,0 +1,56 @@
+import base64
+import torch
+from common.request_io import wav_bytes
+
+
+def generate_window(model, prompt, seconds, params, tail=None, progress=None):
+    """`seconds` of new audio as a (channels, samples) tensor.
+
+    Without a tail this is a plain generation; with one, the model continues
+    `tail` (the last few seconds so far) and only the audio after it is
+    returned. Either way the model never holds more than tail + seconds.
+    """
+    callback = getattr(model, "set_custom_progress_callback", None)
+    if progress and callback:
+        callback(progress)
+    try:
+        if tail is None:
+            model.set_generation_params(duration=seconds, **params)
+            return model.generate([prompt])[0].cpu()
+        context = tail.shape[-1] / model.sample_rate
+        model.set_generation_params(duration=context + seconds, **params)
+        device = getattr(model, "device", "cpu")
+        out = model.generate_continuation(tail[None].to(device), model.sample_rate, [prompt or None])
+        return out[0].cpu()[..., tail.shape[-1]:]
+    finally:
+        if progress and callback:
+            callback(None)
+
+
+def window_plan(duration, first_seconds, chunk_seconds):
+    """Seconds of new audio per window: a short first window for a quick start, then even chunks."""
+    plan = []
+    remaining = duration
+    size = first_seconds
+    while remaining > 1e-6:
+        step = min(size, remaining)
+        plan.append(step)
+        remaining -= step
+        size = chunk_seconds
+    return plan
+
+
+def audio_event(index, start, samples, sample_rate):
+    return {
+        "type": "audio",
+        "index": index,
+        "start": round(start, 3),
+        "duration": round(samples.shape[-1] / sample_rate, 3),
+        "wav": base64.b64encode(wav_bytes(samples.numpy(), sample_rate)).decode()
+    }
+
+
+def keep_tail(tail, new, samples):
+    """The last `samples` of tail + new; all that later windows need as context."""
+    joined = new if tail is None else torch.cat([tail, new], dim=-1)
+    return joined[..., -samples:]
@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "clip"))
+from dedup import group_duplicates  # noqa: E402
+from vector_index import VectorIndex  # noqa: E402
+
+
+class GroupDuplicatesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        rng = np.random.default_rng(0)
+        base = rng.standard_normal((4, 32)).astype(np.float32)
+        # i0, i1 and i2 are copies of one vector; i3..i5 are unrelated
+        vectors = np.concatenate([np.repeat(base[:1], 3, axis=0), rng.standard_normal((3, 32)).astype(np.float32)])
+        self.index = VectorIndex(self.dir.name, dtype="float32")
+        self.index.upsert([f"i{n}" for n in range(6)], vectors)
+
+    def test_full_scan_counts_each_pair_once(self):
+        result = group_duplicates(self.index, threshold=0.99, block_rows=2)
+        self.assertEqual(result["pairs"], 3)
+        self.assertEqual([item["id"] for item in result["groups"][0]["items"]], ["i0", "i1", "i2"])
+
+    def test_query_rows_matching_each_other_count_once(self):
+        result = group_duplicates(self.index, threshold=0.99, ids=["i0", "i1", "i2"], block_rows=2)
+        self.assertEqual(result["pairs"], 3)
+        result = group_duplicates(self.index, threshold=0.99, ids=["i0", "i1"])
+        # i0-i1 once, and each of them with i2
+        self.assertEqual(result["pairs"], 3)
+        self.assertEqual(result["groups"][0]["size"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
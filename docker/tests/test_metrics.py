@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import unittest
+from flask import Flask, Response, stream_with_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import Histogram, Metrics, flatten  # noqa: E402
+
+
+def parse(text):
+    """{family: type} and {sample line without value: value} of a Prometheus text page."""
+    types, samples = {}, {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, family, kind = line.split()
+            types[family] = kind
+        elif line:
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return types, samples
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        self.metrics = Metrics(app, "test")
+
+        @app.route("/work", methods=["POST"])
+        def work():
+            with self.metrics.stage("inference"):
+                time.sleep(0.03)
+            return "done"
+
+        @app.route("/stream")
+        def stream():
+            def generate():
+                with self.metrics.stage("encode"):
+                    yield "a"
+            return Response(stream_with_context(generate()))
+
+        self.client = app.test_client()
+
+    def request(self, method, path):
+        # A server closes every response once sent, which is when it is counted
+        response = self.client.open(path, method=method)
+        body = response.get_data(as_text=True)
+        response.close()
+        return body
+
+    def render(self):
+        return parse(self.request("GET", "/metrics"))
+
+    def test_requests_are_counted_and_timed(self):
+        self.request("POST", "/work")
+        self.request("POST", "/work")
+        types, samples = self.render()
+        self.assertEqual(types["requests_total"], "counter")
+        self.assertEqual(types["request_duration_seconds"], "histogram")
+        labels = 'service="test",endpoint="/work",method="POST",status="200"'
+        self.assertEqual(samples[f"requests_total{{{labels}}}"], 2)
+        self.assertEqual(samples[f"request_duration_seconds_count{{{labels}}}"], 2)
+        self.assertEqual(samples['requests_in_flight{service="test"}'], 1)
+
+    def test_stage_durations(self):
+        self.request("POST", "/work")
+        types, samples = self.render()
+        self.assertEqual(types["stage_duration_seconds"], "histogram")
+        prefix = 'stage_duration_seconds_{}{{service="test",endpoint="/work",stage="inference"'
+        self.assertEqual(samples[prefix.format("count") + "}"], 1)
+        self.assertGreaterEqual(samples[prefix.format("sum") + "}"], 0.03)
+        # Buckets are cumulative: the 10ms one is empty, the 50ms one holds the call
+        self.assertEqual(samples[prefix.format("bucket") + ',le="0.01"}'], 0)
+        self.assertEqual(samples[prefix.format("bucket") + ',le="0.05"}'], 1)
+        self.assertEqual(samples[prefix.format("bucket") + ',le="+Inf"}'], 1)
+        self.assertIn(prefix.format("count").replace("inference", "response_write") + "}", samples)
+
+    def test_stream_stage_recorded_once_sent(self):
+        self.assertEqual(self.request("GET", "/stream"), "a")
+        _, samples = self.render()
+        self.assertEqual(samples['stage_duration_seconds_count{service="test",endpoint="/stream",stage="encode"}'], 1)
+
+    def test_each_family_is_one_group_after_its_type(self):
+        self.request("POST", "/work")
+        self.metrics.collect("cache", lambda: {"hits": 3, "loaded": ["a", "b"], "ready": True, "name": "x"})
+        lines = self.request("GET", "/metrics").splitlines()
+        families = [line.split()[2] for line in lines if line.startswith("# TYPE ")]
+        self.assertEqual(len(families), len(set(families)))
+        _, samples = parse("\n".join(lines))
+        self.assertEqual(samples['test_cache_hits{service="test"}'], 3)
+        self.assertEqual(samples['test_cache_loaded_count{service="test"}'], 2)
+        self.assertEqual(samples['test_cache_ready{service="test"}'], 1)
+
+    def test_failing_collector_is_skipped(self):
+        self.metrics.collect("broken", lambda: 1 / 0)
+        self.assertIn("requests_in_flight", self.render()[0])
+
+
+class FlattenTest(unittest.TestCase):
+    def test_per_key_stats_become_labels(self):
+        stats = {"base": {"active": 1, "hold_seconds": None}, "tiny": {"active": 0, "hold_seconds": 0.5}}
+        self.assertEqual(list(flatten("admission", stats, label="model")), [
+            ("admission_active", {"model": "base"}, 1),
+            ("admission_active", {"model": "tiny"}, 0),
+            ("admission_hold_seconds", {"model": "tiny"}, 0.5)
+        ])
+
+    def test_numeric_dict_values_are_labelled(self):
+        samples = list(flatten("models", {"loads": 2, "load_seconds": {"a": 1.5, "b": 2.0}}, label="model"))
+        self.assertEqual(samples, [
+            ("models_loads", {}, 2),
+            ("models_load_seconds", {"model": "a"}, 1.5),
+            ("models_load_seconds", {"model": "b"}, 2.0)
+        ])
+
+
+class HistogramTest(unittest.TestCase):
+    def test_overflow_counts_only_in_inf(self):
+        histogram = Histogram(buckets=(1, 2))
+        histogram.observe(0.5)
+        histogram.observe(5)
+        samples = list(histogram.samples("h", {}))
+        self.assertEqual([value for _, _, value in samples], [1, 1, 2, 5.5, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
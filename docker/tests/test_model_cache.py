@@ -0,0 +1,67 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.model_cache import ModelCache  # noqa: E402
+
+
+class ModelCacheTest(unittest.TestCase):
+    def test_concurrent_gets_load_once(self):
+        calls = []
+
+        def load(key):
+            calls.append(key)
+            time.sleep(0.1)
+            return object()
+
+        cache = ModelCache(load, size_of=lambda model: 0)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("a"))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, ["a"])
+        self.assertEqual(len(set(map(id, results))), 1)
+
+    def test_failed_load_is_retried(self):
+        attempts = []
+
+        def load(key):
+            attempts.append(key)
+            if len(attempts) == 1:
+                raise RuntimeError("no weights")
+            return key
+
+        cache = ModelCache(load, size_of=lambda model: 0)
+        with self.assertRaises(RuntimeError):
+            cache.get("a")
+        self.assertEqual(cache.get("a"), "a")
+        self.assertEqual(cache.stats()["loading"], [])
+
+    def test_least_recently_used_is_evicted_over_budget(self):
+        sizes = {"a": 40, "b": 40, "c": 40}
+        evicted = []
+        cache = ModelCache(lambda key: key, budget_bytes=100, size_of=sizes.get,
+                           on_evict=lambda key, model: evicted.append(key))
+        cache.get("a")
+        cache.get("b")
+        cache.get("a")
+        cache.get("c")
+        self.assertEqual(evicted, ["b"])
+        self.assertEqual(cache.loaded(), ["a", "c"])
+        self.assertEqual(cache.stats()["bytes"], 80)
+
+    def test_model_over_budget_on_its_own_is_kept(self):
+        cache = ModelCache(lambda key: key, budget_bytes=10, size_of=lambda model: 50)
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual(cache.loaded(), ["b"])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "demucs"))
+from separation_cache import SeparationCache  # noqa: E402
+
+SOURCES = ("drums", "bass", "other", "vocals")
+
+
+def separation(seconds=1.0, sample_rate=8000):
+    rng = np.random.default_rng(0)
+    return {name: rng.uniform(-0.5, 0.5, (2, int(seconds * sample_rate))).astype(np.float32) for name in SOURCES}, sample_rate
+
+
+class SeparationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_concurrent_misses_separate_once(self):
+        cache = SeparationCache(self.dir.name)
+        calls = []
+
+        def separate():
+            calls.append(1)
+            time.sleep(0.1)
+            return separation()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_create("a", separate))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(cache.stats()["collapsed"], 3)
+
+    def test_hit_is_read_from_disk(self):
+        cache = SeparationCache(self.dir.name)
+        first = cache.get_or_create("a", separation)
+        reopened = SeparationCache(self.dir.name)
+        second = reopened.get_or_create("a", lambda: self.fail("should be cached"))
+        self.assertEqual(second.wav("vocals"), first.wav("vocals"))
+        self.assertEqual(reopened.stats()["hits"], 1)
+
+    def test_entry_in_use_is_not_evicted(self):
+        cache = SeparationCache(self.dir.name)
+        cache.get_or_create("a", separation)
+        # Room for exactly one separation from now on
+        cache.max_bytes = cache.stats()["bytes"]
+
+        with cache.use("a", lambda: self.fail("should be cached")) as pinned:
+            cache.get_or_create("b", separation)
+            self.assertTrue(pinned.wav("drums"))
+            self.assertEqual(cache.stats()["entries"], 2)
+        # Over budget once the pin is released, so the older entry goes
+        self.assertEqual(cache.stats()["entries"], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.dir.name, "a")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from flask import Flask, Response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.serving import DeadlineExceeded, Gate, Gates, Overloaded  # noqa: E402
+
+
+def wait_until(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+class GateTest(unittest.TestCase):
+    def test_full_queue_is_rejected_with_retry_after(self):
+        gate = Gate("m", concurrency=1, queue_size=0)
+        gate.enter()
+        with self.assertRaises(Overloaded) as caught:
+            gate.enter()
+        self.assertGreaterEqual(caught.exception.retry_after, 1)
+        gate.leave(3.0)
+        # Retry-After follows how long callers recently held the gate
+        gate.enter()
+        with self.assertRaises(Overloaded) as caught:
+            gate.enter()
+        self.assertEqual(caught.exception.retry_after, 3)
+        self.assertEqual(gate.stats()["rejected"], 2)
+
+    def test_waiters_are_admitted_in_order(self):
+        gate = Gate("m", concurrency=1, queue_size=4)
+        gate.enter()
+        order = []
+
+        def wait(n):
+            with gate.slot():
+                order.append(n)
+
+        threads = []
+        for n in range(3):
+            threads.append(threading.Thread(target=wait, args=(n,)))
+            threads[-1].start()
+            wait_until(lambda: gate.stats()["queued"] == n + 1)
+        gate.leave()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [0, 1, 2])
+        stats = gate.stats()
+        self.assertEqual((stats["active"], stats["queued"], stats["admitted"]), (0, 0, 4))
+
+    def test_deadline_gives_up_and_leaves_the_queue(self):
+        gate = Gate("m", concurrency=1, queue_size=4)
+        gate.enter()
+        with self.assertRaises(DeadlineExceeded):
+            gate.enter(deadline=time.monotonic() + 0.05)
+        stats = gate.stats()
+        self.assertEqual((stats["queued"], stats["expired"]), (0, 1))
+
+    def test_unbounded_enter_skips_the_queue_limit(self):
+        gate = Gate("m", concurrency=1, queue_size=0)
+        gate.enter()
+        thread = threading.Thread(target=gate.enter, kwargs={"bounded": False})
+        thread.start()
+        wait_until(lambda: gate.stats()["queued"] == 1)
+        gate.leave()
+        thread.join()
+        self.assertEqual(gate.stats()["active"], 1)
+
+
+class AdmitTest(unittest.TestCase):
+    def setUp(self):
+        self.gates = Gates(concurrency=1, queue_size=0)
+        app = Flask(__name__)
+
+        @app.route("/run")
+        @self.gates.admit("m")
+        def run():
+            return "ok"
+
+        @app.route("/stream")
+        @self.gates.admit(lambda: "s")
+        def stream():
+            def generate():
+                yield "a"
+                yield "b"
+
+            return Response(generate())
+
+        self.client = app.test_client()
+
+    def test_busy_model_answers_429(self):
+        gate = self.gates.get("m")
+        gate.enter()
+        response = self.client.get("/run")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], str(response.get_json()["retry_after"]))
+        gate.leave()
+        self.assertEqual(self.client.get("/run").status_code, 200)
+
+    def test_missed_deadline_answers_503(self):
+        self.gates.queue_size = 1
+        gate = self.gates.get("m")
+        gate.enter()
+        response = self.client.get("/run", headers={"X-Request-Timeout": "0.05"})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        gate.leave()
+
+    def test_stream_keeps_its_slot_until_closed(self):
+        response = self.client.get("/stream", buffered=False)
+        self.assertEqual(self.gates.get("s").stats()["active"], 1)
+        self.assertEqual(response.get_data(as_text=True), "ab")
+        response.close()
+        self.assertEqual(self.gates.get("s").stats()["active"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "clip"))
+from tagging import VocabularyStore  # noqa: E402
+
+
+def encode_texts(texts):
+    return np.random.default_rng(len(texts)).standard_normal((len(texts), 8))
+
+
+class VocabularyStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.store = VocabularyStore(self.dir.name, encode_texts, "test-model")
+
+    def files(self, suffix):
+        return sorted(f for f in os.listdir(self.dir.name) if f.endswith(suffix))
+
+    def test_delete_removes_definition_and_matrix(self):
+        self.store.register("animals", ["cat", "dog"])
+        self.assertEqual(len(self.files(".npy")), 1)
+        self.assertTrue(self.store.delete("animals"))
+        self.assertEqual(self.files(".json"), [])
+        self.assertEqual(self.files(".npy"), [])
+        self.assertFalse(self.store.delete("animals"))
+
+    def test_delete_keeps_matrix_still_shared(self):
+        self.store.register("animals", ["cat", "dog"])
+        self.store.register("pets", ["cat", "dog"])
+        self.store.delete("animals")
+        self.assertEqual(len(self.files(".npy")), 1)
+        self.assertIn(self.store.score(np.ones((1, 8)), self.store.get("pets"))[0][0]["tag"], ("cat", "dog"))
+
+
+if __name__ == "__main__":
+    unittest.main()
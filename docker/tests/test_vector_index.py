@@ -0,0 +1,46 @@
+"""Run from docker/: python3 -m unittest discover -s tests"""
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "clip"))
+from vector_index import VectorIndex  # noqa: E402
+
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.vectors = np.random.default_rng(0).standard_normal((20, 16)).astype(np.float32)
+        self.ids = [f"i{n}" for n in range(20)]
+
+    def index(self, block_rows=65536):
+        index = VectorIndex(self.dir.name, dtype="float32", block_rows=block_rows)
+        index.upsert(self.ids, self.vectors)
+        return index
+
+    def test_nearest_first(self):
+        results = self.index().search(self.vectors[3], k=5)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[0]["id"], "i3")
+        scores = [result["score"] for result in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_excluded_ids_do_not_take_a_slot(self):
+        for block_rows in (65536, 7):
+            results = self.index(block_rows).search(self.vectors[0], k=5, exclude_ids=["i0"])
+            self.assertEqual(len(results), 5)
+            self.assertNotIn("i0", [result["id"] for result in results])
+
+    def test_deleted_rows_are_skipped(self):
+        index = self.index()
+        index.delete(["i3"])
+        results = index.search(self.vectors[3], k=19)
+        self.assertEqual(len(results), 19)
+        self.assertNotIn("i3", [result["id"] for result in results])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import importlib.util
+import os
+import threading
+import time
+import unittest
+
+# Every service has its own streaming.py, so load this one under its own name
+_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "xtts", "streaming.py")
+_spec = importlib.util.spec_from_file_location("xtts_streaming", _path)
+streaming = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(streaming)
+
+
+class PipelinedTest(unittest.TestCase):
+    def test_results_in_order(self):
+        self.assertEqual(list(streaming.pipelined(lambda x: x * 2, range(5), ahead=2)), [0, 2, 4, 6, 8])
+
+    def test_error_reaches_consumer(self):
+        def fn(x):
+            if x == 2:
+                raise ValueError("bad item")
+            return x
+
+        with self.assertRaises(ValueError):
+            list(streaming.pipelined(fn, range(5)))
+
+    def test_close_waits_for_the_item_in_progress(self):
+        busy = threading.Event()
+
+        def fn(x):
+            busy.set()
+            time.sleep(0.2)
+            busy.clear()
+            return x
+
+        stream = streaming.pipelined(fn, range(10))
+        next(stream)
+        # The worker is now computing the next items; a disconnect closes the generator
+        stream.close()
+        self.assertFalse(busy.is_set())
+        self.assertEqual([t for t in threading.enumerate() if t.name == "xtts-stream"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
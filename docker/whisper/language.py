@@ -0,0 +1,57 @@
+import numpy as np
+import torch
+import whisper
+
+WINDOW_SECONDS = whisper.audio.CHUNK_LENGTH
+# Windows quieter than this (dBFS) carry no language information
+SILENCE_DB = -50.0
+
+
+def window_offsets(duration, windows=1, window_seconds=WINDOW_SECONDS):
+    """Start times of `windows` evenly spaced windows; just the start when the length is unknown."""
+    if windows <= 1 or not duration or duration <= window_seconds:
+        return [0.0]
+    last = duration - window_seconds
+    return [round(last * i / (windows - 1), 3) for i in range(windows)]
+
+
+def detect_batch(model, clips, batch_size=16):
+    """Language probabilities for each 16 kHz clip, batching the encoder pass."""
+    results = []
+    for i in range(0, len(clips), batch_size):
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(np.asarray(clip, dtype=np.float32)), model.dims.n_mels)
+            for clip in clips[i:i + batch_size]
+        ]).to(model.device)
+        _, probs = model.detect_language(mels)
+        results.extend(probs if isinstance(probs, list) else [probs])
+    return results
+
+
+def is_silent(clip):
+    if len(clip) == 0:
+        return True
+    rms = float(np.sqrt(np.mean(np.square(clip, dtype=np.float64))))
+    return 20 * np.log10(rms + 1e-10) < SILENCE_DB
+
+
+def combine(window_probs, clips):
+    """Average the windows' distributions, ignoring silent windows unless all are silent."""
+    weights = np.array([0.0 if is_silent(clip) else 1.0 for clip in clips])
+    if not weights.any():
+        weights[:] = 1.0
+    combined = {}
+    for probs, weight in zip(window_probs, weights):
+        for language, p in probs.items():
+            combined[language] = combined.get(language, 0.0) + weight * float(p)
+    total = float(weights.sum())
+    return {language: p / total for language, p in combined.items()}
+
+
+def summarize(probs, top=5):
+    detected = max(probs, key=probs.get)
+    return {
+        "language": detected,
+        "confidence": probs[detected],
+        "all_probabilities": dict(sorted(probs.items(), key=lambda x: x[1], reverse=True)[:top])
+    }
@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Set in each worker process by _init_worker
+_model = None
+
+
+def _init_worker(model_name, threads):
+    global _model
+    import torch
+    import whisper
+    torch.set_num_threads(threads)
+    _model = whisper.load_model(model_name)
+
+
+def _transcribe(audio, options):
+    result = _model.transcribe(audio, **options)
+    return {"text": result["text"], "segments": result["segments"], "language": result.get("language")}
+
+
+def _ping(_=None):
+    return os.getpid()
+
+
+class TranscriptionPool:
+    """Worker processes that each hold their own copy of a whisper model.
+
+    Each worker gets an equal share of the CPU threads, so independent chunks
+    run side by side instead of contending for one model. Workers are spawned
+    (not forked) because the parent has already started torch's thread pools.
+    """
+
+    def __init__(self, model_name, workers, threads=None):
+        self.model_name = model_name
+        self.workers = max(1, workers)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                print(f"Starting {self.workers} whisper workers ({self.threads} threads each) for {self.model_name}")
+                self._executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self.threads)
+                )
+            return self._executor
+
+    def warmup(self):
+        """Start every worker and wait for its model to load."""
+        pool = self._pool()
+        list(pool.map(_ping, range(self.workers * 2)))
+
+    def submit(self, audio, **options):
+        return self._pool().submit(_transcribe, audio, options)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,67 @@
+import threading
+
+# Parameter counts, used for ordering by quality and for sizing worker pools
+PARAMETERS = {
+    "tiny": 39_000_000,
+    "base": 74_000_000,
+    "small": 244_000_000,
+    "medium": 769_000_000,
+    "turbo": 809_000_000,
+    "large": 1_550_000_000
+}
+# Starting guesses for seconds of compute per second of audio on CPU; replaced by measurements
+CPU_REALTIME_FACTOR = {"tiny": 0.03, "base": 0.06, "small": 0.2, "medium": 0.6, "turbo": 0.4, "large": 1.2}
+GPU_SPEEDUP = 10.0
+
+
+def family(name):
+    """'small.en' -> 'small', 'large-v3' -> 'large'."""
+    base = name.split(".")[0]
+    for size in PARAMETERS:
+        if base == size or base.startswith(size + "-"):
+            return size
+    return base
+
+
+def parameter_bytes(name, bytes_per_parameter=4):
+    return PARAMETERS.get(family(name), PARAMETERS["large"]) * bytes_per_parameter
+
+
+class ModelRouter:
+    """Picks the largest model expected to finish a file within a latency target.
+
+    Expected latency is duration x real-time factor; the factors start from
+    per-size guesses and follow measured transcriptions (moving average).
+    """
+
+    def __init__(self, names, gpu=False, smoothing=0.3):
+        self.names = sorted(names, key=lambda name: PARAMETERS.get(family(name), 0))
+        self.smoothing = smoothing
+        speedup = GPU_SPEEDUP if gpu else 1.0
+        self.factors = {name: CPU_REALTIME_FACTOR.get(family(name), 1.0) / speedup for name in names}
+        self.measured = {name: 0 for name in names}
+        self._lock = threading.Lock()
+
+    def choose(self, duration, target_seconds):
+        with self._lock:
+            fitting = [name for name in self.names if duration * self.factors[name] <= target_seconds]
+            if fitting:
+                return fitting[-1]
+            return min(self.names, key=lambda name: self.factors[name])
+
+    def record(self, name, audio_seconds, elapsed):
+        if name not in self.factors or audio_seconds < 1:
+            return
+        factor = elapsed / audio_seconds
+        with self._lock:
+            if self.measured[name]:
+                factor = (1 - self.smoothing) * self.factors[name] + self.smoothing * factor
+            self.factors[name] = factor
+            self.measured[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {"realtime_factor": round(self.factors[name], 4), "measured": self.measured[name]}
+                for name in self.names
+            }
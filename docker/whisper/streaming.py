@@ -0,0 +1,94 @@
+import numpy as np
+
+# Segments ending this close to the end of a window may be cut off mid-word,
+# so they are decoded again at the start of the next window
+EDGE_SECONDS = 1.0
+PROMPT_CHARS = 200
+
+
+def shift_segment(segment, offset, segment_id):
+    """Copy of a whisper segment moved `offset` seconds later in the recording."""
+    segment = dict(segment)
+    segment["id"] = segment_id
+    segment["start"] = round(segment["start"] + offset, 3)
+    segment["end"] = round(segment["end"] + offset, 3)
+    # seek is in mel frames (100 per second)
+    segment["seek"] = segment.get("seek", 0) + int(round(offset * 100))
+    if segment.get("words"):
+        segment["words"] = [
+            {**word, "start": round(word["start"] + offset, 3), "end": round(word["end"] + offset, 3)}
+            for word in segment["words"]
+        ]
+    return segment
+
+
+def stream_segments(transcribe, blocks, sample_rate=16000, window_seconds=30.0, language=None, **options):
+    """Transcribe audio blocks as they arrive, yielding events as segments are finalised.
+
+    `transcribe(audio, **options)` is a whisper-style transcribe call. Audio is
+    decoded one window at a time: segments that end well inside the window are
+    emitted, and the rest of the window is carried over to the next one, which
+    is prompted with the text emitted so far. Events are
+    {"type": "language", ...} once, then {"type": "segment", ...} per segment
+    and a final {"type": "done", ...}.
+    """
+    window = int(window_seconds * sample_rate)
+    buffer = np.zeros(0, dtype=np.float32)
+    offset = 0.0
+    total = 0
+    texts = []
+    state = {"language": language, "next_id": 0}
+
+    def step(final):
+        nonlocal buffer, offset
+        audio = buffer[:window]
+        duration = len(audio) / sample_rate
+        prompt = "".join(texts)[-PROMPT_CHARS:] or None
+        result = transcribe(audio, language=state["language"], initial_prompt=prompt, **options)
+
+        events = []
+        if state["language"] is None:
+            # Fix the language after the first window so later windows skip detection
+            state["language"] = result.get("language") or "en"
+            events.append({"type": "language", "language": state["language"]})
+
+        segments = result["segments"]
+        if final and len(buffer) <= window:
+            done, cut = segments, len(buffer) / sample_rate
+        else:
+            done = [s for s in segments if s["end"] <= duration - EDGE_SECONDS]
+            # A single segment spanning the whole window still has to make progress
+            if not done:
+                done = segments
+            cut = done[-1]["end"] if done and done[-1]["end"] > 0 else duration
+
+        for segment in done:
+            segment = shift_segment(segment, offset, state["next_id"])
+            state["next_id"] += 1
+            texts.append(segment["text"])
+            events.append({"type": "segment", **segment})
+
+        cut_samples = max(1, min(len(buffer), int(round(cut * sample_rate))))
+        buffer = buffer[cut_samples:]
+        offset += cut_samples / sample_rate
+        return events
+
+    for block in blocks:
+        total += len(block)
+        buffer = np.concatenate([buffer, np.asarray(block, dtype=np.float32)])
+        while len(buffer) >= window:
+            yield from step(final=False)
+
+    while len(buffer) > 0:
+        yield from step(final=True)
+
+    if state["language"] is None:
+        state["language"] = language or "unknown"
+        yield {"type": "language", "language": state["language"]}
+    yield {
+        "type": "done",
+        "text": "".join(texts),
+        "language": state["language"],
+        "segments": state["next_id"],
+        "duration": round(total / sample_rate, 3)
+    }
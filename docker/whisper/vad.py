@@ -0,0 +1,124 @@
+import numpy as np
+
+FRAME_SECONDS = 0.03
+
+
+def frame_energy_db(audio, sample_rate, frame_seconds=FRAME_SECONDS):
+    frame = max(1, int(sample_rate * frame_seconds))
+    n = len(audio) // frame
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:n * frame].reshape(n, frame).astype(np.float32)
+    return 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+
+def speech_regions(audio, sample_rate=16000, margin_db=12.0, floor_db=-55.0, min_speech=0.25,
+                   min_silence=0.6, padding=0.2, max_region=30.0):
+    """(start, end) sample ranges that contain speech, found from frame energy.
+
+    A frame is speech when it is `margin_db` above the recording's noise floor
+    (its 10th percentile) and above `floor_db`. Gaps shorter than
+    `min_silence` are bridged, blips shorter than `min_speech` dropped, and
+    regions longer than `max_region` seconds are split at their quietest frame.
+    """
+    energy = frame_energy_db(audio, sample_rate)
+    if energy.size == 0:
+        return []
+    frame = int(sample_rate * FRAME_SECONDS)
+    threshold = max(float(np.percentile(energy, 10)) + margin_db, floor_db)
+    voiced = energy > threshold
+
+    regions = []
+    start = None
+    for i, is_voiced in enumerate(np.append(voiced, False)):
+        if is_voiced and start is None:
+            start = i
+        elif not is_voiced and start is not None:
+            regions.append([start, i])
+            start = None
+
+    merged = []
+    gap = int(min_silence / FRAME_SECONDS)
+    for region in regions:
+        if merged and region[0] - merged[-1][1] < gap:
+            merged[-1][1] = region[1]
+        else:
+            merged.append(region)
+    merged = [r for r in merged if (r[1] - r[0]) * FRAME_SECONDS >= min_speech]
+
+    limit = int(max_region / FRAME_SECONDS)
+    split = []
+    for start, end in merged:
+        while end - start > limit:
+            # Cut in the quietest frame of the last quarter rather than mid-word
+            window = energy[start + limit * 3 // 4:start + limit]
+            cut = start + limit * 3 // 4 + int(np.argmin(window))
+            split.append((start, cut))
+            start = cut
+        split.append((start, end))
+
+    pad = int(padding * sample_rate)
+    result = []
+    for start, end in split:
+        start, end = max(0, start * frame - pad), min(len(audio), end * frame + pad)
+        if result and start <= result[-1][1]:
+            result[-1] = (result[-1][0], max(end, result[-1][1]))
+        else:
+            result.append((start, end))
+    return result
+
+
+def pack_chunks(regions, sample_rate=16000, max_chunk=30.0):
+    """Group consecutive regions into chunks of at most `max_chunk` seconds of speech."""
+    limit = int(max_chunk * sample_rate)
+    chunks = []
+    current, length = [], 0
+    for start, end in regions:
+        if current and length + (end - start) > limit:
+            chunks.append(current)
+            current, length = [], 0
+        current.append((start, end))
+        length += end - start
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class Chunk:
+    """Speech regions cut out of a recording and joined, with the silence in between removed."""
+
+    def __init__(self, audio, regions, sample_rate=16000):
+        self.regions = regions
+        self.sample_rate = sample_rate
+        self.audio = np.concatenate([audio[start:end] for start, end in regions])
+        # Where each region starts in the joined audio, in seconds
+        lengths = [end - start for start, end in regions]
+        self._joined = np.concatenate([[0], np.cumsum(lengths)[:-1]]) / sample_rate
+        self._original = np.array([start for start, _ in regions]) / sample_rate
+
+    @property
+    def start(self):
+        return float(self._original[0])
+
+    def to_original(self, t, end=False):
+        """Map a time in the joined chunk audio back to the original recording.
+
+        An end time that falls exactly on a join belongs to the earlier region.
+        """
+        i = max(0, int(np.searchsorted(self._joined, t, side="left" if end else "right")) - 1)
+        return float(self._original[i] + (t - self._joined[i]))
+
+
+def remap_segment(segment, chunk, segment_id):
+    segment = dict(segment)
+    segment["id"] = segment_id
+    segment["start"] = round(chunk.to_original(segment["start"]), 3)
+    segment["end"] = round(max(segment["start"], chunk.to_original(segment["end"], end=True)), 3)
+    # seek is in mel frames (100 per second)
+    segment["seek"] = segment.get("seek", 0) + int(round(chunk.start * 100))
+    if segment.get("words"):
+        segment["words"] = [
+            {**word, "start": round(chunk.to_original(word["start"]), 3), "end": round(chunk.to_original(word["end"], end=True), 3)}
+            for word in segment["words"]
+        ]
+    return segment
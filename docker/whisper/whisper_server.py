@@ -1,86 +1,451 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import whisper
-import tempfile
+from common.request_io import decode_pool, decode_audio, decode_audio_file, iter_audio, media_duration, format_event
+from common.model_cache import ModelCache, release_cuda_memory
+from common.serving import Gates
+from common.metrics import Metrics
+from streaming import stream_segments
+from vad import speech_regions, pack_chunks, Chunk, remap_segment
+from parallel import TranscriptionPool
+from language import WINDOW_SECONDS, window_offsets, detect_batch, combine, summarize
+from routing import ModelRouter, parameter_bytes
+from concurrent.futures import Future
+from contextlib import nullcontext
+import numpy as np
 import os
+import tempfile
+import threading
+import time
+import torch
 
 app = Flask(__name__)
 CORS(app)
+metrics = Metrics(app, "whisper")
+
+# Default model, plus the others requests may pick with "model" (or have routed with model=auto)
+DEFAULT_MODEL = os.environ.get("WHISPER_MODEL", "base")
+MODELS = list(dict.fromkeys(
+    [DEFAULT_MODEL] + [name.strip() for name in os.environ.get("WHISPER_MODELS", "tiny,base,small").split(",") if name.strip()]
+))
+MODEL_BUDGET_MB = int(os.environ.get("WHISPER_MODEL_BUDGET_MB", 2048))
+# Comma-separated models loaded and warmed at startup; /health reports ready once they are
+PRELOAD = [name.strip() for name in os.environ.get("WHISPER_PRELOAD", DEFAULT_MODEL).split(",") if name.strip()]
+# model=auto picks the largest model expected to transcribe the file within this many seconds
+LATENCY_TARGET = float(os.environ.get("WHISPER_LATENCY_TARGET", 60))
+# Seconds of audio decoded per step in streaming mode (whisper's own window is 30s)
+STREAM_WINDOW = float(os.environ.get("WHISPER_STREAM_WINDOW", 30))
+
+# Drop silence before transcribing ("auto" = only without a GPU) and split speech into chunks of this many seconds
+VAD = os.environ.get("WHISPER_VAD", "auto").lower()
+VAD_CHUNK_SECONDS = float(os.environ.get("WHISPER_VAD_CHUNK", 30))
+# Worker processes that transcribe VAD chunks in parallel, each with its own model; 1 = in this process
+WORKERS = int(os.environ.get("WHISPER_WORKERS", 1 if torch.cuda.is_available() else max(1, min(4, (os.cpu_count() or 1) // 2))))
+
+def load_model(name):
+    print(f"Loading Whisper model: {name}")
+    return whisper.load_model(name)
+
+# The in-process models and the worker pools split WHISPER_MODEL_BUDGET_MB between them. By default
+# each side gets its share of the copies of a model: WORKERS in the pool for every one in this process.
+POOL_BUDGET_MB = max(0, min(MODEL_BUDGET_MB - 1, int(os.environ.get(
+    "WHISPER_POOL_BUDGET_MB", MODEL_BUDGET_MB * WORKERS // (WORKERS + 1) if WORKERS > 1 else 0
+))))
+IN_PROCESS_BUDGET_MB = MODEL_BUDGET_MB - POOL_BUDGET_MB
 
-model = None
-model_name = os.environ.get("WHISPER_MODEL", "base")
+# Loaded once per name even when the first requests arrive together; LRU-evicted over the budget
+models = ModelCache(load_model, IN_PROCESS_BUDGET_MB << 20, name="whisper", on_evict=release_cuda_memory)
+# Worker pools hold a model copy per process, and every copy counts against their share
+pools = ModelCache(
+    lambda name: TranscriptionPool(name, WORKERS),
+    POOL_BUDGET_MB << 20,
+    name="whisper-workers",
+    size_of=lambda pool: pool.workers * parameter_bytes(pool.model_name),
+    on_evict=lambda name, pool: pool.shutdown()
+)
+router = ModelRouter(MODELS, gpu=torch.cuda.is_available())
+warmup = {"pending": [], "failed": {}, "seconds": None}
+# Requests per model run as many at a time as there are workers; a short queue waits
+gates = Gates.from_env("WHISPER", concurrency=WORKERS, queue_size=8)
+
+metrics.instrument_models(models)
+metrics.instrument_models(pools, name="worker_pools")
+metrics.collect("routing", router.stats, label="model")
+metrics.collect("admission", gates.stats, label="model")
+
+def requested_model():
+    # model=auto (or an unknown name, rejected by the view) queues with the default model
+    name = request.values.get("model")
+    if name is None and request.is_json:
+        data = request.get_json(silent=True)
+        name = data.get("model") if isinstance(data, dict) else None
+    return name if name in MODELS else DEFAULT_MODEL
+
+# Language detection decodes only 30s windows: this many spread across each file (max DETECT_MAX_WINDOWS)
+DETECT_WINDOWS = int(os.environ.get("WHISPER_DETECT_WINDOWS", 1))
+DETECT_MAX_WINDOWS = int(os.environ.get("WHISPER_DETECT_MAX_WINDOWS", 8))
+DETECT_BATCH_MAX_ITEMS = int(os.environ.get("WHISPER_DETECT_BATCH_MAX_ITEMS", 64))
+# Colon-separated directories that "path" requests may read from (paths are refused when unset)
+MEDIA_ROOTS = [os.path.realpath(p) for p in os.environ.get("WHISPER_MEDIA_ROOTS", "").split(":") if p]
+
+def is_ready():
+    return not warmup["pending"] and not warmup["failed"]
 
 @app.route("/health", methods=["GET"])
 def health():
+    # Liveness: the process answers. Readiness: the preloaded models are loaded and warm.
     return jsonify({
         "status": "ok",
         "service": "whisper",
-        "model": model_name,
-        "loaded": model is not None
+        "live": True,
+        "ready": is_ready(),
+        "model": DEFAULT_MODEL,
+        "models": MODELS,
+        "loaded": bool(models.loaded()),
+        "cache": models.stats(),
+        "warmup": warmup,
+        "routing": {"latency_target": LATENCY_TARGET, "models": router.stats()},
+        "vad": VAD,
+        "workers": WORKERS,
+        "admission": gates.stats()
     })
 
+@app.route("/health/ready", methods=["GET"])
+def health_ready():
+    body = {"ready": is_ready(), "warmup": warmup}
+    return jsonify(body), 200 if body["ready"] else 503
+
+def resolve_model(value, duration=None):
+    """Requested model name; "auto" is routed by audio duration (the default model when unknown)."""
+    value = value or DEFAULT_MODEL
+    if value == "auto":
+        return router.choose(duration, LATENCY_TARGET) if duration is not None else DEFAULT_MODEL
+    if value not in MODELS:
+        raise ValueError(f"model must be auto or one of {', '.join(MODELS)}")
+    return value
+
+def get_model(name=None):
+    return models.get(name or DEFAULT_MODEL)
+
+# The in-process model keeps its decoding state (kv-cache hooks) on itself, so it decodes one
+# request at a time; only the worker pools, with a model per process, transcribe in parallel
+model_locks = {}
+model_locks_guard = threading.Lock()
+
+def model_lock(name=None):
+    with model_locks_guard:
+        return model_locks.setdefault(name or DEFAULT_MODEL, threading.Lock())
+
+def warm_up():
+    start = time.perf_counter()
+    for name in list(warmup["pending"]):
+        try:
+            model = get_model(name)
+            # One encoder pass so the first request does not pay for lazy allocations
+            with model_lock(name):
+                detect_batch(model, [np.zeros(whisper.audio.SAMPLE_RATE, dtype=np.float32)])
+            if WORKERS > 1:
+                pools.get(name).warmup()
+        except Exception as e:
+            print(f"Warming up {name} failed: {e}")
+            warmup["failed"][name] = str(e)
+        warmup["pending"].remove(name)
+    warmup["seconds"] = round(time.perf_counter() - start, 3)
+    print(f"Whisper ready in {warmup['seconds']}s")
+
+def start_warmup():
+    unknown = [name for name in PRELOAD if name not in MODELS]
+    if unknown:
+        print(f"Ignoring unknown WHISPER_PRELOAD models: {', '.join(unknown)}")
+    warmup["pending"] = [name for name in PRELOAD if name in MODELS]
+    preload_bytes = sum(parameter_bytes(name) for name in warmup["pending"])
+    if MODEL_BUDGET_MB and preload_bytes > IN_PROCESS_BUDGET_MB << 20 or (WORKERS > 1 and preload_bytes * WORKERS > POOL_BUDGET_MB << 20):
+        print(f"WHISPER_PRELOAD models exceed their share of WHISPER_MODEL_BUDGET_MB ({IN_PROCESS_BUDGET_MB}MB "
+              f"in process, {POOL_BUDGET_MB}MB for worker pools); the oldest will be evicted")
+    threading.Thread(target=warm_up, name="whisper-warmup", daemon=True).start()
+
+def use_vad(value):
+    value = (value or VAD).lower()
+    if value == "auto":
+        return not torch.cuda.is_available()
+    return value in ("1", "true", "yes", "on")
+
+def vad_transcribe(audio, options, name=None):
+    """Transcribe only the speech in `audio`, chunk by chunk, with timestamps mapped back.
+
+    Without worker pools the chunks run on the in-process model: hold model_lock(name).
+    """
+    name = name or DEFAULT_MODEL
+    pool = pools.get(name) if WORKERS > 1 else None
+    sample_rate = whisper.audio.SAMPLE_RATE
+    start = time.perf_counter()
+    regions = speech_regions(audio, sample_rate, max_region=VAD_CHUNK_SECONDS)
+    chunks = [Chunk(audio, group, sample_rate) for group in pack_chunks(regions, sample_rate, VAD_CHUNK_SECONDS)]
+    if not chunks:
+        return {"text": "", "segments": [], "language": options.get("language", "unknown")}
+    
+    def submit(chunk, opts):
+        if pool is not None:
+            return pool.submit(chunk.audio, **opts)
+        future = Future()
+        future.set_result(get_model(name).transcribe(chunk.audio, **opts))
+        return future
+    
+    # Detect the language on the first chunk so every chunk is transcribed in the same one
+    results = []
+    rest = chunks
+    if "language" not in options:
+        results.append(submit(chunks[0], options).result())
+        options = {**options, "language": results[0].get("language")}
+        rest = chunks[1:]
+    pending = [submit(chunk, options) for chunk in rest]
+    results.extend(future.result() for future in pending)
+    
+    segments = []
+    for chunk, result in zip(chunks, results):
+        for segment in result["segments"]:
+            segments.append(remap_segment(segment, chunk, len(segments)))
+    
+    speech = sum(len(chunk.audio) for chunk in chunks) / sample_rate
+    print(f"VAD kept {speech:.1f}s of {len(audio) / sample_rate:.1f}s in {len(chunks)} chunks, "
+          f"transcribed in {time.perf_counter() - start:.2f}s")
+    return {
+        "text": "".join(result["text"] for result in results),
+        "segments": segments,
+        "language": options.get("language") or "unknown"
+    }
+
 @app.route("/transcribe", methods=["POST"])
+@gates.admit(requested_model)
 def transcribe():
-    global model
-    if model is None:
-        print(f"Loading Whisper model: {model_name}")
-        model = whisper.load_model(model_name)
-    
     if "audio" not in request.files:
         return jsonify({"error": "No audio file provided"}), 400
     
-    audio = request.files["audio"]
+    data = request.files["audio"].read()
     language = request.form.get("language", None)
+    requested = request.form.get("model")
+    
+    try:
+        resolve_model(requested)
+        options = {}
+        if language:
+            options["language"] = language
+        
+        # 16 kHz mono float32, decoded in memory
+        with metrics.stage("decode"):
+            audio_data = decode_pool.run(decode_audio, data, whisper.audio.SAMPLE_RATE)
+        duration = len(audio_data) / whisper.audio.SAMPLE_RATE
+        name = resolve_model(requested, duration)
+        
+        vad = use_vad(request.form.get("vad"))
+        pooled = vad and WORKERS > 1
+        # Load and take the model's lock before timing, so routing learns inference speed
+        # rather than load time or the wait behind other requests
+        pools.get(name) if pooled else get_model(name)
+        with metrics.stage("inference"), nullcontext() if pooled else model_lock(name):
+            start = time.perf_counter()
+            if vad:
+                result = vad_transcribe(audio_data, options, name)
+            else:
+                result = get_model(name).transcribe(audio_data, **options)
+            elapsed = time.perf_counter() - start
+        router.record(name, duration, elapsed)
+        
+        response = jsonify({
+            "text": result["text"],
+            "segments": result["segments"],
+            "language": result.get("language", "unknown")
+        })
+        response.headers["X-Whisper-Model"] = name
+        return response
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def spool_upload(audio):
+    # Windows are decoded by seeking, which needs the upload on disk rather than in a pipe
+    suffix = os.path.splitext(audio.filename or "")[1] or ".media"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
+        audio.save(f)
+    return f.name
+
+def media_path(path):
+    if not MEDIA_ROOTS:
+        raise ValueError("Local paths are disabled; set WHISPER_MEDIA_ROOTS to allow them")
+    real_path = os.path.realpath(path)
+    if not any(real_path.startswith(root + os.sep) for root in MEDIA_ROOTS):
+        raise ValueError("Path is outside WHISPER_MEDIA_ROOTS")
+    if not os.path.isfile(real_path):
+        raise ValueError(f"File not found: {path}")
+    return real_path
+
+def detection_windows(value):
+    windows = int(value if value not in (None, "") else DETECT_WINDOWS)
+    if not 1 <= windows <= DETECT_MAX_WINDOWS:
+        raise ValueError(f"windows must be between 1 and {DETECT_MAX_WINDOWS}")
+    return windows
+
+def detect_languages(paths, windows=1, name=None):
+    """Language of each file from up to `windows` 30s windows; one result or {"error"} per path."""
+    model = get_model(name)
+    
+    plan = []
+    for i, path in enumerate(paths):
+        duration = media_duration(path) if windows > 1 else None
+        plan.extend((i, offset) for offset in window_offsets(duration, windows))
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-        audio.save(f.name)
+    def decode_window(item):
+        i, offset = item
         try:
-            options = {}
-            if language:
-                options["language"] = language
-            
-            result = model.transcribe(f.name, **options)
-            return jsonify({
-                "text": result["text"],
-                "segments": result["segments"],
-                "language": result.get("language", "unknown")
-            })
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-        finally:
-            os.unlink(f.name)
+            return decode_audio_file(paths[i], whisper.audio.SAMPLE_RATE, 1, offset, WINDOW_SECONDS)
+        except ValueError as e:
+            return e
+    
+    with metrics.stage("decode"):
+        clips = list(decode_pool.map(decode_window, plan))
+    decoded = [(item, clip) for item, clip in zip(plan, clips) if not isinstance(clip, Exception)]
+    with metrics.stage("inference"), model_lock(name):
+        probs = detect_batch(model, [clip for _, clip in decoded])
+    
+    per_file = [[] for _ in paths]
+    for ((i, offset), clip), p in zip(decoded, probs):
+        per_file[i].append((offset, clip, p))
+    
+    results = []
+    for i, windows_found in enumerate(per_file):
+        if not windows_found:
+            error = next(clip for (j, _), clip in zip(plan, clips) if j == i)
+            results.append({"error": str(error)})
+            continue
+        result = summarize(combine([p for _, _, p in windows_found], [clip for _, clip, _ in windows_found]))
+        if windows > 1:
+            result["windows"] = [
+                {"offset": offset, **{k: v for k, v in summarize(p, top=1).items() if k != "all_probabilities"}}
+                for offset, _, p in windows_found
+            ]
+        results.append(result)
+    return results
 
 @app.route("/detect-language", methods=["POST"])
+@gates.admit(requested_model)
 def detect_language():
-    global model
-    if model is None:
-        model = whisper.load_model(model_name)
+    # Audio is a multipart "audio" file or a "path" to media on this host
+    params = request.form if request.files or request.form else (request.get_json(silent=True) or {})
+    upload = None
+    try:
+        windows = detection_windows(params.get("windows"))
+        if "audio" in request.files:
+            upload = path = spool_upload(request.files["audio"])
+        elif params.get("path"):
+            path = media_path(params["path"])
+        else:
+            return jsonify({"error": "No audio file provided"}), 400
+        
+        result = detect_languages([path], windows, resolve_model(params.get("model")))[0]
+        if "error" in result:
+            return jsonify(result), 400
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if upload:
+            os.remove(upload)
+
+@app.route("/detect-language/batch", methods=["POST"])
+@gates.admit(requested_model)
+def detect_language_batch():
+    # Many "audio" files and/or "paths" in one call; windows of all files share encoder batches
+    params = request.form if request.files or request.form else (request.get_json(silent=True) or {})
+    files = request.files.getlist("audio")
+    paths = request.form.getlist("paths") if request.form else list(params.get("paths") or [])
+    if not files and not paths:
+        return jsonify({"error": "No audio files or paths provided"}), 400
+    if len(files) + len(paths) > DETECT_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {DETECT_BATCH_MAX_ITEMS} items per batch"}), 400
     
-    if "audio" not in request.files:
-        return jsonify({"error": "No audio file provided"}), 400
+    uploads = []
+    try:
+        windows = detection_windows(params.get("windows"))
+        name = resolve_model(params.get("model"))
+        names, resolved, errors = [], [], {}
+        for audio in files:
+            uploads.append(spool_upload(audio))
+            names.append(audio.filename)
+            resolved.append(uploads[-1])
+        for path in paths:
+            names.append(path)
+            try:
+                resolved.append(media_path(path))
+            except ValueError as e:
+                errors[len(resolved)] = str(e)
+                resolved.append(None)
+        
+        found = [path for path in resolved if path is not None]
+        detected = iter(detect_languages(found, windows, name) if found else [])
+        results = [
+            {"name": name, "error": errors[i]} if path is None else {"name": name, **next(detected)}
+            for i, (name, path) in enumerate(zip(names, resolved))
+        ]
+        return jsonify({"results": results, "windows": windows})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        for upload in uploads:
+            os.remove(upload)
+
+@app.route("/transcribe/stream", methods=["POST"])
+@gates.admit(requested_model)
+def transcribe_stream():
+    # Segments are sent as they are decoded, as NDJSON lines or Server-Sent Events.
+    # Audio is either a multipart "audio" file or the raw request body; a raw body
+    # (ideally sent with chunked transfer encoding) is decoded while it is still uploading.
+    language = request.values.get("language") or None
+    format = request.values.get("format") or ("sse" if "text/event-stream" in request.headers.get("Accept", "") else "ndjson")
+    if format not in ("ndjson", "sse"):
+        return jsonify({"error": "format must be ndjson or sse"}), 400
+    requested = request.values.get("model")
     
-    audio = request.files["audio"]
+    try:
+        if "audio" in request.files:
+            # An upload is already complete, so its duration is known for model=auto
+            with metrics.stage("decode"):
+                audio = [decode_pool.run(decode_audio, request.files["audio"].read(), whisper.audio.SAMPLE_RATE)]
+            name = resolve_model(requested, len(audio[0]) / whisper.audio.SAMPLE_RATE)
+        elif request.mimetype in ("", "multipart/form-data", "application/x-www-form-urlencoded"):
+            return jsonify({"error": "No audio file provided"}), 400
+        else:
+            audio = iter_audio(request.stream, whisper.audio.SAMPLE_RATE, whisper.audio.SAMPLE_RATE)
+            name = resolve_model(requested)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-        audio.save(f.name)
+    def generate():
         try:
-            audio_data = whisper.load_audio(f.name)
-            audio_data = whisper.pad_or_trim(audio_data)
-            mel = whisper.log_mel_spectrogram(audio_data).to(model.device)
-            _, probs = model.detect_language(mel)
+            model = get_model(name)
             
-            detected = max(probs, key=probs.get)
-            return jsonify({
-                "language": detected,
-                "confidence": probs[detected],
-                "all_probabilities": dict(sorted(probs.items(), key=lambda x: x[1], reverse=True)[:5])
-            })
+            def locked_transcribe(*args, **kwargs):
+                with model_lock(name):
+                    return model.transcribe(*args, **kwargs)
+            
+            transcribe = metrics.timed("inference", locked_transcribe)
+            for event in stream_segments(transcribe, audio, whisper.audio.SAMPLE_RATE, STREAM_WINDOW, language):
+                yield format_event(event, format)
         except Exception as e:
-            return jsonify({"error": str(e)}), 500
-        finally:
-            os.unlink(f.name)
+            yield format_event({"type": "error", "error": str(e)}, format)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream" if format == "sse" else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Whisper-Model": name}
+    )
 
 if __name__ == "__main__":
-    print(f"Starting Whisper API server with model: {model_name}")
+    print(f"Starting Whisper API server with model: {DEFAULT_MODEL} (available: {', '.join(MODELS)})")
+    start_warmup()
     print("Listening on http://0.0.0.0:9000")
     app.run(host="0.0.0.0", port=9000)
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import torch
+from common.model_cache import ModelCache
+
+KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def audio_key(data, *parts):
+    """Hash of the reference audio bytes plus anything else the latents depend on (the model)."""
+    h = hashlib.sha256(data)
+    for part in parts:
+        h.update(b"\0" + str(part).encode())
+    return h.hexdigest()
+
+
+def latent_bytes(latents):
+    return sum(t.numel() * t.element_size() for t in latents)
+
+
+class SpeakerLatents:
+    """XTTS conditioning latents (gpt_cond_latent, speaker_embedding) per reference audio.
+
+    The memory tier is a ModelCache, so concurrent requests for a speaker that
+    is still being processed share one computation. Misses are read from
+    `<directory>/<key>.pt` and only computed from the audio when that is
+    missing too; computed latents are written back to disk for later runs.
+    """
+
+    def __init__(self, compute, directory, budget_bytes=64 << 20, device="cpu"):
+        self.compute = compute
+        self.directory = directory
+        self.device = device
+        self.computed = 0
+        self.disk_hits = 0
+        self._sources = {}
+        self._lock = threading.Lock()
+        self.memory = ModelCache(self._load, budget_bytes, name="speaker-latents", size_of=latent_bytes)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pt")
+
+    def get(self, key, source=None):
+        """Latents for `key`, computed from `source` (a file path or audio bytes) if not cached.
+
+        Raises KeyError when the latents are unknown and no source is given.
+        """
+        # Keys can come from clients as speaker ids and end up in a file path
+        if not KEY_PATTERN.fullmatch(key):
+            raise KeyError(key)
+        if source is not None:
+            with self._lock:
+                self._sources[key] = source
+        try:
+            return self.memory.get(key)
+        finally:
+            if source is not None:
+                with self._lock:
+                    if self._sources.get(key) is source:
+                        del self._sources[key]
+
+    def has(self, key):
+        if not KEY_PATTERN.fullmatch(key):
+            return False
+        return self.memory.is_loaded(key) or os.path.exists(self._path(key))
+
+    def _load(self, key):
+        path = self._path(key)
+        if os.path.exists(path):
+            try:
+                saved = torch.load(path, map_location=self.device, weights_only=True)
+                self.disk_hits += 1
+                return saved["gpt_cond_latent"], saved["speaker_embedding"]
+            except Exception as e:
+                print(f"Ignoring unreadable speaker latents {path}: {e}")
+
+        with self._lock:
+            source = self._sources.get(key)
+        if source is None:
+            raise KeyError(key)
+
+        if isinstance(source, bytes):
+            # The model only reads reference audio from a path
+            with tempfile.NamedTemporaryFile(suffix=".wav") as f:
+                f.write(source)
+                f.flush()
+                latents = self.compute(f.name)
+        else:
+            latents = self.compute(source)
+        self.computed += 1
+        self._save(key, latents)
+        return latents
+
+    def _save(self, key, latents):
+        gpt_cond_latent, speaker_embedding = latents
+        path = self._path(key)
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            torch.save({"gpt_cond_latent": gpt_cond_latent.cpu(), "speaker_embedding": speaker_embedding.cpu()}, partial)
+            os.replace(partial, path)
+        except OSError as e:
+            print(f"Could not store speaker latents {path}: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def stats(self):
+        memory = self.memory.stats()
+        try:
+            on_disk = sum(1 for name in os.listdir(self.directory) if name.endswith(".pt"))
+        except OSError:
+            on_disk = 0
+        return {
+            "in_memory": len(memory["loaded"]),
+            "bytes": memory["bytes"],
+            "budget_bytes": memory["budget_bytes"],
+            "hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "computed": self.computed,
+            "on_disk": on_disk
+        }
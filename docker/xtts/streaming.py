@@ -0,0 +1,53 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+def pipelined(fn, items, ahead=1):
+    """Yield fn(item) for each item in order while the next ones are computed in a background thread.
+
+    At most `ahead` finished results wait for the consumer. Closing the
+    generator (a client that disconnects) stops the thread after the item it
+    is working on and waits for that, so whoever releases the model after
+    the close really finds it idle; an exception from `fn` is raised in the
+    consumer.
+    """
+    results = queue.Queue(maxsize=max(1, ahead))
+    stop = threading.Event()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                results.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        for item in items:
+            if stop.is_set():
+                return
+            try:
+                result = (fn(item), None)
+            except Exception as e:
+                put((None, e))
+                return
+            if not put(result):
+                return
+        put((_DONE, None))
+
+    thread = threading.Thread(target=produce, name="xtts-stream", daemon=True)
+    thread.start()
+    try:
+        while True:
+            value, error = results.get()
+            if error is not None:
+                raise error
+            if value is _DONE:
+                return
+            yield value
+    finally:
+        stop.set()
+        thread.join()
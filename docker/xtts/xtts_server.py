@@ -1,15 +1,186 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from TTS.api import TTS
+from common.request_io import wav_bytes, send_bytes, wav_header, pcm16
+from common.model_cache import ModelCache
+from common.serving import Gates
+from common.metrics import Metrics
+from speaker_latents import SpeakerLatents, audio_key
+from streaming import pipelined
+from werkzeug.utils import secure_filename
+import numpy as np
+import io
+import zipfile
+import threading
 import tempfile
 import os
 import torch
 
 app = Flask(__name__)
 CORS(app)
+metrics = Metrics(app, "xtts")
 
-tts = None
 model_name = os.environ.get("TTS_MODEL", "tts_models/multilingual/multi-dataset/xtts_v2")
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+SPEAKERS_DIR = os.environ.get("XTTS_SPEAKERS_DIR", "/app/speakers")
+SPEAKER_EXTENSIONS = (".wav", ".mp3", ".ogg")
+# Inside the model volume, so computed latents survive container rebuilds
+LATENTS_DIR = os.environ.get("XTTS_LATENTS_DIR", "/root/.local/share/tts/speaker_latents")
+LATENTS_MEMORY_MB = int(os.environ.get("XTTS_LATENTS_MEMORY_MB", "64"))
+PRECOMPUTE_SPEAKERS = os.environ.get("XTTS_PRECOMPUTE_SPEAKERS", "1") == "1"
+# Silence TTS.api puts between sentences (samples at 24 kHz)
+SENTENCE_GAP = 10000
+# Sentences rendered ahead of the one being sent by /synthesize/stream
+STREAM_AHEAD = int(os.environ.get("XTTS_STREAM_AHEAD", "1"))
+BATCH_MAX_LINES = int(os.environ.get("XTTS_BATCH_MAX_LINES", "100"))
+
+def load_tts(name):
+    print(f"Loading XTTS model: {name}")
+    return TTS(name).to(device)
+
+# Single-flight: concurrent cold requests wait for one load instead of each loading the model
+models = ModelCache(load_tts, name="xtts")
+
+def get_tts():
+    return models.get(model_name)
+
+# Syntheses run one at a time by default; a short queue waits, the rest get a 429
+gates = Gates.from_env("XTTS", concurrency=1, queue_size=8)
+
+metrics.instrument_models(models)
+metrics.collect("admission", gates.stats, label="model")
+
+def supports_latents():
+    return hasattr(get_tts().synthesizer.tts_model, "get_conditioning_latents")
+
+def compute_latents(path):
+    # Same reference settings Xtts.full_inference uses when tts.tts() gets a speaker_wav
+    return get_tts().synthesizer.tts_model.get_conditioning_latents(
+        audio_path=[path],
+        gpt_cond_len=30,
+        gpt_cond_chunk_len=6,
+        max_ref_length=10,
+        sound_norm_refs=False
+    )
+
+latents = SpeakerLatents(metrics.timed("speaker_latents", compute_latents), LATENTS_DIR, LATENTS_MEMORY_MB << 20, device=device)
+metrics.collect("speaker_latents", latents.stats)
+
+# path -> ((mtime, size), key), so listing speakers does not re-hash unchanged files
+speaker_keys = {}
+
+def speaker_files():
+    if not os.path.isdir(SPEAKERS_DIR):
+        return {}
+    return {
+        os.path.splitext(f)[0]: os.path.join(SPEAKERS_DIR, f)
+        for f in sorted(os.listdir(SPEAKERS_DIR))
+        if f.endswith(SPEAKER_EXTENSIONS)
+    }
+
+def file_key(path):
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = speaker_keys.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    with open(path, "rb") as f:
+        key = audio_key(f.read(), model_name)
+    speaker_keys[path] = (version, key)
+    return key
+
+def resolve_speaker(speaker_id=None, speaker_wav=None):
+    """Latents for a speaker id (a file under /app/speakers or a key returned by /clone) or a reference path.
+    
+    Returns None for the default speaker; raises KeyError for an unknown id.
+    """
+    if speaker_id:
+        path = speaker_files().get(speaker_id)
+        if path:
+            return latents.get(file_key(path), path)
+        return latents.get(speaker_id)
+    if speaker_wav and os.path.exists(speaker_wav):
+        return latents.get(file_key(speaker_wav), speaker_wav)
+    return None
+
+def speaker_reference(speaker_id=None, speaker_wav=None):
+    """(latents, None) when the model takes cached latents, else (None, reference path or None).
+    
+    Raises KeyError for an unknown speaker id.
+    """
+    if supports_latents():
+        return resolve_speaker(speaker_id, speaker_wav), None
+    if speaker_id:
+        speaker_wav = speaker_files().get(speaker_id)
+        if not speaker_wav:
+            raise KeyError(speaker_id)
+    if speaker_wav and os.path.exists(speaker_wav):
+        return None, speaker_wav
+    return None, None
+
+def split_sentences(model, text):
+    split = getattr(model.synthesizer, "split_into_sentences", None)
+    return split(text) if split else [text]
+
+def sentence_audio(model, sentence, language, conditioning=None, speaker_wav=None):
+    """One sentence followed by the gap tts.tts() puts after it."""
+    if conditioning is not None:
+        config = model.synthesizer.tts_config
+        gpt_cond_latent, speaker_embedding = conditioning
+        out = model.synthesizer.tts_model.inference(
+            sentence,
+            language,
+            gpt_cond_latent,
+            speaker_embedding,
+            temperature=config.temperature,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            top_k=config.top_k,
+            top_p=config.top_p
+        )
+        wav = out["wav"]
+    elif speaker_wav:
+        wav = model.tts(text=sentence, speaker_wav=speaker_wav, language=language)
+    else:
+        wav = model.tts(text=sentence, language=language)
+    wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+    return np.concatenate([wav, np.zeros(SENTENCE_GAP, dtype=np.float32)])
+
+def synthesize_with_latents(model, text, language, conditioning):
+    """tts.tts() for a cloned voice, minus the reference-audio processing: same sentence split, sampling settings and gaps."""
+    wav = [sentence_audio(model, sentence, language, conditioning) for sentence in split_sentences(model, text)]
+    return np.concatenate(wav) if wav else np.zeros(0, dtype=np.float32)
+
+def render(model, text, language, conditioning=None, speaker_wav=None):
+    if conditioning is not None:
+        # Voice cloning from cached latents
+        return synthesize_with_latents(model, text, language, conditioning)
+    if speaker_wav:
+        # Voice cloning
+        return model.tts(
+            text=text,
+            speaker_wav=speaker_wav,
+            language=language
+        )
+    # Default speaker
+    return model.tts(
+        text=text,
+        language=language
+    )
+
+def precompute_speakers():
+    files = speaker_files()
+    if not files:
+        return
+    try:
+        if not supports_latents():
+            return
+        for name, path in files.items():
+            latents.get(file_key(path), path)
+        print(f"Speaker latents ready for {len(files)} speakers")
+    except Exception as e:
+        print(f"Precomputing speaker latents failed: {e}")
 
 @app.route("/health", methods=["GET"])
 def health():
@@ -17,17 +188,16 @@ def health():
         "status": "ok",
         "service": "xtts",
         "model": model_name,
-        "loaded": tts is not None,
-        "gpu": torch.cuda.is_available()
+        "loaded": models.is_loaded(model_name),
+        "gpu": torch.cuda.is_available(),
+        "speaker_latents": latents.stats(),
+        "admission": gates.stats()
     })
 
 @app.route("/synthesize", methods=["POST"])
+@gates.admit(model_name)
 def synthesize():
-    global tts
-    if tts is None:
-        print(f"Loading XTTS model: {model_name}")
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        tts = TTS(model_name).to(device)
+    model = get_tts()
     
     data = request.json
     if not data:
@@ -38,76 +208,205 @@ def synthesize():
         return jsonify({"error": "No text provided"}), 400
     
     language = data.get("language", "fr")
+    speaker_id = data.get("speaker_id")
     speaker_wav = data.get("speaker_wav")
     
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-            if speaker_wav and os.path.exists(speaker_wav):
-                # Voice cloning
-                tts.tts_to_file(
-                    text=text,
-                    speaker_wav=speaker_wav,
-                    language=language,
-                    file_path=f.name
-                )
-            else:
-                # Default speaker
-                tts.tts_to_file(
-                    text=text,
-                    language=language,
-                    file_path=f.name
-                )
-            
-            return send_file(f.name, mimetype="audio/wav", as_attachment=True, download_name="speech.wav")
+        conditioning, speaker_wav = speaker_reference(speaker_id, speaker_wav)
+    except KeyError:
+        return jsonify({"error": f"Unknown speaker: {speaker_id}"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    try:
+        with metrics.stage("inference"):
+            wav = render(model, text, language, conditioning, speaker_wav)
+        
+        # Rendered and encoded in memory, same peak normalisation as tts_to_file
+        with metrics.stage("encode"):
+            audio = wav_bytes(wav, model.synthesizer.output_sample_rate, normalize=True)
+        return send_bytes(audio, mimetype="audio/wav", download_name="speech.wav")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/synthesize/stream", methods=["POST"])
+@gates.admit(model_name)
+def synthesize_stream():
+    """Sentence by sentence: each sentence is sent as soon as it is rendered while the next one is generated."""
+    model = get_tts()
+    
+    data = request.json
+    if not data:
+        return jsonify({"error": "No JSON data provided"}), 400
+    
+    text = data.get("text", "")
+    if not text:
+        return jsonify({"error": "No text provided"}), 400
+    
+    format = data.get("format", "wav")
+    if format not in ("wav", "pcm"):
+        return jsonify({"error": "format must be wav or pcm"}), 400
+    
+    language = data.get("language", "fr")
+    speaker_id = data.get("speaker_id")
+    
+    try:
+        conditioning, speaker_wav = speaker_reference(speaker_id, data.get("speaker_wav"))
+    except KeyError:
+        return jsonify({"error": f"Unknown speaker: {speaker_id}"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    sentences = split_sentences(model, text)
+    sample_rate = int(model.synthesizer.output_sample_rate)
+    # Sentences render on a worker thread, outside the request context
+    endpoint = metrics.endpoint()
+    
+    def render_sentence(sentence):
+        with metrics.stage("inference", endpoint):
+            wav = sentence_audio(model, sentence, language, conditioning, speaker_wav)
+        with metrics.stage("encode", endpoint):
+            return pcm16(wav)
+    
+    def generate():
+        if format == "wav":
+            yield wav_header(sample_rate)
+        try:
+            yield from pipelined(render_sentence, sentences, STREAM_AHEAD)
+        except Exception as e:
+            # Headers are gone; all that is left is ending the stream early
+            print(f"Streaming synthesis failed: {e}")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="audio/wav" if format == "wav" else f"audio/L16;rate={sample_rate};channels=1",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Sample-Rate": str(sample_rate),
+            "X-Sentences": str(len(sentences))
+        }
+    )
+
+@app.route("/synthesize/batch", methods=["POST"])
+@gates.admit(model_name)
+def synthesize_batch():
+    """Many independent lines in one request, returned as a zip with one WAV per line."""
+    model = get_tts()
+    
+    data = request.json
+    if not data:
+        return jsonify({"error": "No JSON data provided"}), 400
+    
+    lines = data.get("lines")
+    if not lines or not isinstance(lines, list):
+        return jsonify({"error": "No lines provided"}), 400
+    if len(lines) > BATCH_MAX_LINES:
+        return jsonify({"error": f"At most {BATCH_MAX_LINES} lines per request"}), 400
+    
+    # Each line is a string or an object overriding the request's language and speaker
+    jobs = []
+    for i, line in enumerate(lines):
+        if isinstance(line, str):
+            line = {"text": line}
+        if not isinstance(line, dict) or not line.get("text"):
+            return jsonify({"error": f"Line {i} has no text"}), 400
+        name = secure_filename(str(line.get("name", ""))) or f"{i + 1:03d}"
+        jobs.append({
+            "filename": f"{name}.wav",
+            "text": line["text"],
+            "language": line.get("language", data.get("language", "fr")),
+            "speaker": (line.get("speaker_id", data.get("speaker_id")), line.get("speaker_wav", data.get("speaker_wav")))
+        })
+    if len({job["filename"] for job in jobs}) < len(jobs):
+        return jsonify({"error": "Line names must be unique"}), 400
+    
+    # Every speaker is resolved once, before anything is rendered
+    references = {}
+    try:
+        for job in jobs:
+            if job["speaker"] not in references:
+                references[job["speaker"]] = speaker_reference(*job["speaker"])
+    except KeyError as e:
+        return jsonify({"error": f"Unknown speaker: {e.args[0]}"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    try:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zipf:
+            for job in jobs:
+                with metrics.stage("inference"):
+                    wav = render(model, job["text"], job["language"], *references[job["speaker"]])
+                with metrics.stage("encode"):
+                    zipf.writestr(job["filename"], wav_bytes(wav, model.synthesizer.output_sample_rate, normalize=True))
+        return send_bytes(buffer.getvalue(), mimetype="application/zip", download_name="speech.zip")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route("/clone", methods=["POST"])
+@gates.admit(model_name)
 def clone_voice():
-    global tts
-    if tts is None:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        tts = TTS(model_name).to(device)
+    model = get_tts()
     
     if "audio" not in request.files:
         return jsonify({"error": "No audio file provided"}), 400
     
     text = request.form.get("text", "")
     language = request.form.get("language", "fr")
-    audio = request.files["audio"]
+    audio = request.files["audio"].read()
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as speaker_file:
-        audio.save(speaker_file.name)
-        
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as output_file:
-                tts.tts_to_file(
-                    text=text,
-                    speaker_wav=speaker_file.name,
-                    language=language,
-                    file_path=output_file.name
-                )
-                return send_file(output_file.name, mimetype="audio/wav", as_attachment=True, download_name="cloned_speech.wav")
-        finally:
-            os.unlink(speaker_file.name)
+    try:
+        if supports_latents():
+            # Keyed by the audio itself: cloning the same clip again reuses its latents,
+            # and the key can be sent as speaker_id to /synthesize afterwards
+            speaker_id = audio_key(audio, model_name)
+            conditioning = latents.get(speaker_id, audio)
+            with metrics.stage("inference"):
+                wav = synthesize_with_latents(model, text, language, conditioning)
+        else:
+            speaker_id = None
+            # The TTS API only reads reference audio from a path; the output stays in memory
+            with tempfile.NamedTemporaryFile(suffix=".wav") as speaker_file:
+                speaker_file.write(audio)
+                speaker_file.flush()
+                with metrics.stage("inference"):
+                    wav = model.tts(
+                        text=text,
+                        speaker_wav=speaker_file.name,
+                        language=language
+                    )
+        with metrics.stage("encode"):
+            audio_data = wav_bytes(wav, model.synthesizer.output_sample_rate, normalize=True)
+        response = send_bytes(audio_data, mimetype="audio/wav", download_name="cloned_speech.wav")
+        if speaker_id:
+            response.headers["X-Speaker-Id"] = speaker_id
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @app.route("/speakers", methods=["GET"])
 def list_speakers():
-    speakers_dir = "/app/speakers"
     speakers = []
     
-    if os.path.exists(speakers_dir):
-        for f in os.listdir(speakers_dir):
-            if f.endswith((".wav", ".mp3", ".ogg")):
-                speakers.append({
-                    "name": os.path.splitext(f)[0],
-                    "path": os.path.join(speakers_dir, f)
-                })
+    for name, path in speaker_files().items():
+        try:
+            cached = latents.has(file_key(path))
+        except OSError:
+            cached = False
+        speakers.append({
+            "id": name,
+            "name": name,
+            "path": path,
+            "latents_cached": cached
+        })
     
     return jsonify({"speakers": speakers})
 
 if __name__ == "__main__":
     print(f"Starting XTTS API server with model: {model_name}")
     print(f"GPU available: {torch.cuda.is_available()}")
+    if PRECOMPUTE_SPEAKERS:
+        threading.Thread(target=precompute_speakers, name="speaker-latents", daemon=True).start()
     print("Listening on http://0.0.0.0:8020")
     app.run(host="0.0.0.0", port=8020)